@@ -0,0 +1,70 @@
+"""
+Compare plain and assisted decoding of the story model on this machine.
+
+    python -m benchmarks.assisted --draft /models/tiny-draft --max-new-tokens 128
+
+Uses the story model from config/config.yaml and the draft from `--draft` (or
+`assisted_decoding.draft_model_path`). Reports tokens/sec with and without the
+draft, the speedup and the draft accept rate.
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from scripts import utils as util
+from scripts.assisted import AssistedDecoder
+from benchmarks.precision import PROMPTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--draft", help="draft model path (default: assisted_decoding.draft_model_path)")
+    parser.add_argument("--num-assistant-tokens", type=int, default=5)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--greedy", action="store_true", help="greedy decoding instead of the API's sampling")
+    args = parser.parse_args()
+
+    config = util.get_config()
+    if args.draft:
+        config["assisted_decoding"] = {**(config.get("assisted_decoding") or {}), "draft_model_path": args.draft}
+    tokenizer, model = util.load_tokenizer(config), util.load_model(config)
+    draft_model = util.load_draft_model(config)
+    if draft_model is None:
+        parser.error("no draft model: pass --draft or set assisted_decoding.draft_model_path")
+    assistant = AssistedDecoder(model, draft_model, num_assistant_tokens=args.num_assistant_tokens)
+
+    sampling = {"do_sample": False} if args.greedy else {
+        "do_sample": True, "temperature": util.TEMPERATURE, "top_p": util.TOP_P,
+    }
+    totals = {"plain": [0, 0.0], "assisted": [0, 0.0]}
+    for req in PROMPTS:
+        text = util.chat_text(util.build_prompt(req, max_new_tokens=args.max_new_tokens), tokenizer)
+        inputs = tokenizer(text, return_tensors="pt").to(model.device)
+        for mode in ("plain", "assisted"):
+            torch.manual_seed(0)
+            start = time.perf_counter()
+            with torch.no_grad():
+                if mode == "plain":
+                    output = model.generate(**inputs, max_new_tokens=args.max_new_tokens, **sampling)
+                else:
+                    output = assistant.generate(inputs, max_new_tokens=args.max_new_tokens, **sampling)
+            totals[mode][0] += output.shape[1] - inputs["input_ids"].shape[1]
+            totals[mode][1] += time.perf_counter() - start
+
+    rates = {mode: n / seconds for mode, (n, seconds) in totals.items()}
+    stats = assistant.stats()
+    print(json.dumps({
+        "plain_tokens_per_sec": round(rates["plain"], 2),
+        "assisted_tokens_per_sec": round(rates["assisted"], 2),
+        "speedup": round(rates["assisted"] / rates["plain"], 3),
+        "accept_rate": stats["accept_rate"],
+        "proposed_tokens": stats["proposed_tokens"],
+        "accepted_tokens": stats["accepted_tokens"],
+        "fallbacks": stats["fallbacks"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
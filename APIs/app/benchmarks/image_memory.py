@@ -0,0 +1,151 @@
+"""
+Compare low-memory diffusion options (image_model.low_memory) on this machine.
+
+    python -m benchmarks.image_memory --tiny --side 1536 --tier preview --budget-mb 4096
+    python -m benchmarks.image_memory --variants baseline all --side 2048
+
+Each variant builds the pipeline in a fresh process, so peak resident memory is not
+skewed by the previous one. Per variant: latency (median of --repeats renders at
+--side pixels with the --tier's scheduler and steps), peak RSS after loading and after rendering, the peak added by
+rendering, peak GPU memory when on CUDA, and the mean absolute pixel difference from
+the baseline render. With --budget-mb each variant is checked against that peak.
+`--tiny` uses the tiny local pipeline (see benchmarks/tiny_models.py), otherwise the
+pipeline from config/config.yaml.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from scripts import utils as util
+from scripts.image_io import decode_upload
+from scripts.pipelines import configure_image_pipelines
+from benchmarks.image_tiers import synthetic_upload
+from benchmarks.tiny_models import ensure_tiny_models, tiny_config
+
+VARIANTS = {
+    "baseline": None,
+    "attention_slicing": {"attention_slicing": "auto", "vae_tiling": False, "vae_slicing": False},
+    "vae_tiling": {"attention_slicing": False, "vae_tiling": True, "vae_slicing": False},
+    "all": True,
+    # GPU only: weights stay in CPU RAM and move to the GPU per model / per submodule
+    "offload_model": {"offload": "model"},
+    "offload_sequential": {"offload": "sequential"},
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(config, name, side, repeats, tier=None):
+    """Build the pipeline with one low_memory setting and render `repeats` times at `side` pixels with a tier's steps."""
+    config = {**config, "image_model": {**config["image_model"], "low_memory": VARIANTS[name], "warmup": True}}
+    start = time.perf_counter()
+    configure_image_pipelines(config)
+    load_s = time.perf_counter() - start
+    peak_after_load = peak_rss_mb()
+    cuda = torch.cuda.is_available() and config["image_model"].get("device", "cuda").startswith("cuda")
+    if cuda:
+        torch.cuda.reset_peak_memory_stats()
+
+    params = dict(util.image_params(config, tier))
+    params.pop("scale", None)
+    image = decode_upload(synthetic_upload(side, side), max_side=side)
+    prompt = "Pixel Art game visual, retro style for maps."
+    times, out = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = util.model_generation_image(prompt, image, **params)
+        times.append(time.perf_counter() - start)
+    pixels = np.asarray(out, dtype=np.uint8)
+    return {
+        "variant": name,
+        "size": list(out.size),
+        "load_s": round(load_s, 3),
+        "p50_s": round(statistics.median(times), 3),
+        "peak_rss_after_load_mb": round(peak_after_load, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "render_peak_mb": round(peak_rss_mb() - peak_after_load, 1),
+        "peak_gpu_mb": round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1) if cuda else None,
+        # Raw bytes cross the pipe; a list of Python ints is several times the image
+        "pixels": pixels.tobytes(),
+        "shape": list(pixels.shape),
+    }
+
+
+def result_pixels(result):
+    """The rendered image of a run_variant result as a float32 array."""
+    return np.frombuffer(result["pixels"], dtype=np.uint8).reshape(result["shape"]).astype(np.float32)
+
+
+def _child(conn, config, name, side, repeats, tier):
+    try:
+        conn.send(run_variant(config, name, side, repeats, tier))
+    except Exception as e:
+        conn.send({"variant": name, "error": f"{type(e).__name__}: {e}"})
+    conn.close()
+
+
+def run_isolated(config, name, side, repeats, tier=None):
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(child, config, name, side, repeats, tier))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS),
+                        help="low_memory settings; the first is the pixel-difference reference "
+                             "(default: every variant that runs on this device)")
+    parser.add_argument("--side", type=int, default=1536, help="render size in pixels (square)")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--tier", help="quality tier whose scheduler and steps are used (its scale is ignored)")
+    parser.add_argument("--budget-mb", type=float, help="report whether each variant's peak RSS fits this budget")
+    parser.add_argument("--tiny", action="store_true", help="use the tiny local pipeline on CPU")
+    parser.add_argument("--models-dir", default=os.path.join(tempfile.gettempdir(), "ai-api-tiny"))
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    if args.tiny:
+        config = tiny_config(ensure_tiny_models(args.models_dir))
+    else:
+        config = util.get_config()
+    variants = args.variants or [
+        name for name, options in VARIANTS.items()
+        if not (isinstance(options, dict) and options.get("offload")) or torch.cuda.is_available()
+    ]
+
+    results = [run_isolated(config, name, args.side, args.repeats, args.tier) for name in variants]
+    reference = next((r for r in results if "error" not in r), None)
+    report = []
+    for result in results:
+        row = {k: v for k, v in result.items() if k not in ("pixels", "shape")}
+        if "error" not in result:
+            diff = np.abs(result_pixels(result) - result_pixels(reference))
+            row["mean_abs_diff"] = round(float(diff.mean()), 3)
+            if args.budget_mb:
+                row["within_budget"] = result["peak_rss_mb"] <= args.budget_mb
+        report.append(row)
+
+    text = json.dumps({"side": args.side, "reference": reference and reference["variant"], "variants": report}, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare image quality tiers (scheduler, steps, resolution) on this machine.
+
+    python -m benchmarks.image_tiers --tiny --repeats 5
+    python -m benchmarks.image_tiers --tiers preview final
+
+`--tiny` builds and uses the tiny local img2img pipeline (see benchmarks/tiny_models.py),
+so tiers can be compared on CPU without downloading weights; otherwise the pipeline from
+config/config.yaml is used. Per tier: median and p95 latency of decode + diffusion,
+output size, and the mean absolute pixel difference from the last tier listed
+(resized to its size), a rough proxy for how far a preview is from the final render.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from scripts import utils as util
+from scripts.image_io import decode_upload
+from scripts.pipelines import configure_image_pipelines
+from benchmarks.tiny_models import ensure_tiny_models, tiny_config
+
+
+def synthetic_upload(width=1024, height=768, seed=0):
+    """A smooth random JPEG, closer to a photo than white noise."""
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray((rng.random((12, 16, 3)) * 255).astype("uint8"))
+    buf = BytesIO()
+    small.resize((width, height), Image.Resampling.BICUBIC).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def run_tier(params, upload, prompt, max_side, repeats):
+    params = dict(params)
+    side = round(max_side * params.pop("scale", 1.0))
+    times, image = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        img = decode_upload(upload, max_side=side)
+        image = util.model_generation_image(prompt, img, **params)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return image, {
+        "scheduler": params["scheduler"],
+        "steps": params["num_inference_steps"],
+        "size": list(image.size),
+        "p50_s": round(statistics.median(times), 3),
+        "p95_s": round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiers", nargs="+", help="tier names, reference last (default: every configured tier)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tiny", action="store_true", help="use the tiny local pipeline on CPU")
+    parser.add_argument("--models-dir", default=os.path.join(tempfile.gettempdir(), "ai-api-tiny"))
+    args = parser.parse_args()
+
+    if args.tiny:
+        config = tiny_config(ensure_tiny_models(args.models_dir))
+    else:
+        config = util.get_config()
+    configure_image_pipelines(config)
+    tiers = args.tiers or list(util.image_tiers(config))
+    max_side = (config.get("image_io") or {}).get("max_side") or util.image_target_side()
+    upload = synthetic_upload()
+    prompt = "Pixel Art game visual, retro style for maps."
+
+    # One untimed render so pipeline build and first-call allocations are not counted
+    run_tier(util.image_params(config, tiers[0]), upload, prompt, max_side, 1)
+    images, report = {}, {}
+    for tier in tiers:
+        images[tier], report[tier] = run_tier(util.image_params(config, tier), upload, prompt, max_side, args.repeats)
+
+    reference = images[tiers[-1]]
+    ref = np.asarray(reference, dtype=np.float32)
+    for tier in tiers:
+        img = images[tier].resize(reference.size, Image.Resampling.BICUBIC)
+        report[tier]["mean_abs_diff"] = round(float(np.abs(np.asarray(img, dtype=np.float32) - ref).mean()), 2)
+        report[tier]["speedup"] = round(report[tiers[-1]]["p50_s"] / report[tier]["p50_s"], 2)
+    print(json.dumps({"reference": tiers[-1], "max_side": max_side, "tiers": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Load test the API end to end against tiny local stand-in models (no network, no GPU).
+
+    python -m benchmarks.loadtest --concurrency 8 --requests 200 --mix story=6,story_stream=1,image=3 \\
+        --out loadtest.json
+    # after a change, against the report from before it
+    python -m benchmarks.loadtest --concurrency 8 --requests 200 --mix story=6,story_stream=1,image=3 \\
+        --baseline loadtest.json
+
+Builds the tiny models (see benchmarks/tiny_models.py), writes a config pointing at
+them, starts uvicorn (or a model host plus `--workers` uvicorn workers) and drives
+the request mix at fixed concurrency. Request kinds and payloads come from `--seed`,
+so runs are repeatable. Caches are off unless `--cache` is given.
+
+The JSON report has p50/p95/p99 latency, throughput and error rate per endpoint and
+overall, time-to-first-event for streams, and peak RSS of the server processes.
+With `--baseline` every metric is compared against the report of an earlier run on the
+same machine (none is committed, timings are machine specific). Latency and RSS regress
+when they grow by more than `--tolerance`, throughput when it drops by more than that,
+and error rate when it grows by more than one point. Regressions exit with status 1.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import psutil
+import yaml
+from PIL import Image
+
+from benchmarks.tiny_models import ensure_tiny_models, tiny_config
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KINDS = ("story", "story_stream", "image")
+GENRES = ["Puzzle", "Strategy", "Survival", "Platform", "Role Playing"]
+TONES = ["Serious", "Humorous", "Dramatic", "Magic"]
+PLOTS = ["In Search of Treasure", "The Return to Home", "Within the Labyrinth", ""]
+TECHNOLOGIES = ["Pixel Art", "2D Illustration", "Vectorised", "Voxels"]
+STYLES = ["Retro style", "Cartoon style", "Minimalistic style"]
+# Lower is better for these; throughput is higher-is-better; error_rate is compared in absolute points
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r}, expected one of {KINDS}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class RssSampler(threading.Thread):
+    """Polls the summed RSS of the server processes and their children; keeps the peak."""
+
+    def __init__(self, procs, interval=0.05):
+        super().__init__(daemon=True)
+        self.procs = [psutil.Process(p.pid) for p in procs]
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def sample(self):
+        total = 0
+        for proc in self.procs:
+            try:
+                for p in [proc, *proc.children(recursive=True)]:
+                    total += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak = max(self.peak, total)
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.sample()
+
+
+def start_server(config_path, port, workers, log):
+    env = {**os.environ, "APP_CONFIG": config_path, "CUDA_VISIBLE_DEVICES": "", "HF_HUB_OFFLINE": "1"}
+    procs = []
+    if workers > 1:
+        sock = os.path.join(os.path.dirname(config_path), "models.sock")
+        env["MODEL_HOST_SOCKET"] = sock
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "scripts.model_host", "--socket", sock], cwd=APP_DIR, env=env, stdout=log, stderr=log,
+        ))
+        deadline = time.time() + 120
+        while not os.path.exists(sock) and time.time() < deadline:
+            time.sleep(0.1)
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    procs.append(subprocess.Popen(cmd, cwd=APP_DIR, env=env, stdout=log, stderr=log))
+    return procs
+
+
+def wait_ready(base_url, procs, timeout=300):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if any(p.poll() is not None for p in procs):
+            raise RuntimeError("server exited during startup, see the server log")
+        try:
+            if httpx.get(base_url + "/health/ready", timeout=2).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("server did not become ready")
+
+
+def build_plan(mix, n, seed):
+    """Deterministic list of (kind, payload) for the whole run."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    plan = []
+    for i in range(n):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "image":
+            buf = io.BytesIO()
+            Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(buf, format="PNG")
+            req = {"technology": rng.choice(TECHNOLOGIES), "char_env_item": rng.choice(STYLES)}
+            plan.append((kind, {"png": buf.getvalue(), "req": json.dumps(req)}))
+        else:
+            plan.append((kind, {
+                "genre": rng.choice(GENRES), "tone": rng.choice(TONES), "plot": rng.choice(PLOTS),
+                "usr_prompt": f"load test request {i}",
+            }))
+    return plan
+
+
+async def send(client, kind, payload):
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if kind == "story":
+            r = await client.post("/generate_story", json=payload, headers={"X-Cache-Bypass": "1"})
+            status = r.status_code
+        elif kind == "story_stream":
+            async with client.stream("POST", "/generate_story/stream", json=payload) as r:
+                status = r.status_code
+                async for line in r.aiter_lines():
+                    if line and ttft is None:
+                        ttft = time.perf_counter() - start
+        else:
+            files = {"image": ("upload.png", payload["png"], "image/png")}
+            r = await client.post("/generate_image", files=files, data={"req": payload["req"]})
+            status = r.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"kind": kind, "status": status, "seconds": time.perf_counter() - start, "ttft": ttft}
+
+
+async def drive(base_url, plan, concurrency, timeout):
+    queue = list(reversed(plan))
+    results = []
+
+    async def worker(client):
+        while queue:
+            kind, payload = queue.pop()
+            results.append(await send(client, kind, payload))
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return results, time.perf_counter() - start
+
+
+def summarize(results, wall):
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["seconds"] * 1000 for r in ok]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(ok) / wall, 3) if wall else 0.0,
+    }
+    for key, q in zip(LATENCY_KEYS, (50, 95, 99)):
+        value = percentile(latencies, q)
+        summary[key] = round(value, 2) if value is not None else None
+    ttfts = [r["ttft"] * 1000 for r in ok if r["ttft"] is not None]
+    if ttfts:
+        summary["ttft_p50_ms"] = round(percentile(ttfts, 50), 2)
+        summary["ttft_p95_ms"] = round(percentile(ttfts, 95), 2)
+    statuses = {}
+    for r in results:
+        if r["status"] != 200:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    if statuses:
+        summary["error_statuses"] = statuses
+    return summary
+
+
+def compare(report, baseline, tolerance):
+    """List of regressions of `report` against `baseline` (see module docstring)."""
+    regressions = []
+
+    def check(scope, key, new, old, higher_is_worse=True):
+        if new is None or old is None:
+            return
+        if key == "error_rate":
+            worse = new - old > 0.01
+        elif higher_is_worse:
+            worse = old > 0 and (new - old) / old > tolerance
+        else:
+            worse = old > 0 and (old - new) / old > tolerance
+        if worse:
+            regressions.append({"scope": scope, "metric": key, "baseline": old, "current": new})
+
+    scopes = {"overall": (report["overall"], baseline.get("overall", {}))}
+    for kind, summary in report["endpoints"].items():
+        scopes[kind] = (summary, baseline.get("endpoints", {}).get(kind, {}))
+    for scope, (new, old) in scopes.items():
+        for key in LATENCY_KEYS:
+            check(scope, key, new.get(key), old.get(key))
+        check(scope, "throughput_rps", new.get("throughput_rps"), old.get("throughput_rps"), higher_is_worse=False)
+        check(scope, "error_rate", new.get("error_rate"), old.get("error_rate"))
+    check("server", "peak_rss_mb", report.get("peak_rss_mb"), baseline.get("peak_rss_mb"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=4, help="requests sent first and left out of the report")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("story=6,story_stream=1,image=3"))
+    parser.add_argument("--workers", type=int, default=1, help=">1 runs a model host plus this many uvicorn workers")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--cache", action="store_true", help="keep the response and image caches on")
+    parser.add_argument("--models-dir", default=os.path.join(tempfile.gettempdir(), "ai-api-tiny"))
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against this stored report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before a regression")
+    args = parser.parse_args()
+
+    paths = ensure_tiny_models(args.models_dir)
+    overrides = {"generation": {"max_new_tokens": args.max_new_tokens}}
+    if args.cache:
+        overrides.update(response_cache={"enabled": True}, image_cache={"enabled": True})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump(tiny_config(paths, **overrides), f)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(tempfile.gettempdir(), "ai-api-loadtest-server.log")
+        with open(log_path, "w") as log:
+            procs = start_server(config_path, port, args.workers, log)
+            sampler = RssSampler(procs)
+            sampler.start()
+            try:
+                startup_s = wait_ready(base_url, procs)
+                plan = build_plan(args.mix, args.warmup + args.requests, args.seed)
+                if args.warmup:
+                    asyncio.run(drive(base_url, plan[:args.warmup], args.concurrency, args.timeout))
+                results, wall = asyncio.run(drive(base_url, plan[args.warmup:], args.concurrency, args.timeout))
+            finally:
+                sampler.stop()
+                for proc in reversed(procs):
+                    proc.terminate()
+                for proc in procs:
+                    proc.wait(timeout=30)
+
+    report = {
+        "settings": {
+            "concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup, "mix": args.mix,
+            "workers": args.workers, "max_new_tokens": args.max_new_tokens, "seed": args.seed, "cache": args.cache,
+        },
+        "startup_s": round(startup_s, 3),
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(sampler.peak / 1024 ** 2, 1),
+        "overall": summarize(results, wall),
+        "endpoints": {
+            kind: summarize([r for r in results if r["kind"] == kind], wall)
+            for kind in args.mix if any(r["kind"] == kind for r in results)
+        },
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Compare story-model precision modes on this machine.
+
+    python -m benchmarks.precision --modes float32 bfloat16 int8
+
+Each mode is loaded in a fresh process so load time and resident memory are not
+skewed by the previous one. Generation is greedy, so drift against the baseline
+mode (the first one listed) is deterministic:
+
+- token_agreement: share of generated tokens matching the baseline position by position
+- exact_match: share of prompts whose whole output matches the baseline
+- next_token_kl: mean KL(baseline || mode) of the first-token distribution
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+import psutil
+import torch
+
+from scripts import utils as util
+from scripts.pydantic_model import GameGenre, GameTone, PlotTitle, StoryPrompt
+
+PROMPTS = [
+    StoryPrompt(genre=GameGenre.PUZZLE, plot=PlotTitle.IN_SEARCH_OF_TREASURE, tone=GameTone.HUMOROUS,
+                objectives="Open the vault"),
+    StoryPrompt(genre=GameGenre.SURVIVAL, plot=PlotTitle.THE_DESCENT_INTO_HELL, tone=GameTone.DRAMATIC,
+                usr_prompt="A lighthouse keeper"),
+    StoryPrompt(genre=GameGenre.PLATFORM, plot=PlotTitle.THE_RETURN_TO_HOME, tone=GameTone.ACTIVE),
+    StoryPrompt(genre=GameGenre.ROLE_PLAYING, plot=PlotTitle.WITHIN_THE_LABYRINTH, tone=GameTone.SERIOUS,
+                objectives="Find the lost crew"),
+]
+
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(config, precision, max_new_tokens, repeats):
+    """Load the model in one precision and generate greedily for every prompt."""
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    tokenizer, model = util.load_tokenizer(config), util.load_model(config, precision=precision)
+    load_s = time.perf_counter() - start
+    rss_after_load = rss_mb()
+
+    outputs, first_logprobs = [], []
+    n_tokens, gen_s = 0, 0.0
+    for req in PROMPTS:
+        text = util.chat_text(util.build_prompt(req, max_new_tokens=max_new_tokens), tokenizer)
+        inputs = tokenizer(text, return_tensors="pt").to(model.device)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with torch.no_grad():
+                out = model.generate(
+                    **inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                    output_scores=True, return_dict_in_generate=True, pad_token_id=tokenizer.pad_token_id,
+                )
+            gen_s += time.perf_counter() - start
+        generated = out.sequences[0, inputs["input_ids"].shape[1]:]
+        n_tokens += generated.numel() * repeats
+        outputs.append(generated.tolist())
+        first_logprobs.append(torch.log_softmax(out.scores[0][0].float(), dim=-1).tolist())
+
+    return {
+        "precision": precision,
+        "load_s": round(load_s, 3),
+        "rss_mb": round(rss_after_load, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "model_mb": round(util.model_size_bytes(model) / 1024 ** 2, 1),
+        "tokens_per_sec": round(n_tokens / gen_s, 2) if gen_s else None,
+        "outputs": outputs,
+        "first_logprobs": first_logprobs,
+    }
+
+
+def _child(conn, config, precision, max_new_tokens, repeats):
+    try:
+        conn.send(run_mode(config, precision, max_new_tokens, repeats))
+    except Exception as e:
+        conn.send({"precision": precision, "error": f"{type(e).__name__}: {e}"})
+    conn.close()
+
+
+def run_isolated(config, precision, max_new_tokens, repeats):
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(child, config, precision, max_new_tokens, repeats))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+def drift(baseline, result):
+    matched = total = exact = 0
+    for base, out in zip(baseline["outputs"], result["outputs"]):
+        total += max(len(base), len(out))
+        matched += sum(a == b for a, b in zip(base, out))
+        exact += base == out
+    kl = 0.0
+    for base, out in zip(baseline["first_logprobs"], result["first_logprobs"]):
+        p, q = torch.tensor(base), torch.tensor(out)
+        kl += torch.sum(p.exp() * (p - q)).item()
+    n = len(baseline["outputs"])
+    return {
+        "token_agreement": round(matched / total, 4) if total else 1.0,
+        "exact_match": round(exact / n, 4),
+        "next_token_kl": round(max(0.0, kl / n), 6),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["float32", "bfloat16", "int8"], choices=util.PRECISIONS,
+                        help="precision modes; the first is the drift baseline")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=1, help="timed generations per prompt")
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    config = util.get_config()
+    results = [run_isolated(config, mode, args.max_new_tokens, args.repeats) for mode in args.modes]
+    baseline = results[0]
+    report = []
+    for result in results:
+        row = {k: v for k, v in result.items() if k not in ("outputs", "first_logprobs")}
+        if "error" not in result and "error" not in baseline:
+            row["drift"] = drift(baseline, result)
+        report.append(row)
+
+    text = json.dumps({"baseline": baseline["precision"], "modes": report}, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Tiny randomly initialised stand-ins for the story model and the Stable Diffusion
+img2img pipeline, built locally (no network, no GPU) for benchmarks and smoke runs.
+
+    python -m benchmarks.tiny_models --out /tmp/ai-api-tiny
+
+Outputs are deterministic for a given seed. Generated text is noise, but tensor
+shapes, tokenizer, chat template and pipeline code paths match the real models.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+def _corpus():
+    # Train the tokenizer on the prompt sources, so story prompts tokenize into real merges
+    texts = []
+    for name in ("pydantic_model.py", "prompts.py"):
+        with open(os.path.join(HERE, "..", "scripts", name)) as f:
+            texts.append(f.read())
+    return texts
+
+
+def build_tiny_tokenizer():
+    """Small byte-level BPE tokenizer with a ChatML template, trained on the prompt sources."""
+    from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=600, special_tokens=["<|endoftext|>", "<|im_start|>", "<|im_end|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tok.train_from_iterator(_corpus(), trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tok, eos_token="<|im_end|>", pad_token="<|endoftext|>",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer
+
+
+def build_tiny_lm(out, seed=0, hidden_size=64, num_layers=2):
+    """Qwen2-style causal LM with the tiny tokenizer (build_tiny_tokenizer)."""
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    tokenizer = build_tiny_tokenizer()
+    tokenizer.save_pretrained(out)
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=2048,
+        eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+    )
+    Qwen2ForCausalLM(config).save_pretrained(out)
+    return out
+
+
+def build_tiny_sd(out, seed=0):
+    """StableDiffusionImg2ImgPipeline with a two-block UNet/VAE and a character-level CLIP tokenizer."""
+    from diffusers import UNet2DConditionModel, AutoencoderKL, PNDMScheduler, StableDiffusionImg2ImgPipeline
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    chars = list(bytes_to_unicode().values())
+    vocab = {c: i for i, c in enumerate(chars)}
+    vocab.update({c + "</w>": len(chars) + i for i, c in enumerate(chars)})
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "vocab.json"), "w") as f:
+            json.dump(vocab, f)
+        with open(os.path.join(tmp, "merges.txt"), "w") as f:
+            f.write("#version: 0.2\n")
+        tokenizer = CLIPTokenizer(os.path.join(tmp, "vocab.json"), os.path.join(tmp, "merges.txt"), model_max_length=77)
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=1, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"), up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32, norm_num_groups=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64), in_channels=3, out_channels=3, down_block_types=("DownEncoderBlock2D",) * 2,
+        up_block_types=("UpDecoderBlock2D",) * 2, latent_channels=4, norm_num_groups=32, sample_size=64,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, hidden_size=32, intermediate_size=37, layer_norm_eps=1e-05,
+        num_attention_heads=4, num_hidden_layers=2, pad_token_id=1, vocab_size=len(vocab),
+    ))
+    pipe = StableDiffusionImg2ImgPipeline(
+        unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer,
+        scheduler=PNDMScheduler(skip_prk_steps=True, steps_offset=1), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipe.save_pretrained(out)
+    return out
+
+
+def ensure_tiny_models(root):
+    """Build (once) and return paths of the tiny story model, draft model and SD pipeline under `root`."""
+    paths = {name: os.path.join(root, name) for name in ("lm", "draft", "sd")}
+    if not os.path.exists(os.path.join(paths["lm"], "config.json")):
+        build_tiny_lm(paths["lm"], seed=0)
+    if not os.path.exists(os.path.join(paths["draft"], "config.json")):
+        build_tiny_lm(paths["draft"], seed=1, num_layers=1)
+    if not os.path.exists(os.path.join(paths["sd"], "model_index.json")):
+        build_tiny_sd(paths["sd"])
+    return paths
+
+
+def tiny_config(paths, **overrides):
+    """config.yaml contents that run the API on the tiny models, on CPU."""
+    config = {
+        "model": {"base_model_path": paths["lm"], "device": "cpu", "dtype": "float32", "precision": "float32"},
+        "image_model": {"model_id": paths["sd"], "device": "cpu", "dtype": "float32"},
+        "response_cache": {"enabled": False},
+        "image_cache": {"enabled": False},
+        "jobs": {"enabled": False},
+    }
+    for section, values in overrides.items():
+        config[section] = {**config.get(section, {}), **values}
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "ai-api-tiny"))
+    args = parser.parse_args()
+    print(json.dumps(ensure_tiny_models(args.out), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,250 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
-from scripts import utils as util
-from scripts.pydantic_model import StoryPrompt, AestheticsMessage
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Header, Request, Query
+from scripts import prompts
+from scripts.executor import QueueFullError, SessionNotFound
+from scripts.model_host import RemoteInference
+from scripts import metrics
+from scripts.cache import build_response_cache, story_cache_key, build_image_cache, image_cache_key
+from scripts import image_io
+from scripts.jobs import build_job_queue
+from scripts.pydantic_model import StoryPrompt, StoryBatchRequest, SessionMessage, AestheticsMessage
+import os
+import asyncio
 import time
-from PIL import Image, ImageOps
-from io import BytesIO
 import json
+import base64
+from typing import Optional, List
+from contextlib import asynccontextmanager
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 # Init Parameters
-config = util.get_config()
-tokenizer, model = util.load_model_and_tokenizer(config)
-app = FastAPI(title="AI Functionalities API")
+config = prompts.get_config()
+# With a model host (scripts/model_host.py) this worker loads no weights and forwards
+# inference over a Unix socket; otherwise models load here, in the background (see lifespan)
+host_cfg = config.get("model_host") or {}
+host_socket = os.environ.get("MODEL_HOST_SOCKET") or (host_cfg.get("socket") if host_cfg.get("enabled") else None)
+if host_socket:
+    inference = RemoteInference(config, host_socket)
+else:
+    from scripts.inference import LocalInference
+    inference = LocalInference(config)
+gen_params = inference.gen_params
+
+batch_cfg = config.get("batching") or {}
+# Limits for the /generate_story/batch and /generate_image/batch endpoints
+batch_api_cfg = config.get("batch_endpoints") or {}
+MAX_BATCH_ITEMS = batch_api_cfg.get("max_items", 64)
+IMAGE_BATCH_SIZE = batch_api_cfg.get("image_batch_size", 4)
+# Upload cap, decode size and output encoding for the image endpoints
+image_io_cfg = image_io.image_io_settings(config)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    inference.start()
+    if job_queue is not None:
+        job_queue.start()
+    yield
+    if job_queue is not None:
+        await job_queue.stop()
+    await inference.stop()
+
+
+# Content-addressed cache of generated stories (memory LRU + optional SQLite tier)
+response_cache = build_response_cache(config)
+# Byte-bounded cache of encoded /generate_image results, keyed on upload hash + prompt + parameters
+image_cache = build_image_cache(config)
+
+
+app = FastAPI(title="AI Functionalities API", lifespan=lifespan)
+
+
+
+def route_label(request):
+    # Route template, not the raw URL, so path parameters (and unknown URLs) do not explode cardinality
+    return getattr(request.scope.get("route"), "path", "unmatched")
+
+
+@app.middleware("http")
+async def record_request(request, call_next):
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.ERRORS.inc(path=route_label(request), status=500)
+        raise
+    path = route_label(request)
+    metrics.REQUESTS.inc(path=path, status=response.status_code)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+    if response.status_code >= 400:
+        metrics.ERRORS.inc(path=path, status=response.status_code)
+    return response
+
+
+def queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def host_unavailable(e: ConnectionError) -> HTTPException:
+    # The model host is down or restarting; the request itself was fine
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _disconnected(request):
+    # The body is already read, so the next ASGI message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def unless_disconnected(request, awaitable):
+    """
+    Await an inference call, cancelling it if the HTTP client disconnects first
+    (generation then stops at the next token or diffusion step, also on a model host).
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_disconnected(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+    if not task.done():
+        raise ClientDisconnected()
+    return task.result()
+
+
+def client_closed():
+    # Nobody reads it; 499 keeps abandoned requests apart in the request/error metrics
+    return Response(status_code=499)
+
+
+async def require_ready():
+    """Dependency for the story endpoints; 503 until the story models have loaded."""
+    if not await inference.is_ready("story"):
+        status = (await inference.readiness())["status"]
+        raise HTTPException(status_code=503, detail=f"Models are {status}", headers={"Retry-After": "5"})
+
+
+async def require_image_ready():
+    """Dependency for the image endpoints; the image pipeline loads after the story models."""
+    if not await inference.is_ready("image"):
+        status = (await inference.readiness())["image"]
+        raise HTTPException(status_code=503, detail=f"Image pipeline is {status}", headers={"Retry-After": "5"})
+
 
 # Post Generate
-@app.post("/generate_story")
-async def generate_text(req: StoryPrompt):
+@app.post("/generate_story", dependencies=[Depends(require_ready)])
+async def generate_text(
+    req: StoryPrompt,
+    request: Request,
+    response: Response,
+    x_cache_bypass: Optional[str] = Header(default=None),
+):
     try:
-        print(req)
+        # Step 0: serve repeated prompts from the response cache
+        cache_key = None
+        if response_cache is not None:
+            cache_key = story_cache_key(req, gen_params, config["model"]["base_model_path"])
+            cached = None
+            if x_cache_bypass:
+                response_cache.bypass()
+                response.headers["X-Cache"] = "BYPASS"
+            else:
+                cached = await run_in_threadpool(response_cache.get, cache_key)
+                response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+            metrics.CACHE_REQUESTS.inc(cache="story", result=response.headers["X-Cache"].lower())
+            if cached is not None:
+                return cached
+
         # Step 1: Format prompt
-        start = time.time()
-        max_new_tokens = 256
-        text = util.build_prompt(req, max_new_tokens=max_new_tokens)
+        max_new_tokens = gen_params["max_new_tokens"]
+        with metrics.stage("prompt_build"):
+            text = prompts.build_prompt(req, max_new_tokens=max_new_tokens)
+
+
+        # Step 2: generate response (batched with concurrent requests when enabled;
+        # seeded requests run alone so their sampling is reproducible). Stops early when
+        # the client disconnects or req.timeout_s runs out
+        story, truncated = await unless_disconnected(
+            request, inference.story(text, seed=req.seed, budget_s=req.timeout_s, adapter=req.adapter)
+        )
+
+        result = {"generated_story": story, "truncated": truncated}
+        # A story cut short by its deadline is not the answer to the prompt
+        if cache_key is not None and not truncated:
+            await run_in_threadpool(response_cache.set, cache_key, result)
 
+        return result
 
-        # Step 2: generate response
-        response = util.model_generation(text, model, tokenizer, max_new_tokens=max_new_tokens)
-        end = time.time()
-        print(f"Inference Time: {end - start:.2f} sec")
+    except ClientDisconnected:
+        return client_closed()
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 
+def _sse(data, event=None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
 
-        return {"generated_story": response}
 
+@app.post("/generate_story/stream", dependencies=[Depends(require_ready)])
+async def generate_text_stream(req: StoryPrompt):
+    """
+    Server-Sent Events variant of /generate_story.
+    Emits `data: {"text": ...}` chunks as tokens are decoded and a final
+    `event: done` carrying the full story plus time-to-first-token and
+    per-token latency, and `truncated` when `timeout_s` ran out first. If generation
+    fails part way, the stream ends with `event: error` instead of `done`.
+    """
+    try:
+        max_new_tokens = gen_params["max_new_tokens"]
+        with metrics.stage("prompt_build"):
+            text = prompts.build_prompt(req, max_new_tokens=max_new_tokens)
+        stream = await inference.story_stream(text, budget_s=req.timeout_s, adapter=req.adapter)
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=422, detail=str(e))
-    
+
+    async def events():
+        # The stream takes its slot when first advanced here; closing this generator (client
+        # gone) closes the stream, which cancels the generation
+        parts = []
+        try:
+            async for event in stream:
+                if "text" in event:
+                    parts.append(event["text"])
+                    yield _sse(event)
+                elif "error" in event:
+                    print(f"Stream failed after {len(parts)} chunks: {event['error']}")
+                    yield _sse({"error": event["error"], "generated_story": "".join(parts)}, event="error")
+                else:
+                    stats = event["stats"]
+                    print(f"Stream Time: {stats['total_ms'] / 1000:.2f} sec (TTFT {stats['ttft_ms']} ms)")
+                    yield _sse({"generated_story": "".join(parts), **stats}, event="done")
+        except QueueFullError as e:
+            # Lost the race for the slot after admission; the status line has already gone out
+            yield _sse({"error": str(e), "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            print(f"Stream failed after {len(parts)} chunks: {e!r}")
+            yield _sse({"error": str(e), "generated_story": "".join(parts)}, event="error")
+        finally:
+            await stream.aclose()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 
 def parse_aesthetics_message(req: str = Form(...)) -> AestheticsMessage:
     """Parse JSON string from form data into AestheticsMessage"""
@@ -47,49 +257,544 @@ def parse_aesthetics_message(req: str = Form(...)) -> AestheticsMessage:
         raise HTTPException(status_code=422, detail=f"Invalid aesthetics data: {str(e)}")
     
 
-@app.post("/generate_image")
+def image_result_params(params, output):
+    """Everything besides upload, prompt and pipeline that changes the returned bytes (cache key / ETag)."""
+    decode = {"max_side": image_io_cfg["max_side"], "multiple": image_io_cfg["multiple"]}
+    return {**params, "decode": decode, "output": output}
+
+
+def server_timing(timings):
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+@app.post("/generate_image", dependencies=[Depends(require_image_ready)])
 # def generate_image(req: AestheticsMessage, image: UploadFile = File(...)):
 async def generate_image(
+    request: Request,
     image: UploadFile = File(...),
-    req: AestheticsMessage = Depends(parse_aesthetics_message)
+    req: AestheticsMessage = Depends(parse_aesthetics_message),
+    format: Optional[str] = None,
+    quality: Optional[int] = None,
+    accept: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
 ):   
     try:
-        print(req)
         # Step 1: Format prompt
-        start = time.time()
-        #prompt = util.build_sd_prompts(req)
-        prompt_text = util.build_sd_prompts(req)
-        # Read file bytes
-        data = await image.read()
-
-        # Load PIL image (the line you asked about)
-        img = Image.open(BytesIO(data))
-        img = ImageOps.exif_transpose(img)  # fix orientation
-        img = img.convert("RGB")            # ensure RGB (or use "RGBA" if you want alpha)
+        #prompt = prompts.build_sd_prompts(req)
+        with metrics.stage("prompt_build"):
+            prompt_text = prompts.build_sd_prompts(req)
+        # Output format from ?format= or the Accept header (PNG by default)
+        output = image_io.negotiate_format(accept, format, quality, image_io_cfg)
+        # Read file bytes, up to image_io.max_upload_mb
+        data = await image_io.read_upload(image, image_io_cfg["max_upload_bytes"])
 
-        
-        out_img = util.model_generation_image(prompt_text, img)
+        # Same upload + prompt + parameters always renders the same image (fixed seed),
+        # so the cache key doubles as a strong ETag
+        params = prompts.image_params(config, req.quality)
+        cache_key = image_cache_key(
+            data, prompt_text, image_result_params(params, output), await inference.pipeline_key(req.style_model)
+        )
+        etag = f'"{cache_key}"'
+        media_type = image_io.media_type(output["format"])
+        # 'inline' helps browsers/Swagger show it; you can change filename
+        headers = {
+            "Content-Disposition": f'inline; filename="generated.{image_io.file_extension(output["format"])}"',
+            "ETag": etag,
+            "Vary": "Accept",
+        }
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
 
-        end = time.time()
-        print(f"Inference Time: {end - start:.2f} sec")
+        if image_cache is not None:
+            encoded = await run_in_threadpool(image_cache.get, cache_key)
+            metrics.CACHE_REQUESTS.inc(cache="image", result="hit" if encoded is not None else "miss")
+            if encoded is not None:
+                return Response(content=encoded, media_type=media_type, headers={**headers, "X-Cache": "HIT"})
 
-        # ----- Return as PNG bytes -----
-        buf = BytesIO()
-        out_img.save(buf, format="PNG")
-        buf.seek(0)
+        # Decode and diffusion run on the image pool, encoding on the thread pool, off the event loop.
+        # Diffusion stops early when the client disconnects or req.timeout_s runs out
+        encoded, timings, truncated = await unless_disconnected(
+            request, inference.image(data, prompt_text, req.style_model, params, output, budget_s=req.timeout_s)
+        )
+        if truncated:
+            # Partially denoised: neither cached nor identified by the full result's ETag
+            headers.pop("ETag")
+            headers.update({"X-Truncated": "true", "Cache-Control": "no-store"})
+        elif image_cache is not None:
+            await run_in_threadpool(image_cache.set, cache_key, encoded, "." + image_io.file_extension(output["format"]))
 
-        # 'inline' helps browsers/Swagger show it; you can change filename
-        headers = {"Content-Disposition": 'inline; filename="generated.png"'}
+        headers.update({"X-Cache": "MISS", "Server-Timing": server_timing(timings)})
+        return Response(content=encoded, media_type=media_type, headers=headers)
 
-        return StreamingResponse(buf, media_type="image/png", headers=headers)
- 
+    except ClientDisconnected:
+        return client_closed()
+    except image_io.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
     except Exception as e:
             raise HTTPException(status_code=422, detail=str(e))
 
 
 
-# Get Health
+def _chunks(items, size):
+    size = max(1, int(size))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _item_error(index, e):
+    status = 429 if isinstance(e, QueueFullError) else 503 if isinstance(e, ConnectionError) else 422
+    return {"index": index, "status": status, "error": str(e)}
+
+
+def _batch_response(results, stream):
+    """Either NDJSON lines as items finish, or one JSON body with results in request order."""
+    if stream:
+        async def lines():
+            async for item in results:
+                yield json.dumps(item) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def collect():
+        return sorted([item async for item in results], key=lambda item: item["index"])
+    return collect()
+
+
+async def story_batch_results(items):
+    """
+    Yield one result per StoryPrompt. Cache hits come back first; the rest run as
+    real batched generate calls of up to batching.max_batch_size prompts
+    (seeded prompts run one by one so they stay reproducible).
+    """
+    pending = []
+    for index, item in enumerate(items):
+        try:
+            cache_key = None
+            if response_cache is not None:
+                cache_key = story_cache_key(item, gen_params, config["model"]["base_model_path"])
+                cached = await run_in_threadpool(response_cache.get, cache_key)
+                metrics.CACHE_REQUESTS.inc(cache="story", result="hit" if cached is not None else "miss")
+                if cached is not None:
+                    yield {"index": index, "status": 200, "cached": True, **cached}
+                    continue
+            with metrics.stage("prompt_build"):
+                text = prompts.build_prompt(item, max_new_tokens=gen_params["max_new_tokens"])
+            pending.append((index, item, cache_key, text))
+        except Exception as e:
+            yield _item_error(index, e)
+
+    # One generate call serves one LoRA adapter, so unseeded prompts are chunked per adapter
+    by_adapter = {}
+    for p in pending:
+        if p[1].seed is None:
+            by_adapter.setdefault(p[1].adapter, []).append(p)
+    seeded = [p for p in pending if p[1].seed is not None]
+    max_batch = batch_cfg.get("max_batch_size", 8)
+    groups = [chunk for group in by_adapter.values() for chunk in _chunks(group, max_batch)] + [[p] for p in seeded]
+    for group in groups:
+        try:
+            if group[0][1].seed is None:
+                # Batch items carry no time budget, so a batched story is never truncated
+                stories = [
+                    (story, False)
+                    for story in await inference.story_batch([p[3] for p in group], adapter=group[0][1].adapter)
+                ]
+            else:
+                stories = [await inference.story(group[0][3], seed=group[0][1].seed, adapter=group[0][1].adapter)]
+        except Exception as e:
+            for index, _, _, _ in group:
+                yield _item_error(index, e)
+            continue
+        for (index, _, cache_key, _), (story, truncated) in zip(group, stories):
+            # Same shape as the single-prompt route, so either can serve the other's cache hits
+            result = {"generated_story": story, "truncated": truncated}
+            if cache_key is not None and not truncated:
+                await run_in_threadpool(response_cache.set, cache_key, result)
+            yield {"index": index, "status": 200, "cached": False, **result}
+
+
+@app.post("/generate_story/batch", dependencies=[Depends(require_ready)])
+async def generate_text_batch(req: StoryBatchRequest, stream: bool = False):
+    """
+    Generate many stories in one round trip. Returns `{"results": [...]}` in request
+    order, or NDJSON lines in completion order with `?stream=true`. Each result has
+    `index`, `status` and either `generated_story` or `error`.
+    """
+    if len(req.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    response = _batch_response(story_batch_results(req.items), stream)
+    if stream:
+        return response
+    return {"results": await response}
+
+
+def parse_aesthetics_list(reqs: str = Form(...)) -> List[AestheticsMessage]:
+    """Parse a JSON list (or a single object applied to every image) into AestheticsMessages"""
+    try:
+        data = json.loads(reqs)
+        data = data if isinstance(data, list) else [data]
+        return [AestheticsMessage(**item) for item in data]
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid JSON: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Invalid aesthetics data: {str(e)}")
+
+
+async def image_batch_results(datas, reqs):
+    png = image_io.negotiate_format(fmt="png", settings=image_io_cfg)
+    pending = []
+    for index, (data, req) in enumerate(zip(datas, reqs)):
+        try:
+            prompt = prompts.build_sd_prompts(req)
+            params = prompts.image_params(config, req.quality)
+            cache_key = image_cache_key(
+                data, prompt, image_result_params(params, png), await inference.pipeline_key(req.style_model)
+            )
+            if image_cache is not None:
+                cached = await run_in_threadpool(image_cache.get, cache_key)
+                metrics.CACHE_REQUESTS.inc(cache="image", result="hit" if cached is not None else "miss")
+                if cached is not None:
+                    yield {"index": index, "status": 200, "cached": True, "etag": f'"{cache_key}"',
+                           "image_png_base64": base64.b64encode(cached).decode("ascii")}
+                    continue
+            pending.append((index, data, req, prompt, cache_key))
+        except Exception as e:
+            yield _item_error(index, e)
+
+    # Items of one quality tier share the diffusion parameters of a chunk
+    tiers = {}
+    for entry in pending:
+        tiers.setdefault(entry[2].quality, []).append(entry)
+    chunks = [chunk for entries in tiers.values() for chunk in _chunks(entries, IMAGE_BATCH_SIZE)]
+    for chunk in chunks:
+        try:
+            params = prompts.image_params(config, chunk[0][2].quality)
+            items = [(data, prompt, req.style_model) for _, data, req, prompt, _ in chunk]
+            outputs = await inference.image_chunk(items, params)
+        except Exception as e:
+            outputs = [e] * len(chunk)
+        for (index, _, _, _, cache_key), out in zip(chunk, outputs):
+            if isinstance(out, Exception):
+                yield _item_error(index, out)
+                continue
+            if image_cache is not None:
+                await run_in_threadpool(image_cache.set, cache_key, out, "." + image_io.file_extension(png["format"]))
+            yield {"index": index, "status": 200, "cached": False, "etag": f'"{cache_key}"',
+                   "image_png_base64": base64.b64encode(out).decode("ascii")}
+
+
+@app.post("/generate_image/batch", dependencies=[Depends(require_image_ready)])
+async def generate_image_batch(
+    images: List[UploadFile] = File(...),
+    reqs: List[AestheticsMessage] = Depends(parse_aesthetics_list),
+    stream: bool = False,
+):
+    """
+    Stylise many uploads in one round trip. `reqs` is a JSON list with one
+    AestheticsMessage per image (or a single object used for all of them).
+    Results carry base64 PNGs, in request order or as NDJSON with `?stream=true`.
+    """
+    if len(images) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    if len(reqs) == 1:
+        reqs = reqs * len(images)
+    if len(reqs) != len(images):
+        raise HTTPException(status_code=422, detail=f"Got {len(images)} images but {len(reqs)} aesthetics entries")
+    try:
+        datas = [await image_io.read_upload(image, image_io_cfg["max_upload_bytes"]) for image in images]
+    except image_io.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    response = _batch_response(image_batch_results(datas, reqs), stream)
+    if stream:
+        return response
+    return {"results": await response}
+
+
+# ---------- Story sessions ----------
+def require_sessions():
+    if not (config.get("sessions") or {}).get("enabled", True):
+        raise HTTPException(status_code=404, detail="Story sessions are disabled")
+
+
+@app.post("/generate_story/sessions", dependencies=[Depends(require_ready), Depends(require_sessions)])
+async def start_story_session(req: StoryPrompt, request: Request):
+    """
+    Open a multi-turn story session: the first story is generated from the prompt and
+    its KV cache is kept server-side, so continuations only prefill the new turn.
+    """
+    try:
+        with metrics.stage("prompt_build"):
+            text = prompts.build_prompt(req, max_new_tokens=gen_params["max_new_tokens"])
+        return await unless_disconnected(
+            request, inference.session_start(text, adapter=req.adapter, seed=req.seed, budget_s=req.timeout_s)
+        )
+    except ClientDisconnected:
+        return client_closed()
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/generate_story/sessions/{session_id}", dependencies=[Depends(require_ready), Depends(require_sessions)])
+async def continue_story_session(session_id: str, req: SessionMessage, request: Request):
+    """Add a user turn ("continue", "revise ...") to a session and generate the reply."""
+    try:
+        return await unless_disconnected(
+            request, inference.session_continue(session_id, req.message, seed=req.seed, budget_s=req.timeout_s)
+        )
+    except ClientDisconnected:
+        return client_closed()
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get("/generate_story/sessions/{session_id}", dependencies=[Depends(require_ready), Depends(require_sessions)])
+async def get_story_session(session_id: str):
+    try:
+        return await inference.session_info(session_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ConnectionError as e:
+        raise host_unavailable(e)
+
+
+@app.delete("/generate_story/sessions/{session_id}", status_code=204,
+            dependencies=[Depends(require_ready), Depends(require_sessions)])
+async def delete_story_session(session_id: str):
+    try:
+        deleted = await inference.session_delete(session_id)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session {session_id!r}")
+    return Response(status_code=204)
+
+
+# ---------- Async jobs ----------
+async def story_job(payload, data):
+    """Job handler: the /generate_story result as JSON bytes (served from and stored in the response cache)."""
+    req = StoryPrompt(**payload)
+    cache_key = None
+    if response_cache is not None:
+        cache_key = story_cache_key(req, gen_params, config["model"]["base_model_path"])
+        cached = await run_in_threadpool(response_cache.get, cache_key)
+        metrics.CACHE_REQUESTS.inc(cache="story", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return json.dumps(cached).encode("utf-8"), "application/json", {"cached": True}
+    with metrics.stage("prompt_build"):
+        text = prompts.build_prompt(req, max_new_tokens=gen_params["max_new_tokens"])
+    story, truncated = await inference.story(text, seed=req.seed, budget_s=req.timeout_s, adapter=req.adapter)
+    result = {"generated_story": story, "truncated": truncated}
+    if cache_key is not None and not truncated:
+        await run_in_threadpool(response_cache.set, cache_key, result)
+    return json.dumps(result).encode("utf-8"), "application/json", {"cached": False, "truncated": truncated}
+
+
+async def image_job(payload, data):
+    """Job handler: the /generate_image result bytes, with the ETag and timings it would have had."""
+    if not await inference.is_ready("image"):
+        if (await inference.readiness())["image"] == "failed":
+            raise RuntimeError("Image pipeline failed to load")
+        # Still loading after the story models: the worker requeues the job and retries
+        raise QueueFullError("image pipeline", retry_after=5)
+    req, output = AestheticsMessage(**payload["req"]), payload["output"]
+    with metrics.stage("prompt_build"):
+        prompt_text = prompts.build_sd_prompts(req)
+    params = prompts.image_params(config, req.quality)
+    cache_key = image_cache_key(
+        data, prompt_text, image_result_params(params, output), await inference.pipeline_key(req.style_model)
+    )
+    meta = {"etag": f'"{cache_key}"', "filename": f"generated.{image_io.file_extension(output['format'])}"}
+    if image_cache is not None:
+        encoded = await run_in_threadpool(image_cache.get, cache_key)
+        metrics.CACHE_REQUESTS.inc(cache="image", result="hit" if encoded is not None else "miss")
+        if encoded is not None:
+            return encoded, image_io.media_type(output["format"]), {**meta, "cached": True}
+    encoded, timings, truncated = await inference.image(
+        data, prompt_text, req.style_model, params, output, budget_s=req.timeout_s
+    )
+    if truncated:
+        meta = {"filename": meta["filename"], "truncated": True}
+    elif image_cache is not None:
+        await run_in_threadpool(image_cache.set, cache_key, encoded, "." + image_io.file_extension(output["format"]))
+    meta.update({"cached": False, "server_timing": server_timing(timings)})
+    return encoded, image_io.media_type(output["format"]), meta
+
+
+# Persistent queue drained by worker tasks in every HTTP process; None when jobs.enabled is false
+job_queue = build_job_queue(config, {"story": story_job, "image": image_job}, ready=lambda: inference.is_ready("story"))
+
+
+def require_jobs():
+    if job_queue is None:
+        raise HTTPException(status_code=404, detail="Async jobs are disabled (set jobs.sqlite_path to enable)")
+
+
+def job_view(job, result=None):
+    view = {name: job[name] for name in (
+        "id", "kind", "status", "priority", "attempts", "created", "started", "finished", "expires", "error",
+    )}
+    view["truncated"] = bool((job["meta"] or {}).get("truncated"))
+    if job["status"] == "done":
+        view["result_url"] = f"/jobs/{job['id']}/result"
+        if result is not None:
+            view["result"] = result
+    return view
+
+
+def job_accepted(job, created, response):
+    # 202 while it still has to run; a duplicate of a finished job is answered with 200
+    response.status_code = 200 if job["status"] == "done" else 202
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return {**job_view(job), "deduplicated": not created}
+
+
+@app.post("/jobs/story", status_code=202, dependencies=[Depends(require_jobs)])
+async def submit_story_job(req: StoryPrompt, response: Response, priority: int = 0):
+    """
+    Queue a /generate_story request and return its job id at once. Resubmitting the
+    same body returns the existing job (`deduplicated: true`) instead of queuing it again.
+    """
+    try:
+        job, created = await job_queue.submit("story", req.model_dump(), priority=priority)
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    return job_accepted(job, created, response)
+
+
+@app.post("/jobs/image", status_code=202, dependencies=[Depends(require_jobs)])
+async def submit_image_job(
+    response: Response,
+    image: UploadFile = File(...),
+    req: AestheticsMessage = Depends(parse_aesthetics_message),
+    format: Optional[str] = None,
+    quality: Optional[int] = None,
+    priority: int = 0,
+    accept: Optional[str] = Header(default=None),
+):
+    """
+    Queue a /generate_image request (same form fields and output negotiation) and
+    return its job id at once; the upload is kept in the job store until it runs.
+    """
+    try:
+        output = image_io.negotiate_format(accept, format, quality, image_io_cfg)
+        prompts.image_params(config, req.quality)  # reject unknown tiers now rather than in the job
+        data = await image_io.read_upload(image, image_io_cfg["max_upload_bytes"])
+        payload = {"req": req.model_dump(mode="json"), "output": output}
+        job, created = await job_queue.submit("image", payload, data, priority=priority)
+    except image_io.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ConnectionError as e:
+        raise host_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return job_accepted(job, created, response)
+
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(require_jobs)])
+async def get_job(job_id: str, wait: float = Query(default=0, ge=0)):
+    """
+    Job status. `?wait=S` long-polls up to S seconds (capped at jobs.max_wait_s) for the
+    job to finish. Finished story jobs include their `result`.
+    """
+    job = await job_queue.get(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    result = None
+    if job["status"] == "done" and job["kind"] == "story":
+        stored = await job_queue.result(job_id)
+        result = json.loads(stored[0]) if stored is not None else None
+    return job_view(job, result)
+
+
+@app.get("/jobs/{job_id}/result", dependencies=[Depends(require_jobs)])
+async def get_job_result(job_id: str, wait: float = Query(default=0, ge=0)):
+    """
+    The finished job's response body: story JSON or the encoded image, with the
+    headers the synchronous endpoint would send. 409 while the job is queued or running.
+    """
+    job = await job_queue.get(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job["error"])
+    stored = await job_queue.result(job_id) if job["status"] == "done" else None
+    if stored is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}", headers={"Retry-After": "1"})
+    content, media_type = stored
+    meta = job["meta"] or {}
+    headers = {}
+    if meta.get("filename"):
+        headers["Content-Disposition"] = f'inline; filename="{meta["filename"]}"'
+    if meta.get("etag"):
+        headers["ETag"] = meta["etag"]
+    if meta.get("server_timing"):
+        headers["Server-Timing"] = meta["server_timing"]
+    if meta.get("truncated"):
+        headers.update({"X-Truncated": "true", "Cache-Control": "no-store"})
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+# Get Health (liveness: the process is up and serving, models may still be loading)
 @app.get("/health")
+@app.get("/health/live")
 async def health():
     return {"status": "ok"}
 
+
+# Get Readiness (models loaded; includes per-phase startup timings)
+@app.get("/health/ready")
+async def ready():
+    readiness = await inference.readiness()
+    # Ready once the story models are; the image pipeline may still be loading ("image")
+    body = {"status": readiness["status"], "image": readiness["image"], "startup": readiness["startup"]}
+    if readiness["error"]:
+        body["error"] = readiness["error"]
+    if readiness["status"] != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+# Get queue depth / wait times per model
+@app.get("/queue")
+async def queue_stats():
+    stats = await inference.stats()
+    if job_queue is not None:
+        stats["jobs"] = await job_queue.stats()
+    return stats
+
+
+# Get Prometheus metrics (per-stage latency histograms, token/queue/cache/error counters)
+@app.get("/metrics")
+async def prometheus_metrics():
+    if isinstance(inference, RemoteInference):
+        # HTTP metrics from this worker, inference metrics from the model host
+        text = metrics.REGISTRY.render(names=metrics.HTTP_METRICS) + await inference.metrics_text()
+    else:
+        text = metrics.REGISTRY.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+# Get response cache hit/miss counters
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "story": response_cache.stats() if response_cache is not None else None,
+        "image": image_cache.stats() if image_cache is not None else None,
+    }
+
@@ -1,2 +1,15 @@
-from . import utils
-from . import pydantic_model
\ No newline at end of file
+import importlib
+
+# Submodules load on first access (`scripts.utils`, ...), so processes that only
+# need the light modules (e.g. HTTP workers in front of a model host) never import torch
+__all__ = [
+    "utils", "pydantic_model", "pipelines", "batching", "executor", "prefix_cache", "cache",
+    "startup", "metrics", "assisted", "prompts", "inference", "model_host", "prompt_compiler",
+    "image_io", "jobs", "adapters", "sessions",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
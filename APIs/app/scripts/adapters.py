@@ -0,0 +1,157 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from scripts import metrics
+
+
+def adapter_bytes(model, name):
+    """Bytes of the LoRA weights of adapter `name` attached to `model`."""
+    return sum(
+        p.numel() * p.element_size()
+        for param_name, p in model.named_parameters()
+        if ".lora_" in param_name and f".{name}." in param_name
+    )
+
+
+class AdapterRegistry:
+    """
+    LoRA adapters attached on demand to the one shared story model.
+
+    `paths` maps adapter names (what a request's `adapter` field selects) to PEFT
+    adapter directories. Loaded adapters stay attached in an LRU bounded by `max_bytes`
+    of adapter weights and `max_loaded` adapters; the least recently used idle one is
+    detached when a new one needs room. The base weights are never copied or merged.
+
+    Which adapter is active is model-wide state, so `use(name)` lets any number of
+    generate calls run with the active adapter and makes a call for another adapter
+    wait until they are done before switching. The story batcher groups requests by
+    adapter, so a batch never needs more than one.
+    """
+
+    def __init__(self, model, paths, max_bytes=None, max_loaded=None):
+        self.model = model
+        self.paths = dict(paths)
+        self.max_bytes = max_bytes
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()   # name -> bytes, least recently used first
+        self._cond = threading.Condition()
+        self._active = None            # None: plain base model
+        self._users = 0
+        self.loads = 0
+        self.evictions = 0
+        self.switches = 0
+
+    def names(self):
+        return sorted(self.paths)
+
+    def check(self, name):
+        """Raise ValueError for an adapter name that is not configured."""
+        if name is not None and name not in self.paths:
+            raise ValueError(f"Unknown adapter {name!r}. Allowed: {self.names()}")
+
+    def loaded_bytes(self):
+        return sum(self._loaded.values())
+
+    def _evict(self, room):
+        while self._loaded and (
+            (self.max_bytes is not None and self.loaded_bytes() + room > self.max_bytes)
+            or (self.max_loaded is not None and len(self._loaded) >= self.max_loaded)
+        ):
+            name, _ = self._loaded.popitem(last=False)
+            self.model.delete_adapter(name)
+            self.evictions += 1
+            print(f"Detached adapter {name!r}")
+
+    def _load(self, name):
+        path = self.paths[name]
+        # Room for the new adapter is estimated from its weights file before attaching it
+        size = sum(
+            entry.stat().st_size for entry in os.scandir(path)
+            if entry.name.startswith("adapter_model.")
+        )
+        self._evict(size)
+        with metrics.stage("adapter_load"):
+            self.model.load_adapter(path, adapter_name=name)
+        self._loaded[name] = adapter_bytes(self.model, name)
+        self.loads += 1
+        print(f"Attached adapter {name!r} ({self._loaded[name] / 1024 ** 2:.1f} MB)")
+
+    def _activate(self, name):
+        if name is None:
+            if self._loaded:
+                self.model.disable_adapters()
+        else:
+            if name not in self._loaded:
+                self._load(name)
+            self.model.set_adapter(name)
+            self.model.enable_adapters()
+        self._active = name
+        self.switches += 1
+
+    @contextmanager
+    def use(self, name=None):
+        """Run the block with adapter `name` active (None: the base model)."""
+        self.check(name)
+        with self._cond:
+            while self._users and self._active != name:
+                self._cond.wait()
+            if self._active != name:
+                self._activate(name)
+            if name is not None:
+                self._loaded.move_to_end(name)
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._users -= 1
+                if not self._users:
+                    self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "configured": self.names(),
+            "loaded": list(self._loaded),
+            "active": self._active,
+            "loaded_mb": round(self.loaded_bytes() / 1024 ** 2, 2),
+            "max_mb": round(self.max_bytes / 1024 ** 2, 2) if self.max_bytes is not None else None,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "switches": self.switches,
+        }
+
+
+def adapter_paths(cfg):
+    """Adapter name -> directory from `adapters.paths` plus every adapter directory under `adapters.dir`."""
+    paths = {}
+    root = cfg.get("dir")
+    if root and os.path.isdir(root):
+        for entry in sorted(os.scandir(root), key=lambda e: e.name):
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, "adapter_config.json")):
+                paths[entry.name] = entry.path
+    paths.update(cfg.get("paths") or {})
+    return paths
+
+
+def build_adapter_registry(model, config):
+    """AdapterRegistry from the `adapters` section of config.yaml, or None when no adapters are configured."""
+    cfg = config.get("adapters") or {}
+    paths = adapter_paths(cfg)
+    if not cfg.get("enabled", True) or not paths:
+        return None
+    if (config["model"].get("precision") or "auto") == "int8":
+        raise ValueError("LoRA adapters need floating-point Linear layers; they do not work with model.precision int8")
+    max_mb = cfg.get("max_mb", 512)
+    registry = AdapterRegistry(
+        model, paths,
+        max_bytes=int(max_mb * 1024 ** 2) if max_mb else None,
+        max_loaded=cfg.get("max_loaded"),
+    )
+    for name in cfg.get("preload") or []:
+        with registry.use(name):
+            pass
+    with registry.use(None):
+        pass
+    return registry
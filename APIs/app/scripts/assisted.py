@@ -0,0 +1,142 @@
+import threading
+import time
+
+import torch
+
+from scripts import metrics
+
+
+class AssistedDecoder:
+    """
+    Assisted (speculative) decoding of the story model with a small draft model.
+
+    The draft proposes up to `num_assistant_tokens` tokens per step and the story
+    model verifies them in a single forward pass, so each expensive forward can
+    yield several tokens. Both models must share the tokenizer.
+
+    Forward hooks count draft and verification passes on the calling thread, which
+    gives per-request accept rate (accepted / proposed draft tokens) and speedup
+    (tokens/sec against `baseline_tokens_per_sec`, the plain-decoding rate measured
+    by `calibrate`). If an assisted call fails, the request is decoded without the
+    draft, unless it was streaming and tokens have already been sent.
+    """
+
+    def __init__(self, model, draft_model, num_assistant_tokens=5):
+        self.model = model
+        self.draft_model = draft_model
+        self.draft_model.generation_config.num_assistant_tokens = num_assistant_tokens
+        self.num_assistant_tokens = num_assistant_tokens
+        self.baseline_tokens_per_sec = None
+        self._local = threading.local()
+        self._hooks = [
+            model.register_forward_hook(self._counter("target")),
+            draft_model.register_forward_hook(self._counter("draft")),
+        ]
+        self.requests = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.fallbacks = 0
+
+    def _counter(self, name):
+        def hook(module, args, output):
+            counts = getattr(self._local, "counts", None)
+            if counts is not None:
+                counts[name] += 1
+        return hook
+
+    def _generate(self, inputs, **kwargs):
+        self._local.counts = {"target": 0, "draft": 0}
+        try:
+            output = self.model.generate(**inputs, assistant_model=self.draft_model, **kwargs)
+            return output, self._local.counts
+        finally:
+            self._local.counts = None
+
+    def generate(self, inputs, fallback_kwargs=None, **kwargs):
+        """
+        `model.generate(**inputs, **kwargs)` with the draft model attached.
+        `fallback_kwargs` (e.g. a prefix KV cache) are only used when decoding
+        falls back to the plain path.
+        """
+        start = time.perf_counter()
+        streamer = kwargs.get("streamer")
+        try:
+            output, counts = self._generate(inputs, **kwargs)
+        except Exception as e:
+            if streamer is not None and getattr(streamer, "token_times", True):
+                # Tokens already went to the client; a retry would stream them again
+                raise
+            self.fallbacks += 1
+            metrics.ASSISTED_FALLBACKS.inc()
+            print(f"Assisted decoding failed, decoding without draft: {e!r}")
+            if streamer is not None:
+                # The failed call consumed the prompt; the retry puts it again
+                streamer.next_tokens_are_prompt = True
+            return self.model.generate(**inputs, **kwargs, **(fallback_kwargs or {}))
+
+        seconds = time.perf_counter() - start
+        new_tokens = output.shape[1] - inputs["input_ids"].shape[1]
+        self.record(new_tokens, counts, seconds)
+        return output
+
+    def record(self, new_tokens, counts, seconds):
+        # Every verification pass emits the draft tokens it accepted plus one of its own
+        accepted = max(0, new_tokens - counts["target"])
+        proposed = max(accepted, counts["draft"])
+        self.requests += 1
+        self.proposed += proposed
+        self.accepted += accepted
+        metrics.DRAFT_TOKENS.inc(accepted, result="accepted")
+        metrics.DRAFT_TOKENS.inc(proposed - accepted, result="rejected")
+        if proposed:
+            metrics.ASSISTED_ACCEPT_RATE.observe(accepted / proposed)
+        if self.baseline_tokens_per_sec and seconds > 0:
+            metrics.ASSISTED_SPEEDUP.observe(new_tokens / seconds / self.baseline_tokens_per_sec)
+
+    def calibrate(self, inputs, max_new_tokens=16):
+        """
+        Measure plain greedy tokens/sec (the speedup baseline) and check the draft
+        actually works with this model. Returns False if assisted decoding fails.
+        """
+        with torch.no_grad():
+            start = time.perf_counter()
+            output = self.model.generate(**inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                                         do_sample=False)
+            seconds = time.perf_counter() - start
+            self.baseline_tokens_per_sec = (output.shape[1] - inputs["input_ids"].shape[1]) / seconds
+            try:
+                self._generate(inputs, max_new_tokens=max_new_tokens, do_sample=False)
+            except Exception as e:
+                print(f"Draft model unusable with the story model, assisted decoding disabled: {e!r}")
+                return False
+        return True
+
+    def close(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+    def stats(self):
+        return {
+            "num_assistant_tokens": self.num_assistant_tokens,
+            "requests": self.requests,
+            "proposed_tokens": self.proposed,
+            "accepted_tokens": self.accepted,
+            "accept_rate": round(self.accepted / self.proposed, 4) if self.proposed else None,
+            "baseline_tokens_per_sec": round(self.baseline_tokens_per_sec, 2) if self.baseline_tokens_per_sec else None,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def build_assisted_decoder(model, tokenizer, draft_model, config):
+    """
+    AssistedDecoder from the `assisted_decoding` section of config.yaml, or None
+    when the draft cannot be used with the story model.
+    """
+    cfg = config.get("assisted_decoding") or {}
+    decoder = AssistedDecoder(model, draft_model, num_assistant_tokens=cfg.get("num_assistant_tokens", 5))
+    inputs = tokenizer("Once upon a time", return_tensors="pt").to(model.device)
+    if not decoder.calibrate(inputs, max_new_tokens=cfg.get("calibration_tokens", 16)):
+        decoder.close()
+        return None
+    return decoder
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from scripts.executor import QueueFullError
+
+
+class _Pending:
+    __slots__ = ("text", "key", "future", "control", "enqueued")
+
+    def __init__(self, text, key, future, control=None):
+        self.text = text
+        self.key = key
+        self.future = future
+        self.control = control
+        self.enqueued = time.perf_counter()
+
+
+class StoryBatcher:
+    """
+    Async dynamic batcher in front of the causal LM.
+
+    Concurrent `submit` calls are collected for up to `window_ms` (or until
+    `max_batch_size` requests are waiting), grouped by `key` (e.g. max_new_tokens,
+    since one `generate` call shares its generation arguments), and handed to
+    `generate_fn(texts, key, controls)` as a single batch on a worker thread. Each
+    caller gets its own slice of the returned list; `controls` are the callers'
+    optional RequestControls, so one row can stop early without the others.
+
+    With an `executor` (see scripts/executor.py) batches run on its bounded pool and
+    `submit` rejects new requests with QueueFullError once `max_queue` are waiting.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=8, window_ms=15.0, executor=None, max_queue=None):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.executor = executor
+        self.max_queue = max_queue
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.requests = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    async def submit(self, text, key, control=None):
+        self.start()
+        if self.max_queue is not None and self._queue.qsize() >= self.max_queue:
+            retry_after = self.executor.retry_after() if self.executor else 1
+            raise QueueFullError("story", retry_after)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Pending(text, key, future, control))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Anything already queued rides along without waiting for a new window
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            groups = {}
+            for item in batch:
+                # Callers that went away while waiting do not take a batch slot
+                if not item.future.done():
+                    groups.setdefault(item.key, []).append(item)
+
+            for key, items in groups.items():
+                texts = [item.text for item in items]
+                controls = [item.control for item in items]
+                try:
+                    if self.executor is not None:
+                        results = await self.executor.run(self.generate_fn, texts, key, controls)
+                    else:
+                        results = await loop.run_in_executor(None, self.generate_fn, texts, key, controls)
+                except Exception as e:
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.requests += len(items)
+                for item, result in zip(items, results):
+                    if not item.future.done():
+                        item.future.set_result(result)
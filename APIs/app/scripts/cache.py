@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(payload):
+    """Stable sha256 over a JSON-serialisable payload (sorted keys, no whitespace)."""
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def story_cache_key(req, params, model_id):
+    """
+    Key for a StoryPrompt: the prompt fields normalised the same way build_prompt
+    reads them (stripped, plot resolved to its PlotTitle case-insensitively), the
+    generation parameters, the model id, the seed and the LoRA adapter if any.
+    """
+    from scripts.pydantic_model import PLOT_BY_NAME
+
+    fields = {
+        name: (getattr(req, name, None) or "").strip()
+        for name in ("objectives", "genre", "plot", "tone", "usr_prompt")
+    }
+    plot = PLOT_BY_NAME.get(fields["plot"].casefold())
+    if plot is not None:
+        fields["plot"] = plot.value
+    key = {
+        "fields": fields,
+        "params": params,
+        "model": model_id,
+        "seed": getattr(req, "seed", None),
+    }
+    adapter = getattr(req, "adapter", None)
+    if adapter:
+        # Only when set, so base-model entries keep their keys
+        key["adapter"] = adapter
+    return content_key(key)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for JSON-serialisable responses.
+
+    The memory tier is an LRU of `max_entries` items with a TTL; the optional SQLite
+    tier (`sqlite_path`) survives restarts and is consulted on memory misses, with
+    hits promoted back into memory. get/set may touch SQLite, so async callers run
+    them on a thread pool.
+    """
+
+    def __init__(self, max_entries=1024, ttl_s=None, sqlite_path=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl_s
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            os.makedirs(os.path.dirname(os.path.abspath(sqlite_path)), exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            # WAL with synchronous=NORMAL: a commit per set() appends to the log without an fsync
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = json.loads(row[0]), row[1]
+                    if not self._expired(created):
+                        self._put_mem(key, value, created)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def _put_mem(self, key, value, created):
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def set(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._put_mem(key, value, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), created),
+                )
+                self._db.commit()
+
+    def bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "disk": self._db is not None,
+        }
+
+
+def image_cache_key(image_bytes, prompt, params, pipeline_key):
+    """
+    Key for an img2img result: hash of the uploaded bytes, the prompt from
+    build_sd_prompts, the pipeline parameters and the (model, dtype, device) key.
+    """
+    return content_key({
+        "image": hashlib.sha256(image_bytes).hexdigest(),
+        "prompt": prompt,
+        "params": params,
+        "pipeline": list(pipeline_key),
+    })
+
+
+class BlobCache:
+    """
+    Byte-bounded two-tier cache for encoded results (e.g. PNG or WebP bytes).
+
+    The memory tier keeps at most `max_bytes` of values, evicting least recently
+    used first. The optional disk tier stores one file per key under `disk_dir`,
+    named with the suffix passed to set() (`suffix` by default), and is trimmed
+    oldest-first (by mtime, refreshed on hit) to `disk_max_bytes`. Values are
+    returned exactly as stored, so hits need no decoding.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, disk_dir=None, disk_max_bytes=None, suffix=".bin"):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.suffix = suffix
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._disk = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            entries = [e for e in os.scandir(disk_dir) if e.is_file() and not e.name.endswith(".tmp")]
+            for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                key, ext = os.path.splitext(entry.name)
+                self._disk[key] = (ext, entry.stat().st_size)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key, suffix=None):
+        if suffix is None:
+            suffix = self._disk[key][0]
+        return os.path.join(self.disk_dir, key + suffix)
+
+    def _disk_bytes(self):
+        return sum(size for _, size in self._disk.values())
+
+    def _put_mem(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old)
+        self._mem[key] = value
+        self._mem_bytes += len(value)
+        while self._mem_bytes > self.max_bytes:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            value = self._mem.get(key)
+            if value is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return value
+            if key in self._disk:
+                try:
+                    with open(self._path(key), "rb") as fh:
+                        value = fh.read()
+                    os.utime(self._path(key))
+                except OSError:
+                    self._disk.pop(key, None)
+                else:
+                    # Dicts keep insertion order: re-insert to mark as most recently used
+                    self._disk[key] = self._disk.pop(key)
+                    self._put_mem(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key, value, suffix=None):
+        """Store `value`; on disk as `<key><suffix>`, e.g. ".webp" for a WebP encoding."""
+        suffix = suffix or self.suffix
+        with self._lock:
+            self._put_mem(key, value)
+            if not self.disk_dir:
+                return
+            path = self._path(key, suffix)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(value)
+            os.replace(tmp, path)
+            old = self._disk.pop(key, None)
+            if old is not None and old[0] != suffix:
+                try:
+                    os.remove(self._path(key, old[0]))
+                except OSError:
+                    pass
+            self._disk[key] = (suffix, len(value))
+            if self.disk_max_bytes is not None:
+                while len(self._disk) > 1 and self._disk_bytes() > self.disk_max_bytes:
+                    oldest = next(iter(self._disk))
+                    path = self._path(oldest)
+                    self._disk.pop(oldest)
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        return {
+            "entries": len(self._mem),
+            "bytes": self._mem_bytes,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes(),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+
+def build_image_cache(config):
+    """BlobCache from the `image_cache` section of config.yaml, or None when disabled."""
+    cfg = config.get("image_cache") or {}
+    if not cfg.get("enabled", True):
+        return None
+    disk_max_mb = cfg.get("disk_max_mb")
+    return BlobCache(
+        max_bytes=int(cfg.get("max_mb", 256) * 1024 ** 2),
+        disk_dir=cfg.get("disk_dir"),
+        disk_max_bytes=int(disk_max_mb * 1024 ** 2) if disk_max_mb else None,
+        # Default only: set() gets the negotiated format's suffix (the key already covers the format)
+        suffix=".png",
+    )
+
+
+def build_response_cache(config):
+    """ResponseCache from the `response_cache` section of config.yaml, or None when disabled."""
+    cfg = config.get("response_cache") or {}
+    if not cfg.get("enabled", True):
+        return None
+    return ResponseCache(
+        max_entries=cfg.get("max_entries", 1024),
+        ttl_s=cfg.get("ttl_s", 24 * 3600),
+        sqlite_path=cfg.get("sqlite_path"),
+    )
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from scripts import metrics
+
+
+class QueueFullError(Exception):
+    """Raised when a model's wait queue is full; maps to HTTP 429 with Retry-After."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} queue is full, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class SessionNotFound(KeyError):
+    """Raised for an unknown or expired story session; maps to HTTP 404."""
+
+
+class InferenceExecutor:
+    """
+    Bounded executor for one model.
+
+    At most `max_concurrency` calls run at once on a dedicated thread pool, so
+    blocking inference never runs on the event loop. Up to `max_queue` callers may
+    wait for a slot; beyond that `QueueFullError` is raised immediately instead of
+    letting requests pile up.
+    """
+
+    def __init__(self, name, max_concurrency=1, max_queue=16):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"infer-{name}")
+        self._slots = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.last_wait = 0.0
+        self.avg_wait = 0.0
+        self.avg_service = 0.0
+
+    def _semaphore(self):
+        # Created lazily so it binds to the server's event loop, not the import-time one
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    def retry_after(self):
+        """Seconds until a slot is likely free, from the running average service time."""
+        backlog = (self.waiting + self.running) / self.max_concurrency
+        return max(1, math.ceil(self.avg_service * backlog))
+
+    def admit(self):
+        """Raise QueueFullError if a caller arriving now would be turned away."""
+        if self._semaphore().locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(self.name, self.retry_after())
+
+    async def acquire(self):
+        slots = self._semaphore()
+        self.admit()
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.last_wait = time.perf_counter() - start
+        metrics.QUEUE_WAIT_SECONDS.observe(self.last_wait, model=self.name)
+        self.avg_wait = 0.9 * self.avg_wait + 0.1 * self.last_wait
+        self.running += 1
+        return time.perf_counter()
+
+    def release(self, started=None):
+        self.running -= 1
+        self.completed += 1
+        if started is not None:
+            service = time.perf_counter() - started
+            self.avg_service = service if self.completed == 1 else 0.9 * self.avg_service + 0.1 * service
+        self._semaphore().release()
+
+    def release_when_done(self, future, started=None):
+        """Release the slot once `future` (the work holding it on the pool) has finished."""
+        def done(f):
+            if not f.cancelled():
+                f.exception()  # retrieved here; the caller may be gone
+            self.release(started)
+        future.add_done_callback(done)
+
+    async def run(self, fn, *args, **kwargs):
+        started = await self.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.pool, partial(fn, *args, **kwargs))
+        except BaseException:
+            self.release(started)
+            raise
+        # A cancelled caller stops waiting, but the slot stays taken until the pool thread
+        # returns, so at most max_concurrency calls ever run
+        self.release_when_done(future, started)
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "last_wait_ms": round(self.last_wait * 1000, 2),
+            "avg_wait_ms": round(self.avg_wait * 1000, 2),
+            "avg_service_ms": round(self.avg_service * 1000, 2),
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def build_executors(config):
+    """One executor per model from the `executor` section of config.yaml."""
+    cfg = config.get("executor") or {}
+    defaults = {"story": {"max_concurrency": 1, "max_queue": 32}, "image": {"max_concurrency": 1, "max_queue": 8}}
+    executors = {}
+    for name, default in defaults.items():
+        opts = {**default, **(cfg.get(name) or {})}
+        executors[name] = InferenceExecutor(name, opts["max_concurrency"], opts["max_queue"])
+    return executors
@@ -0,0 +1,144 @@
+"""
+Upload decode and result encode for the image endpoints (PIL only, no torch import,
+so HTTP workers can use it too).
+
+Decode: size-capped upload, JPEG draft-mode decode close to the pipeline's target
+resolution, upright RGB, longest side at most `max_side`, both sides snapped down
+to a multiple of 8. Encode: PNG, WebP or JPEG, negotiated from `?format=` or the
+Accept header, with a quality setting for the lossy formats.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from scripts import metrics
+
+# format name -> (PIL format, media type, file extension)
+FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+MEDIA_TYPES = {media_type: name for name, (_, media_type, _) in FORMATS.items()}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def image_io_settings(config):
+    """Settings from the `image_io` section of config.yaml."""
+    cfg = config.get("image_io") or {}
+    return {
+        "max_upload_bytes": int(cfg.get("max_upload_mb", 20) * 1024 ** 2),
+        "max_pixels": cfg.get("max_pixels", 64_000_000),
+        # None: the pipeline's native resolution (e.g. 512 for SD 1.x)
+        "max_side": cfg.get("max_side"),
+        "multiple": cfg.get("multiple", 8),
+        "format": FORMAT_ALIASES.get(cfg.get("format", "png"), cfg.get("format", "png")),
+        "quality": cfg.get("quality", 90),
+        "png_compress_level": cfg.get("png_compress_level", 1),
+    }
+
+
+async def read_upload(upload, max_bytes):
+    """Read an UploadFile, raising UploadTooLarge as soon as it goes over `max_bytes`."""
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"Upload is {upload.size} bytes; the limit is {max_bytes}")
+    chunks, total = [], 0
+    while True:
+        chunk = await upload.read(1024 ** 2)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Upload is over the {max_bytes} byte limit")
+        chunks.append(chunk)
+
+
+def negotiate_format(accept=None, fmt=None, quality=None, settings=None):
+    """
+    Output {"format", "quality"} for a request: an explicit `fmt` wins, then the
+    best-q supported type in the Accept header, then the configured default.
+    """
+    settings = settings or image_io_settings({})
+    if fmt:
+        fmt = FORMAT_ALIASES.get(fmt.lower(), fmt.lower())
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported output format {fmt!r}. Allowed: {sorted(FORMATS)}")
+    elif accept:
+        ranked = []
+        for order, part in enumerate(accept.split(",")):
+            media_type, *options = [p.strip() for p in part.split(";")]
+            q = 1.0
+            for option in options:
+                if option.startswith("q="):
+                    try:
+                        q = float(option[2:])
+                    except ValueError:
+                        q = 0.0
+            name = MEDIA_TYPES.get(media_type.lower())
+            if media_type in ("*/*", "image/*"):
+                name = settings["format"]
+            if name is not None and q > 0:
+                ranked.append((-q, order, name))
+        fmt = min(ranked)[2] if ranked else settings["format"]
+    else:
+        fmt = settings["format"]
+    if fmt == "png":
+        # Lossless: quality does not apply, and leaving it out keeps one cache entry per PNG result
+        return {"format": fmt, "quality": None}
+    quality = settings["quality"] if quality is None else int(quality)
+    if not 1 <= quality <= 100:
+        raise ValueError(f"quality must be between 1 and 100, got {quality}")
+    return {"format": fmt, "quality": quality}
+
+
+def media_type(fmt):
+    return FORMATS[fmt][1]
+
+
+def file_extension(fmt):
+    return FORMATS[fmt][2]
+
+
+def snap_size(width, height, max_side=None, multiple=8):
+    """Scale (width, height) so the longest side is at most `max_side`, then round both down to `multiple`."""
+    scale = min(1.0, max_side / max(width, height)) if max_side else 1.0
+    width, height = round(width * scale), round(height * scale)
+    return max(multiple, width // multiple * multiple), max(multiple, height // multiple * multiple)
+
+
+def decode_upload(data, max_side=None, multiple=8, max_pixels=None):
+    """Decode uploaded bytes into an upright RGB PIL image sized for diffusion (see snap_size)."""
+    with metrics.stage("image_decode"):
+        img = Image.open(BytesIO(data))
+        if max_side:
+            # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target size
+            width, height = snap_size(*img.size, max_side=max_side, multiple=1)
+            img.draft("RGB", (width, height))
+        if max_pixels and img.size[0] * img.size[1] > max_pixels:
+            raise ValueError(f"Image is {img.size[0]}x{img.size[1]}; at most {max_pixels} pixels are decoded")
+        img.load()
+    with metrics.stage("exif_transpose"):
+        img = ImageOps.exif_transpose(img)  # fix orientation
+        img = img.convert("RGB")            # ensure RGB (or use "RGBA" if you want alpha)
+    size = snap_size(*img.size, max_side=max_side, multiple=multiple)
+    if size != img.size:
+        with metrics.stage("image_resize"):
+            img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def encode_image(img, format="png", quality=90, png_compress_level=1):
+    """Encode a PIL image as PNG, WebP or JPEG bytes."""
+    with metrics.stage("image_encode"):
+        buf = BytesIO()
+        if format == "png":
+            img.save(buf, format="PNG", compress_level=png_compress_level)
+        elif format == "webp":
+            img.save(buf, format="WEBP", quality=quality, method=4)
+        else:
+            img.save(buf, format="JPEG", quality=quality, optimize=False)
+        return buf.getvalue()
@@ -0,0 +1,371 @@
+import asyncio
+from contextlib import nullcontext
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from scripts import utils as util
+from scripts import metrics
+from scripts.batching import StoryBatcher
+from scripts.executor import build_executors
+from scripts.image_io import image_io_settings, decode_upload, encode_image
+from scripts.startup import ModelState
+
+
+class LocalInference:
+    """
+    Models owned by this process: background-loaded ModelState, one bounded
+    executor per model and the story batcher.
+
+    main.py talks to the models only through these async methods, so the same API
+    can run against a separate model-host process instead (see scripts/model_host.py).
+    Cancelling an awaiting caller stops its generation at the next token.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.state = ModelState()
+        self.gen_params = util.generation_params(config)
+        self.executors = build_executors(config)
+        self.story_executor = self.executors["story"]
+        self.image_executor = self.executors["image"]
+        self.image_io = image_io_settings(config)
+        # Concurrent story requests are merged into one generate call
+        self.batch_cfg = config.get("batching") or {}
+        self.batcher = StoryBatcher(
+            self._generate_batch,
+            max_batch_size=self.batch_cfg.get("max_batch_size", 8),
+            window_ms=self.batch_cfg.get("window_ms", 15),
+            executor=self.story_executor,
+            max_queue=self.story_executor.max_queue,
+        )
+        # Scrape-time gauges for queue depth and in-flight calls per model
+        metrics.REGISTRY.gauge(
+            "ai_api_queue_depth", "Requests waiting for an inference slot", ["model"],
+            fn=lambda: {(name, ): ex.waiting for name, ex in self.executors.items()},
+        )
+        metrics.REGISTRY.gauge(
+            "ai_api_inflight", "Inference calls currently running", ["model"],
+            fn=lambda: {(name, ): ex.running for name, ex in self.executors.items()},
+        )
+
+    def start(self):
+        self.state.start(self.config)
+        if self.batch_cfg.get("enabled", True):
+            self.batcher.start()
+
+    async def stop(self):
+        await self.batcher.stop()
+        for executor in self.executors.values():
+            executor.shutdown()
+        if self.state.sessions is not None:
+            self.state.sessions.close()
+
+    async def is_ready(self, model=None):
+        """Whether `model` ("story" or "image") can serve; everything when None."""
+        state = self.state
+        if model == "story":
+            return state.ready
+        if model == "image":
+            return state.image_ready
+        return state.ready and state.image_ready
+
+    async def readiness(self):
+        state = self.state
+        return {
+            "status": state.status, "image": state.image_status, "startup": state.timings,
+            "error": state.error or state.image_error,
+        }
+
+    def _check_adapter(self, adapter):
+        """ValueError for an adapter name that is not configured; called before queueing so it never fails a batch."""
+        if adapter is not None and self.state.adapters is None:
+            raise ValueError(f"Unknown adapter {adapter!r}: no adapters are configured")
+        if self.state.adapters is not None:
+            self.state.adapters.check(adapter)
+
+    def _adapter_scope(self, adapter):
+        """AdapterRegistry.use(adapter), or a no-op when no adapters are configured."""
+        adapters = self.state.adapters
+        return adapters.use(adapter) if adapters is not None else nullcontext()
+
+    def _prefix_cache(self, adapter):
+        # The prefix KV cache holds base-model keys/values; LoRA on attention changes them
+        return self.state.prefix_cache if adapter is None else None
+
+    def _generate_batch(self, texts, key, controls=None):
+        # The batcher groups requests by (max_new_tokens, adapter)
+        max_new_tokens, adapter = key
+        state = self.state
+        with self._adapter_scope(adapter):
+            return util.model_generation_batch(
+                texts, state.model, state.tokenizer, max_new_tokens=max_new_tokens, prefix_cache=self._prefix_cache(adapter),
+                temperature=self.gen_params["temperature"], top_p=self.gen_params["top_p"], assistant=state.assistant,
+                compiler=state.prompt_compiler, controls=controls,
+            )
+
+    def _generate(self, text, seed=None, control=None, adapter=None):
+        state = self.state
+        with self._adapter_scope(adapter):
+            return util.model_generation(
+                text, state.model, state.tokenizer, prefix_cache=self._prefix_cache(adapter), seed=seed,
+                assistant=state.assistant, control=control, compiler=state.prompt_compiler, **self.gen_params
+            )
+
+    async def story(self, text, seed=None, budget_s=None, adapter=None):
+        """
+        One story; batched with concurrent requests for the same adapter unless seeded (seeded
+        runs alone to stay reproducible). With `budget_s`, generation stops once that many
+        seconds have passed since the call. `adapter` names a LoRA adapter (None: base model).
+        Returns (story, truncated), truncated meaning the budget cut it short.
+        """
+        self._check_adapter(adapter)
+        control = util.RequestControl(budget_s)
+        try:
+            if self.batch_cfg.get("enabled", True) and seed is None:
+                story = await self.batcher.submit(text, (self.gen_params["max_new_tokens"], adapter), control)
+            else:
+                story = await self.story_executor.run(self._generate, text, seed=seed, control=control, adapter=adapter)
+            return story, control.truncated
+        finally:
+            # Stops the generate loop if the caller went away; no-op once it has finished
+            control.cancel()
+
+    async def story_batch(self, texts, adapter=None):
+        """Several stories, all with the same adapter, in one padded generate call."""
+        self._check_adapter(adapter)
+        controls = [util.RequestControl() for _ in texts]
+        try:
+            return await self.story_executor.run(
+                self._generate_batch, texts, (self.gen_params["max_new_tokens"], adapter), controls
+            )
+        finally:
+            for control in controls:
+                control.cancel()
+
+    async def story_admit(self, adapter=None):
+        """Raise now what story_stream would hit when it starts: an unknown adapter or a full queue."""
+        self._check_adapter(adapter)
+        self.story_executor.admit()
+
+    async def story_stream(self, text, budget_s=None, adapter=None):
+        """
+        Check admission (QueueFullError while a response can still be a 429) and return an
+        async iterator of {"text": chunk} events followed by {"stats": ...}, or by
+        {"error": message} if generation failed; stats["truncated"] is true when
+        `budget_s` ran out first. The story slot is taken, and generation started, only
+        once the iterator is first advanced, so a stream that is never consumed holds nothing.
+        """
+        await self.story_admit(adapter)
+
+        async def events():
+            started = await self.story_executor.acquire()
+            control = util.RequestControl(budget_s)
+            state = self.state
+            streamer = None
+            try:
+                streamer = util.model_generation_stream(
+                    text, state.model, state.tokenizer, executor=self.story_executor.pool,
+                    prefix_cache=self._prefix_cache(adapter), assistant=state.assistant, control=control,
+                    compiler=state.prompt_compiler, scope=self._adapter_scope(adapter), **self.gen_params
+                )
+                async for chunk in iterate_in_threadpool(streamer):
+                    if chunk:
+                        yield {"text": chunk}
+                if streamer.error is not None:
+                    yield {"error": f"{type(streamer.error).__name__}: {streamer.error}"}
+                else:
+                    yield {"stats": {**streamer.stats(), "truncated": control.truncated}}
+            finally:
+                # Stops generate at the next token if the consumer went away; the slot is
+                # released when the pool thread actually returns
+                control.cancel()
+                if streamer is not None and streamer.future is not None:
+                    self.story_executor.release_when_done(asyncio.wrap_future(streamer.future), started)
+                else:
+                    self.story_executor.release(started)
+
+        return events()
+
+    def _session_store(self):
+        if self.state.sessions is None:
+            raise ValueError("Story sessions are disabled (sessions.enabled in config.yaml)")
+        return self.state.sessions
+
+    def _session_turn(self, session, text, seed=None, control=None):
+        """
+        One turn of `session`, on the story executor: the first turn's `text` is a story
+        prompt, later ones a follow-up message in the chat template. Only the tokens the
+        session's KV cache does not cover are prefilled, wherever the store finds that
+        cache; a dropped one means a full prefill over the same ids.
+        """
+        state, store = self.state, self.state.sessions
+        with session.lock:
+            first = not session.ids
+            with metrics.stage("tokenize"):
+                if first:
+                    turn_ids = util.encode_prompts([text], state.tokenizer, state.prompt_compiler)["input_ids"][0].tolist()
+                else:
+                    turn_ids = store.turn_ids(state.tokenizer, text)
+            input_ids = session.ids + turn_ids
+            store.check_length(len(input_ids) + self.gen_params["max_new_tokens"])
+            cache, source = store.checkout(session)
+            reused = cache.get_seq_length() if cache is not None else 0
+            try:
+                with self._adapter_scope(session.adapter):
+                    ids, reply, cache = util.model_generation_session(
+                        input_ids, state.model, state.tokenizer, past_key_values=cache,
+                        prefix_cache=self._prefix_cache(session.adapter) if first else None,
+                        seed=seed, control=control, **self.gen_params
+                    )
+            except Exception:
+                store.release(session, keep_cache=False)
+                raise
+            if control.cancel_event.is_set():
+                # The caller went away: forget the half-written turn
+                if source is not None:
+                    cache.crop(reused)
+                store.release(session, keep_cache=source is not None)
+                return None
+            store.checkin(session, ids, cache, [{"role": "user", "content": str(text)}, {"role": "assistant", "content": reply}])
+        kv = source or ("new" if first else "reprefill")
+        metrics.SESSION_TURNS.inc(kv=kv)
+        return {
+            "session_id": session.id,
+            "turn": len(session.turns) // 2,
+            "generated_story": reply,
+            "truncated": control.truncated,
+            "kv": kv,
+            "reused_tokens": reused,
+            "prefill_tokens": len(input_ids) - reused,
+        }
+
+    async def _session_call(self, session, text, seed, budget_s):
+        control = util.RequestControl(budget_s)
+        try:
+            return await self.story_executor.run(self._session_turn, session, text, seed=seed, control=control)
+        finally:
+            control.cancel()
+
+    async def session_start(self, text, adapter=None, seed=None, budget_s=None):
+        """
+        Open a story session whose first turn is the story prompt `text`. Sessions run
+        alone (never batched). Returns the turn (story, truncated, session_id, KV reuse).
+        """
+        store = self._session_store()
+        self._check_adapter(adapter)
+        session = store.create(adapter)
+        try:
+            return await self._session_call(session, text, seed, budget_s)
+        except BaseException:
+            # A session without its first turn is of no use to anyone
+            store.delete(session.id)
+            raise
+
+    async def session_continue(self, session_id, message, seed=None, budget_s=None):
+        """Add a user turn to a session and generate the reply; SessionNotFound for an unknown or expired session."""
+        session = self._session_store().get(session_id)
+        return await self._session_call(session, message, seed, budget_s)
+
+    async def session_info(self, session_id):
+        return self._session_store().get(session_id).view()
+
+    async def session_delete(self, session_id):
+        return self._session_store().delete(session_id)
+
+    async def pipeline_key(self, model_id=None):
+        return self.state.image_pipelines.key(model_id)
+
+    def _decode(self, data, model_id, scale=1.0):
+        io = self.image_io
+        # Quality tiers render at a fraction of the full decode resolution
+        max_side = round((io["max_side"] or util.image_target_side(model_id)) * scale)
+        return decode_upload(data, max_side=max_side, multiple=io["multiple"], max_pixels=io["max_pixels"])
+
+    def _render(self, data, prompt, model_id, params, timings, control):
+        params = dict(params)
+        img = util.timed(timings, "decode", self._decode, data, model_id, params.pop("scale", 1.0))
+        return util.timed(
+            timings, "diffusion", util.model_generation_image, prompt, img, model_id=model_id, control=control, **params
+        )
+
+    def _encode(self, img, output):
+        output = output or {}
+        return encode_image(
+            img, format=output.get("format", "png"), quality=output.get("quality") or self.image_io["quality"],
+            png_compress_level=self.image_io["png_compress_level"],
+        )
+
+    async def image(self, data, prompt, model_id, params, output=None, budget_s=None):
+        """
+        Decode and diffusion on the image pool, then encoding on the shared thread pool
+        so the next image can start diffusing meanwhile. `output` is
+        {"format", "quality"} (see scripts/image_io.py). With `budget_s`, diffusion skips
+        its remaining steps once that many seconds have passed since the call.
+        Returns (bytes, stage seconds, truncated).
+        """
+        timings = {}
+        control = util.RequestControl(budget_s)
+        try:
+            out_img = await self.image_executor.run(self._render, data, prompt, model_id, params, timings, control)
+        finally:
+            # Interrupts diffusion at the next step if the caller went away
+            control.cancel()
+        encoded = await run_in_threadpool(util.timed, timings, "encode", self._encode, out_img, output)
+        return encoded, timings, control.truncated
+
+    def _render_chunk(self, items, params, control):
+        """
+        Decode a chunk of (upload, prompt, model_id) items and run one batched diffusion
+        pass per distinct (model, image size); returns an image or the exception per item.
+        """
+        params = dict(params)
+        scale = params.pop("scale", 1.0)
+        results = {}
+        groups = {}
+        for index, (data, prompt, model_id) in enumerate(items):
+            try:
+                img = self._decode(data, model_id, scale)
+            except Exception as e:
+                results[index] = e
+                continue
+            groups.setdefault((model_id, img.size), []).append((index, prompt, img))
+        for (model_id, _), rows in groups.items():
+            try:
+                images = util.model_generation_image_batch(
+                    [r[1] for r in rows], [r[2] for r in rows], model_id=model_id, control=control, **params
+                )
+                for (index, _, _), out_img in zip(rows, images):
+                    results[index] = out_img
+            except Exception as e:
+                for index, _, _ in rows:
+                    results[index] = e
+        return [results[index] for index in range(len(items))]
+
+    def _encode_all(self, results):
+        return [r if isinstance(r, Exception) else self._encode(r, None) for r in results]
+
+    async def image_chunk(self, items, params):
+        """PNG bytes (or the exception) per item; encoding runs after the image slot is released."""
+        control = util.RequestControl()
+        try:
+            results = await self.image_executor.run(self._render_chunk, items, params, control)
+        finally:
+            control.cancel()
+        return await run_in_threadpool(self._encode_all, results)
+
+    async def stats(self):
+        story = self.story_executor.stats()
+        story["batcher_queue_depth"] = self.batcher.queue_depth()
+        assistant = self.state.assistant
+        story["assisted_decoding"] = assistant.stats() if assistant is not None else None
+        compiler = self.state.prompt_compiler
+        story["prompt_compiler"] = compiler.stats() if compiler is not None else None
+        adapters = self.state.adapters
+        story["adapters"] = adapters.stats() if adapters is not None else None
+        sessions = self.state.sessions
+        story["sessions"] = sessions.stats() if sessions is not None else None
+        return {"story": story, "image": self.image_executor.stats()}
+
+    async def metrics_text(self):
+        """Inference-side metrics not already in this process's registry (none when local)."""
+        return ""
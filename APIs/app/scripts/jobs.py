@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from scripts import metrics
+from scripts.cache import content_key
+from scripts.executor import QueueFullError
+
+# queued -> running -> done | failed; a running job whose lease ran out (worker died) is claimable again
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed")
+
+_COLUMNS = "id, kind, priority, status, media_type, meta, error, attempts, created, started, finished, expires"
+
+
+class JobStore:
+    """
+    SQLite-backed job queue shared by every HTTP worker process on the host.
+
+    Jobs are claimed highest `priority` first, then oldest first, by one atomic UPDATE,
+    so several processes can drain the same file. A claim holds a lease that the running
+    worker renews; if the worker dies, the job is claimed again once the lease runs out,
+    up to `max_attempts` times. Finished jobs (results and errors) are kept for
+    `result_ttl_s` and then purged.
+    """
+
+    def __init__(self, path, result_ttl_s=3600, max_attempts=3):
+        self.result_ttl = result_ttl_s
+        self.max_attempts = max(1, int(max_attempts))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit; multi-statement writes take the write lock up front with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, dedupe_key TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " status TEXT NOT NULL, payload TEXT NOT NULL, input BLOB, result BLOB, media_type TEXT,"
+            " meta TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, owner TEXT, lease_until REAL,"
+            " created REAL NOT NULL, started REAL, finished REAL, expires REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key)")
+
+    @staticmethod
+    def _public(row):
+        job = dict(row)
+        job["meta"] = json.loads(job["meta"]) if job.get("meta") else None
+        return job
+
+    def submit(self, kind, payload, data=None, priority=0, max_queued=None):
+        """
+        Queue a job, or return the live job for the same kind + payload + input.
+        A duplicate with a higher priority raises the queued job's priority.
+        Returns (job, created).
+        """
+        dedupe_key = content_key({
+            "kind": kind,
+            "payload": payload,
+            "input": hashlib.sha256(data).hexdigest() if data is not None else None,
+        })
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT {_COLUMNS} FROM jobs WHERE dedupe_key = ? AND status != 'failed'"
+                    " AND (expires IS NULL OR expires > ?) ORDER BY created DESC LIMIT 1",
+                    (dedupe_key, now),
+                ).fetchone()
+                created = row is None
+                if not created:
+                    job_id = row["id"]
+                    if row["status"] == "queued" and priority > row["priority"]:
+                        self._db.execute("UPDATE jobs SET priority = ? WHERE id = ?", (int(priority), job_id))
+                else:
+                    if max_queued is not None:
+                        queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                        if queued >= max_queued:
+                            raise QueueFullError("jobs", 5)
+                    job_id = uuid.uuid4().hex
+                    self._db.execute(
+                        "INSERT INTO jobs (id, kind, dedupe_key, priority, status, payload, input, created)"
+                        " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                        (job_id, kind, dedupe_key, int(priority), json.dumps(payload), data, now),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(job_id), created
+
+    def claim(self, owner, lease_s):
+        """Take the next job (highest priority, then oldest) for `owner`; None when the queue is empty."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, started = ?, attempts = attempts + 1"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                "             ORDER BY priority DESC, created LIMIT 1)"
+                " RETURNING id, kind, payload, input, attempts",
+                (owner, now + lease_s, now, now),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def renew(self, job_id, owner, lease_s):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + lease_s, job_id, owner),
+            )
+
+    def requeue(self, job_id, owner):
+        """Put a claimed job back without counting the attempt (shutdown, inference queue full)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, started = NULL,"
+                " attempts = attempts - 1 WHERE id = ? AND owner = ? AND status = 'running'",
+                (job_id, owner),
+            )
+
+    def _finish(self, job_id, owner, status, result=None, media_type=None, meta=None, error=None):
+        now = time.time()
+        expires = now + self.result_ttl if self.result_ttl is not None else None
+        with self._lock:
+            # The upload is not needed any more; drop it to keep the file small
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, media_type = ?, meta = ?, error = ?, input = NULL,"
+                " owner = NULL, lease_until = NULL, finished = ?, expires = ? WHERE id = ? AND owner = ?",
+                (status, result, media_type, json.dumps(meta) if meta else None, error, now, expires, job_id, owner),
+            )
+
+    def finish(self, job_id, owner, result, media_type, meta=None):
+        self._finish(job_id, owner, "done", result=result, media_type=media_type, meta=meta)
+
+    def fail(self, job_id, owner, error):
+        self._finish(job_id, owner, "failed", error=error)
+
+    def get(self, job_id):
+        """Job status (no payload or result bytes), or None if unknown or expired."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id = ? AND (expires IS NULL OR expires > ?)", (job_id, time.time())
+            ).fetchone()
+        return self._public(row) if row is not None else None
+
+    def result(self, job_id):
+        """(result bytes, media type) of a done job, else None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, media_type FROM jobs WHERE id = ? AND status = 'done' AND (expires IS NULL OR expires > ?)",
+                (job_id, time.time()),
+            ).fetchone()
+        return (row["result"], row["media_type"]) if row is not None else None
+
+    def purge(self):
+        """Delete finished jobs past their TTL; returns how many."""
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)
+            ).rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in ACTIVE + FINISHED} | {row[0]: row[1] for row in rows}
+
+
+class JobQueue:
+    """
+    Asynchronous jobs for long generations: submit returns a job id at once and
+    `workers` tasks in this process drain the JobStore.
+
+    `handlers` maps a job kind to `async fn(payload, data) -> (result bytes, media type, meta)`;
+    they go through the same bounded inference executors as the synchronous endpoints,
+    so jobs queue behind them rather than overloading the models. `ready` is an async
+    callable; workers wait for it (e.g. models loaded) before claiming jobs.
+    """
+
+    def __init__(self, store, handlers, workers=2, lease_s=60, poll_s=0.5, max_queued=1000, max_wait_s=60,
+                 ready=None):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, int(workers))
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self.max_queued = max_queued
+        self.max_wait_s = max_wait_s
+        self.ready = ready
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        self._wake = None
+        self._finished = {}
+        self._last_purge = 0.0
+
+    def _event(self):
+        # Created lazily so it binds to the server's event loop, not the import-time one
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind, payload, data=None, priority=0):
+        job, created = await run_in_threadpool(self.store.submit, kind, payload, data, priority, self.max_queued)
+        if created:
+            metrics.JOBS.inc(kind=kind, status="queued")
+            self._event().set()
+        return job, created
+
+    async def get(self, job_id, wait_s=0):
+        """
+        Job status, long-polling up to `wait_s` (capped at max_wait_s) for it to finish.
+        Jobs finished by this process wake the poll at once; others are seen within poll_s.
+        """
+        deadline = time.monotonic() + min(wait_s or 0, self.max_wait_s)
+        while True:
+            job = await run_in_threadpool(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED:
+                self._finished.pop(job_id, None)
+                return job
+            if remaining <= 0:
+                return job
+            finished = self._finished.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(finished.wait(), timeout=min(self.poll_s, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def result(self, job_id):
+        return await run_in_threadpool(self.store.result, job_id)
+
+    async def stats(self):
+        return {"workers": self.workers, **await run_in_threadpool(self.store.counts)}
+
+    async def _worker(self):
+        while True:
+            if self.ready is not None and not await self.ready():
+                await asyncio.sleep(1)
+                continue
+            job = await run_in_threadpool(self.store.claim, self.owner, self.lease_s)
+            if job is None:
+                await self._idle()
+                continue
+            await self._run(job)
+
+    async def _idle(self):
+        if time.monotonic() - self._last_purge > 60:
+            self._last_purge = time.monotonic()
+            await run_in_threadpool(self.store.purge)
+        wake = self._event()
+        try:
+            # Other processes' submissions are picked up on the next poll
+            await asyncio.wait_for(wake.wait(), timeout=self.poll_s)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            await run_in_threadpool(self.store.renew, job_id, self.owner, self.lease_s)
+
+    async def _run(self, job):
+        job_id, kind = job["id"], job["kind"]
+        if job["attempts"] > self.store.max_attempts:
+            await run_in_threadpool(self.store.fail, job_id, self.owner, f"gave up after {job['attempts'] - 1} attempts")
+            metrics.JOBS.inc(kind=kind, status="failed")
+            self._notify(job_id)
+            return
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id))
+        retry_after = None
+        try:
+            result, media_type, meta = await self.handlers[kind](job["payload"], job["input"])
+        except QueueFullError as e:
+            # The models are saturated by synchronous traffic; try again later
+            await run_in_threadpool(self.store.requeue, job_id, self.owner)
+            retry_after = e.retry_after
+        except asyncio.CancelledError:
+            # Shutting down: leave the job for the next worker. Shielded, so the requeue
+            # finishes even though this task is being cancelled
+            await asyncio.shield(run_in_threadpool(self.store.requeue, job_id, self.owner))
+            raise
+        except Exception as e:
+            await run_in_threadpool(self.store.fail, job_id, self.owner, str(e) or repr(e))
+            metrics.JOBS.inc(kind=kind, status="failed")
+        else:
+            await run_in_threadpool(self.store.finish, job_id, self.owner, result, media_type, meta)
+            metrics.JOBS.inc(kind=kind, status="done")
+        finally:
+            heartbeat.cancel()
+        if retry_after is not None:
+            await asyncio.sleep(retry_after)
+            return
+        self._notify(job_id)
+
+    def _notify(self, job_id):
+        finished = self._finished.pop(job_id, None)
+        if finished is not None:
+            finished.set()
+
+
+def build_job_queue(config, handlers, ready=None):
+    """
+    JobQueue from the `jobs` section of config.yaml, or None when disabled. Jobs are
+    opt-in: they need `jobs.sqlite_path`, so no database is created unless configured.
+    """
+    cfg = config.get("jobs") or {}
+    if not cfg.get("enabled", True) or not cfg.get("sqlite_path"):
+        return None
+    store = JobStore(
+        cfg["sqlite_path"],
+        result_ttl_s=cfg.get("result_ttl_s", 3600),
+        max_attempts=cfg.get("max_attempts", 3),
+    )
+    return JobQueue(
+        store, handlers,
+        workers=cfg.get("workers", 2),
+        lease_s=cfg.get("lease_s", 60),
+        poll_s=cfg.get("poll_s", 0.5),
+        max_queued=cfg.get("max_queued", 1000),
+        max_wait_s=cfg.get("max_wait_s", 60),
+        ready=ready,
+    )
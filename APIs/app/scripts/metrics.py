@@ -0,0 +1,192 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond tokenization up to long diffusion runs
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320, 640, 1280)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are read from `fn()` at scrape time ({label tuple: value})."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = self.header()
+        samples = self.fn() if self.fn is not None else {}
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series["count"] if series else 0
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series["counts"]):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': bound})} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format (v0.0.4) registry; no client library needed."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), fn=None):
+        return self.register(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self, names=None, exclude=()):
+        lines = []
+        for metric in self._metrics:
+            if (names is None or metric.name in names) and metric.name not in exclude:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "ai_api_stage_seconds",
+    "Latency of each inference stage (prompt_build, tokenize, generate, decode, image_decode, "
+    "exif_transpose, image_resize, diffusion, image_encode)",
+    ["stage"],
+)
+TOKENS = REGISTRY.counter("ai_api_tokens_total", "Tokens processed by the story model", ["direction"])
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "ai_api_generate_tokens_per_second", "Output tokens per second of each generate call", buckets=RATE_BUCKETS
+)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("ai_api_queue_wait_seconds", "Time spent waiting for an inference slot", ["model"])
+CACHE_REQUESTS = REGISTRY.counter("ai_api_cache_requests_total", "Cache lookups by outcome", ["cache", "result"])
+REQUESTS = REGISTRY.counter("ai_api_requests_total", "HTTP requests by path and status", ["path", "status"])
+ERRORS = REGISTRY.counter("ai_api_errors_total", "HTTP requests that ended in an error status", ["path", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("ai_api_request_seconds", "End-to-end HTTP request latency", ["path"])
+JOBS = REGISTRY.counter("ai_api_jobs_total", "Async jobs by kind and outcome (queued, done, failed)", ["kind", "status"])
+# Recorded by the HTTP process itself; everything else is recorded where the models run
+HTTP_METRICS = (REQUESTS.name, ERRORS.name, REQUEST_SECONDS.name, CACHE_REQUESTS.name, JOBS.name)
+DRAFT_TOKENS = REGISTRY.counter("ai_api_draft_tokens_total", "Draft-model tokens in assisted decoding", ["result"])
+ASSISTED_ACCEPT_RATE = REGISTRY.histogram(
+    "ai_api_assisted_accept_rate", "Share of draft tokens accepted per assisted request",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+ASSISTED_SPEEDUP = REGISTRY.histogram(
+    "ai_api_assisted_speedup", "Assisted tokens/sec over the plain-decoding baseline, per request",
+    buckets=(0.5, 0.75, 1, 1.25, 1.5, 2, 2.5, 3, 4, 6),
+)
+ASSISTED_FALLBACKS = REGISTRY.counter("ai_api_assisted_fallbacks_total", "Assisted calls that fell back to plain decoding")
+SESSION_TURNS = REGISTRY.counter(
+    "ai_api_session_turns_total", "Story session turns by where their KV cache came from (device, cpu, disk, new, reprefill)",
+    ["kv"],
+)
+
+
+@contextmanager
+def stage(name):
+    """Time a block into ai_api_stage_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def record_generation(input_tokens, output_tokens, seconds):
+    TOKENS.inc(input_tokens, direction="input")
+    TOKENS.inc(output_tokens, direction="output")
+    if seconds > 0:
+        TOKENS_PER_SECOND.observe(output_tokens / seconds)
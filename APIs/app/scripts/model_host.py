@@ -0,0 +1,418 @@
+"""
+Model-host process: owns the model weights and serves inference to any number of
+HTTP workers over a Unix socket, so adding uvicorn workers does not copy the models.
+
+    python -m scripts.model_host --socket /tmp/ai-api-models.sock
+    MODEL_HOST_SOCKET=/tmp/ai-api-models.sock uvicorn main:app --workers 4
+
+Framing: every message is `!II` (header length, payload length), a JSON header and
+an optional raw payload, so uploads and encoded images cross the socket without base64.
+Several payloads in one frame are concatenated and split by `header["sizes"]`.
+Each worker keeps one connection and multiplexes requests on it by `id`; a
+`cancel` frame (or a dropped connection) cancels the request on the host, which
+stops its generation at the next token.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import struct
+
+from scripts import metrics
+from scripts.executor import QueueFullError, SessionNotFound
+from scripts.prompts import Prompt, generation_params
+
+FRAME = struct.Struct("!II")
+
+
+async def read_frame(reader):
+    head = await reader.readexactly(FRAME.size)
+    header_len, payload_len = FRAME.unpack(head)
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+def write_frame(writer, header, payload=b""):
+    body = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    writer.write(FRAME.pack(len(body), len(payload)) + body)
+    if payload:
+        writer.write(payload)
+
+
+def join_payloads(blobs):
+    return [len(blob) for blob in blobs], b"".join(blobs)
+
+
+def split_payloads(sizes, payload):
+    view = memoryview(payload)
+    offsets = [0, *itertools.accumulate(sizes)]
+    return [bytes(view[a:b]) for a, b in zip(offsets, offsets[1:])]
+
+
+def prompt_arg(text):
+    """A prompt for the wire: build_prompt's segments when it has them, so the host can compile it."""
+    segments = getattr(text, "segments", None)
+    return [list(segment) for segment in segments] if segments else text
+
+
+def prompt_from_arg(value):
+    return Prompt(value) if isinstance(value, list) else value
+
+
+def error_header(e):
+    if isinstance(e, QueueFullError):
+        return {"status": 429, "error": str(e), "name": e.name, "retry_after": e.retry_after}
+    if isinstance(e, SessionNotFound):
+        return {"status": 404, "error": e.args[0]}
+    return {"status": 422, "error": str(e)}
+
+
+def raise_for_error(header):
+    status = header.get("status", 200)
+    if status == 429:
+        raise QueueFullError(header["name"], header["retry_after"])
+    if status == 404:
+        raise SessionNotFound(header["error"])
+    if status == 503:
+        raise ConnectionError(header["error"])
+    if status != 200:
+        raise RuntimeError(header["error"])
+
+
+class ModelHost:
+    """Serves a LocalInference over a Unix socket (see module docstring for the protocol)."""
+
+    def __init__(self, inference, socket_path):
+        self.inference = inference
+        self.socket_path = socket_path
+
+    async def serve(self):
+        self.inference.start()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._connection, path=self.socket_path)
+        print(f"Model host listening on {self.socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.inference.stop()
+
+    async def _connection(self, reader, writer):
+        tasks = {}
+        lock = asyncio.Lock()
+
+        async def send(header, payload=b""):
+            async with lock:
+                write_frame(writer, header, payload)
+                await writer.drain()
+
+        async def run(request_id, header, payload):
+            try:
+                await self._dispatch(request_id, header, payload, send)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                await send({"id": request_id, **error_header(e)})
+            finally:
+                tasks.pop(request_id, None)
+
+        try:
+            while True:
+                header, payload = await read_frame(reader)
+                request_id = header["id"]
+                if header["op"] == "cancel":
+                    task = tasks.get(request_id)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                tasks[request_id] = asyncio.create_task(run(request_id, header, payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # The worker went away: nobody is waiting for these results any more
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(self, request_id, header, payload, send):
+        inference = self.inference
+        op, args = header["op"], header.get("args", {})
+        reply = {"id": request_id, "status": 200}
+        if op == "ready":
+            ready = {model: await inference.is_ready(model) for model in ("story", "image")}
+            await send({**reply, "ready": ready, "readiness": await inference.readiness()})
+        elif op == "story":
+            story, truncated = await inference.story(
+                prompt_from_arg(args["text"]), seed=args.get("seed"), budget_s=args.get("budget_s"),
+                adapter=args.get("adapter"),
+            )
+            await send({**reply, "story": story, "truncated": truncated})
+        elif op == "story_batch":
+            stories = await inference.story_batch(
+                [prompt_from_arg(text) for text in args["texts"]], adapter=args.get("adapter")
+            )
+            await send({**reply, "stories": stories})
+        elif op == "story_admit":
+            await inference.story_admit(args.get("adapter"))
+            await send(reply)
+        elif op == "story_stream":
+            events = await inference.story_stream(
+                prompt_from_arg(args["text"]), budget_s=args.get("budget_s"), adapter=args.get("adapter")
+            )
+            await send({**reply, "event": "start"})
+            try:
+                async for event in events:
+                    await send({**reply, "event": "data", **event})
+            finally:
+                # Cancelled (worker gone): stop the generation now rather than at garbage collection
+                await events.aclose()
+            await send({**reply, "event": "end"})
+        elif op == "session_start":
+            turn = await inference.session_start(
+                prompt_from_arg(args["text"]), adapter=args.get("adapter"), seed=args.get("seed"),
+                budget_s=args.get("budget_s"),
+            )
+            await send({**reply, "turn": turn})
+        elif op == "session_continue":
+            turn = await inference.session_continue(
+                args["session_id"], args["message"], seed=args.get("seed"), budget_s=args.get("budget_s")
+            )
+            await send({**reply, "turn": turn})
+        elif op == "session_info":
+            await send({**reply, "session": await inference.session_info(args["session_id"])})
+        elif op == "session_delete":
+            await send({**reply, "deleted": await inference.session_delete(args["session_id"])})
+        elif op == "pipeline_key":
+            await send({**reply, "key": list(await inference.pipeline_key(args.get("model_id")))})
+        elif op == "image":
+            encoded, timings, truncated = await inference.image(
+                payload, args["prompt"], args.get("model_id"), args["params"], args.get("output"), args.get("budget_s")
+            )
+            await send({**reply, "timings": timings, "truncated": truncated}, encoded)
+        elif op == "image_chunk":
+            uploads = split_payloads(args["sizes"], payload)
+            items = [(data, prompt, model_id) for data, (prompt, model_id) in zip(uploads, args["items"])]
+            results = await inference.image_chunk(items, args["params"])
+            errors = {i: error_header(r) for i, r in enumerate(results) if isinstance(r, Exception)}
+            sizes, blob = join_payloads([b"" if isinstance(r, Exception) else r for r in results])
+            await send({**reply, "sizes": sizes, "errors": errors}, blob)
+        elif op == "stats":
+            await send({**reply, "stats": await inference.stats()})
+        elif op == "metrics":
+            await send({**reply, "text": metrics.REGISTRY.render(exclude=args.get("exclude", ()))})
+        else:
+            raise ValueError(f"Unknown op {op!r}")
+
+
+class RemoteInference:
+    """
+    Same async interface as LocalInference, served by a model host over `socket_path`.
+    Loads no weights. One multiplexed connection per worker, reopened on demand.
+    """
+
+    def __init__(self, config, socket_path):
+        self.socket_path = socket_path
+        self.gen_params = generation_params(config)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+        self._send_lock = None
+        self._ready = {}
+        self._pipeline_keys = {}
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._send_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                try:
+                    reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                except OSError as e:
+                    # e.g. no socket file yet: callers see one ConnectionError for "host down"
+                    raise ConnectionError(f"model host unavailable at {self.socket_path}: {e}") from e
+                self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                header, payload = await read_frame(reader)
+                queue = self._pending.get(header.get("id"))
+                if queue is not None:
+                    queue.put_nowait((header, payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writer = None
+            for queue in self._pending.values():
+                queue.put_nowait(({"status": 503, "error": "model host connection lost"}, b""))
+
+    async def _send(self, header, payload=b""):
+        async with self._send_lock:
+            write_frame(self._writer, header, payload)
+            await self._writer.drain()
+
+    async def _open(self, op, args, payload=b""):
+        await self._connect()
+        request_id = next(self._ids)
+        queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        await self._send({"id": request_id, "op": op, "args": args}, payload)
+        return request_id, queue
+
+    async def _cancel(self, request_id):
+        self._pending.pop(request_id, None)
+        if self._writer is not None and not self._writer.is_closing():
+            try:
+                await self._send({"id": request_id, "op": "cancel"})
+            except ConnectionError:
+                pass
+
+    async def _call(self, op, args=None, payload=b""):
+        request_id, queue = await self._open(op, args or {}, payload)
+        try:
+            header, payload = await queue.get()
+        except asyncio.CancelledError:
+            # Propagate the disconnect to the host so it stops generating
+            await asyncio.shield(self._cancel(request_id))
+            raise
+        self._pending.pop(request_id, None)
+        raise_for_error(header)
+        return header, payload
+
+    async def is_ready(self, model=None):
+        models = [model] if model else ["story", "image"]
+        # Readiness only ever goes from false to true, so the host is asked until it does
+        if not all(self._ready.get(m) for m in models):
+            try:
+                header, _ = await asyncio.wait_for(self._call("ready"), timeout=5)
+                self._ready = header["ready"]
+            except (OSError, asyncio.TimeoutError):
+                return False
+        return all(self._ready.get(m) for m in models)
+
+    async def readiness(self):
+        try:
+            header, _ = await asyncio.wait_for(self._call("ready"), timeout=5)
+        except (OSError, asyncio.TimeoutError) as e:
+            return {"status": "unavailable", "image": "unavailable", "startup": {}, "error": repr(e)}
+        return header["readiness"]
+
+    async def story(self, text, seed=None, budget_s=None, adapter=None):
+        args = {"text": prompt_arg(text), "seed": seed, "budget_s": budget_s, "adapter": adapter}
+        header, _ = await self._call("story", args)
+        return header["story"], header["truncated"]
+
+    async def story_batch(self, texts, adapter=None):
+        header, _ = await self._call("story_batch", {"texts": [prompt_arg(text) for text in texts], "adapter": adapter})
+        return header["stories"]
+
+    async def story_admit(self, adapter=None):
+        await self._call("story_admit", {"adapter": adapter})
+
+    async def story_stream(self, text, budget_s=None, adapter=None):
+        args = {"text": prompt_arg(text), "budget_s": budget_s, "adapter": adapter}
+        # Admission up front so a full queue is still a 429; the host request itself is only
+        # sent once the stream is consumed, so an unconsumed stream holds no host slot
+        await self.story_admit(adapter)
+
+        async def events():
+            request_id, queue = await self._open("story_stream", args)
+            done = False
+            try:
+                while True:
+                    header, _ = await queue.get()
+                    if header.get("status", 200) != 200:
+                        done = True
+                        self._pending.pop(request_id, None)
+                        raise_for_error(header)
+                    event = header.get("event")
+                    if event == "start":
+                        continue
+                    if event == "end":
+                        done = True
+                        self._pending.pop(request_id, None)
+                        return
+                    yield {k: v for k, v in header.items() if k in ("text", "stats", "error")}
+            finally:
+                if not done:
+                    await asyncio.shield(self._cancel(request_id))
+
+        return events()
+
+    async def session_start(self, text, adapter=None, seed=None, budget_s=None):
+        args = {"text": prompt_arg(text), "adapter": adapter, "seed": seed, "budget_s": budget_s}
+        header, _ = await self._call("session_start", args)
+        return header["turn"]
+
+    async def session_continue(self, session_id, message, seed=None, budget_s=None):
+        args = {"session_id": session_id, "message": message, "seed": seed, "budget_s": budget_s}
+        header, _ = await self._call("session_continue", args)
+        return header["turn"]
+
+    async def session_info(self, session_id):
+        header, _ = await self._call("session_info", {"session_id": session_id})
+        return header["session"]
+
+    async def session_delete(self, session_id):
+        header, _ = await self._call("session_delete", {"session_id": session_id})
+        return header["deleted"]
+
+    async def pipeline_key(self, model_id=None):
+        if model_id not in self._pipeline_keys:
+            header, _ = await self._call("pipeline_key", {"model_id": model_id})
+            self._pipeline_keys[model_id] = tuple(header["key"])
+        return self._pipeline_keys[model_id]
+
+    async def image(self, data, prompt, model_id, params, output=None, budget_s=None):
+        args = {"prompt": prompt, "model_id": model_id, "params": params, "output": output, "budget_s": budget_s}
+        header, encoded = await self._call("image", args, data)
+        return encoded, header["timings"], header["truncated"]
+
+    async def image_chunk(self, items, params):
+        sizes, blob = join_payloads([data for data, _, _ in items])
+        args = {"sizes": sizes, "items": [[prompt, model_id] for _, prompt, model_id in items], "params": params}
+        header, payload = await self._call("image_chunk", args, blob)
+        results = split_payloads(header["sizes"], payload)
+        for index, error in header["errors"].items():
+            results[int(index)] = RuntimeError(error["error"]) if error["status"] != 429 else \
+                QueueFullError(error["name"], error["retry_after"])
+        return results
+
+    async def stats(self):
+        header, _ = await self._call("stats")
+        return header["stats"]
+
+    async def metrics_text(self):
+        """The host's registry (inference stages, tokens, queues) without the worker-side HTTP metrics."""
+        header, _ = await self._call("metrics", {"exclude": list(metrics.HTTP_METRICS)})
+        return header["text"]
+
+
+def main():
+    from scripts.inference import LocalInference
+    from scripts.prompts import get_config
+
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Serve the models to HTTP workers over a Unix socket")
+    parser.add_argument("--socket", default=(config.get("model_host") or {}).get("socket", "/tmp/ai-api-models.sock"))
+    args = parser.parse_args()
+    asyncio.run(ModelHost(LocalInference(config), args.socket).serve())
+
+
+if __name__ == "__main__":
+    main()
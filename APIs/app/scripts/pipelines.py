@@ -0,0 +1,270 @@
+import threading
+from collections import OrderedDict
+
+import torch
+from diffusers import (StableDiffusionImg2ImgPipeline, DPMSolverMultistepScheduler, EulerAncestralDiscreteScheduler,
+                       DDIMScheduler, UniPCMultistepScheduler)
+
+DEFAULT_IMAGE_MODEL = "nitrosocke/Ghibli-Diffusion"
+
+DTYPES = {
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "float32": torch.float32,
+}
+
+
+def resolve_device(device, cpu_fallback=True):
+    """
+    Map the configured device onto one that exists on this host.
+    "cuda" falls back to "cpu" when no GPU is visible and cpu_fallback is enabled.
+    """
+    device = (device or "cpu").strip()
+    if device.startswith("cuda") and not torch.cuda.is_available():
+        if not cpu_fallback:
+            raise RuntimeError(f"Device {device!r} requested but CUDA is not available")
+        print(f"CUDA not available, falling back to CPU for {device!r}")
+        return "cpu"
+    return device
+
+
+def resolve_dtype(dtype, device):
+    """
+    Half precision diffusion is not supported on most CPU kernels, so anything
+    other than float32/bfloat16 is promoted to float32 off the GPU.
+    """
+    torch_dtype = DTYPES.get((dtype or "float16").strip(), torch.float16)
+    if device == "cpu" and torch_dtype == torch.float16:
+        return torch.float32
+    return torch_dtype
+
+
+def pipeline_size_bytes(pipe):
+    total = 0
+    for component in pipe.components.values():
+        if isinstance(component, torch.nn.Module):
+            total += sum(p.numel() * p.element_size() for p in component.parameters())
+            total += sum(b.numel() * b.element_size() for b in component.buffers())
+    return total
+
+
+# Scheduler names usable by image quality tiers: class and config overrides ("default" keeps the pipeline's own)
+SCHEDULERS = {
+    "dpm_multistep": (DPMSolverMultistepScheduler, {}),
+    "dpm_multistep_karras": (DPMSolverMultistepScheduler, {"use_karras_sigmas": True}),
+    "unipc": (UniPCMultistepScheduler, {}),
+    "euler_a": (EulerAncestralDiscreteScheduler, {}),
+    "ddim": (DDIMScheduler, {}),
+}
+
+
+def with_scheduler(pipe, name="default", view=False):
+    """
+    `pipe` itself for "default", else a view sharing its weights with a fresh scheduler.
+    Schedulers keep per-call state (timesteps), so every call gets its own instead of
+    swapping `pipe.scheduler` under concurrent requests. `view=True` always returns a
+    view, for per-call state such as the interrupt flag.
+    """
+    if not name or name == "default":
+        if not view:
+            return pipe
+        scheduler = pipe.scheduler
+    elif name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler {name!r}. Allowed: {['default', *sorted(SCHEDULERS)]}")
+    else:
+        cls, overrides = SCHEDULERS[name]
+        scheduler = cls.from_config(pipe.scheduler.config, **overrides)
+    view = pipe.__class__(
+        **{**pipe.components, "scheduler": scheduler},
+        requires_safety_checker=pipe.config.get("requires_safety_checker", False),
+    )
+    view.set_progress_bar_config(disable=True)
+    return view
+
+
+# Memory savers for large images on small hosts (`image_model.low_memory` in config.yaml)
+LOW_MEMORY_DEFAULTS = {"attention_slicing": "auto", "vae_tiling": True, "vae_slicing": True, "offload": None}
+OFFLOAD_MODES = ("model", "sequential")
+
+
+def low_memory_options(value):
+    """
+    Normalise `image_model.low_memory`: false/null turns every saver off, true turns
+    on attention slicing and VAE tiling/slicing, a mapping overrides those defaults.
+    """
+    if not value:
+        return {}
+    options = dict(LOW_MEMORY_DEFAULTS)
+    if isinstance(value, dict):
+        unknown = set(value) - set(LOW_MEMORY_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown image_model.low_memory keys {sorted(unknown)}. Allowed: {sorted(LOW_MEMORY_DEFAULTS)}")
+        options.update(value)
+    if options["offload"] not in (None, *OFFLOAD_MODES):
+        raise ValueError(f"Unknown image_model.low_memory.offload {options['offload']!r}, expected one of {OFFLOAD_MODES}")
+    return {key: v for key, v in options.items() if v not in (None, False)}
+
+
+def apply_low_memory(pipe, options, device):
+    """
+    Turn on the memory savers in `options` (see low_memory_options) on a freshly loaded
+    pipeline and move it to `device`. They hold on the shared modules, so every
+    scheduler view of the pipeline runs with them.
+
+    - attention_slicing: attention computed a few heads at a time instead of all at once
+    - vae_tiling: images larger than the VAE's tile are encoded/decoded in overlapping tiles
+    - vae_slicing: a batch is decoded one image at a time
+    - offload: "model" keeps one whole model on the GPU at a time, "sequential" one
+      submodule at a time (slowest, least memory); weights wait in CPU RAM. GPU only.
+    """
+    slicing = options.get("attention_slicing")
+    if slicing:
+        pipe.enable_attention_slicing("auto" if slicing is True else slicing)
+    if options.get("vae_tiling"):
+        pipe.vae.enable_tiling()
+    if options.get("vae_slicing"):
+        pipe.vae.enable_slicing()
+    offload = options.get("offload")
+    if offload and not device.startswith("cuda"):
+        print(f"image_model.low_memory.offload={offload!r} needs a GPU; ignored on {device!r}")
+        offload = None
+    if offload == "sequential":
+        pipe.enable_sequential_cpu_offload(device=device)
+    elif offload == "model":
+        pipe.enable_model_cpu_offload(device=device)
+    else:
+        pipe = pipe.to(device)
+    return pipe
+
+
+def native_resolution(pipe):
+    """Side length the pipeline's UNet was trained at (latent sample_size x VAE scale factor)."""
+    sample_size = pipe.unet.config.sample_size
+    if isinstance(sample_size, (list, tuple)):
+        sample_size = max(sample_size)
+    return sample_size * pipe.vae_scale_factor
+
+
+class PipelineRegistry:
+    """
+    Process-wide LRU of warm img2img pipelines keyed by (model_id, dtype, device).
+
+    Pipelines are built lazily on first use and evicted least-recently-used first
+    once the summed weight size goes over `max_bytes`. The most recently used
+    pipeline is never evicted, even if it alone exceeds the budget. `low_memory`
+    holds the memory savers applied to every pipeline (see apply_low_memory).
+    """
+
+    def __init__(self, model_id=DEFAULT_IMAGE_MODEL, dtype="float16", device="cuda",
+                 cpu_fallback=True, max_bytes=None, allowed_models=None, low_memory=None):
+        self.device = resolve_device(device, cpu_fallback)
+        self.dtype = resolve_dtype(dtype, self.device)
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.allowed_models = set(allowed_models or []) | {model_id}
+        self.low_memory = low_memory_options(low_memory)
+        self._pipes = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def key(self, model_id=None):
+        key = (model_id or self.model_id, str(self.dtype).replace("torch.", ""), self.device)
+        if self.low_memory:
+            # Tiled VAE output differs slightly at tile seams, so results are keyed apart
+            key += ("low_memory:" + ",".join(f"{k}={v}" for k, v in sorted(self.low_memory.items())), )
+        return key
+
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def get(self, model_id=None):
+        model_id = model_id or self.model_id
+        if model_id not in self.allowed_models:
+            raise ValueError(f"Image model {model_id!r} is not enabled. Allowed: {sorted(self.allowed_models)}")
+        key = self.key(model_id)
+
+        with self._lock:
+            if key in self._pipes:
+                self._pipes.move_to_end(key)
+                return self._pipes[key]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        # Build outside the registry lock so a cold model does not stall hits on warm ones,
+        # but only once per key when several requests race for the same model.
+        with build_lock:
+            with self._lock:
+                if key in self._pipes:
+                    self._pipes.move_to_end(key)
+                    return self._pipes[key]
+            pipe = self._build(model_id)
+            size = pipeline_size_bytes(pipe)
+            with self._lock:
+                self._pipes[key] = pipe
+                self._sizes[key] = size
+                self._evict()
+            return pipe
+
+    def _build(self, model_id):
+        low_memory = f", low memory: {self.low_memory}" if self.low_memory else ""
+        print(f"Loading image pipeline {model_id} ({self.dtype}, {self.device}{low_memory})")
+        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(model_id, torch_dtype=self.dtype)
+        pipe = apply_low_memory(pipe, self.low_memory, self.device)
+        pipe.set_progress_bar_config(disable=True)
+        return pipe
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        evicted = False
+        while len(self._pipes) > 1 and self.total_bytes() > self.max_bytes:
+            key, _ = self._pipes.popitem(last=False)
+            size = self._sizes.pop(key)
+            evicted = True
+            print(f"Evicting image pipeline {key} ({size / 1024 ** 3:.2f} GB)")
+        if evicted and self.device.startswith("cuda"):
+            torch.cuda.empty_cache()
+
+    def warmup(self):
+        """Build the default pipeline so the first request does not pay for the load."""
+        return self.get(self.model_id)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def configure_image_pipelines(config):
+    """
+    Create the process-wide registry from the `image_model` section of config.yaml.
+    Missing keys keep the previous hardcoded behaviour (Ghibli-Diffusion, float16, cuda).
+    """
+    global _registry
+    cfg = config.get("image_model") or {}
+    max_gb = cfg.get("max_cache_gb")
+    registry = PipelineRegistry(
+        model_id=cfg.get("model_id", DEFAULT_IMAGE_MODEL),
+        dtype=cfg.get("dtype", "float16"),
+        device=cfg.get("device", "cuda"),
+        cpu_fallback=cfg.get("cpu_fallback", True),
+        max_bytes=int(max_gb * 1024 ** 3) if max_gb else None,
+        allowed_models=cfg.get("allowed_models"),
+        low_memory=cfg.get("low_memory"),
+    )
+    with _registry_lock:
+        _registry = registry
+    if cfg.get("warmup", True):
+        registry.warmup()
+    return registry
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PipelineRegistry()
+        return _registry
+
+
+def get_image_pipeline(model_id=None):
+    return get_registry().get(model_id)
@@ -0,0 +1,54 @@
+import copy
+
+import torch
+from transformers import DynamicCache
+
+
+class PrefixCache:
+    """
+    Precomputed key/value cache for the fixed chat-template prefix of every story prompt
+    (chat template opening + storyteller header).
+
+    `generate_kwargs(input_ids)` returns a private copy of the cache when the request's
+    tokens start with the cached prefix, so `generate` only prefills the request-specific
+    brief. Requests whose tokens diverge from the prefix fall back to a full prefill.
+    """
+
+    def __init__(self, model, tokenizer, prefix_text):
+        ids = tokenizer(prefix_text, return_tensors="pt")["input_ids"]
+        # Drop the last token: it may merge with the brief that follows in the full prompt
+        ids = ids[:, :-1]
+        self.ids = ids[0].tolist()
+        self.length = len(self.ids)
+        self.hits = 0
+        self.misses = 0
+        with torch.no_grad():
+            out = model(input_ids=ids.to(model.device), past_key_values=DynamicCache(), use_cache=True)
+        self.cache = out.past_key_values
+
+    def matches(self, input_ids):
+        if input_ids.shape[0] != 1 or input_ids.shape[1] <= self.length:
+            return False
+        return input_ids[0, :self.length].tolist() == self.ids
+
+    def generate_kwargs(self, input_ids):
+        if not self.matches(input_ids):
+            self.misses += 1
+            return {}
+        self.hits += 1
+        # generate() extends the cache in place, so every request gets its own copy
+        return {"past_key_values": copy.deepcopy(self.cache)}
+
+    def stats(self):
+        return {"prefix_tokens": self.length, "hits": self.hits, "misses": self.misses}
+
+
+def build_prefix_cache(model, tokenizer, header_text):
+    """
+    Cache the templated prompt up to the end of `header_text`, i.e. everything that is
+    identical for every story request.
+    """
+    messages = [{"role": "user", "content": header_text}]
+    templated = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    prefix_text = templated[:templated.index(header_text) + len(header_text)]
+    return PrefixCache(model, tokenizer, prefix_text)
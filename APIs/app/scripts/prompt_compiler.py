@@ -0,0 +1,134 @@
+import torch
+from transformers import BatchEncoding
+
+from scripts.prompts import build_prompt, static_segments
+from scripts.pydantic_model import GameGenre, GameTone, PlotTitle, StoryPrompt
+
+# Stands in for the prompt when splitting the chat template into its fixed head and tail
+SENTINEL = "\x00prompt\x00"
+
+# Free-text fields that stress segment boundaries (punctuation, newlines, unicode, digits)
+_CHECK_FIELDS = [
+    {},
+    {"objectives": "Find the key.", "usr_prompt": "(short) — keep it dark!\n\nNo dragons"},
+    {"objectives": "42 coins", "genre": "puzzle", "plot": "the odyssey?", "tone": "  Grim\t"},
+    {"objectives": "Ünïcödé “quotes” 'and' émojis 🐉", "plot": "the split self", "usr_prompt": "...\n- bullet"},
+]
+
+
+def _check_prompts(max_new_tokens):
+    prompts = [build_prompt(StoryPrompt(**fields), max_new_tokens) for fields in _CHECK_FIELDS]
+    for i, plot in enumerate(PlotTitle):
+        genres, tones = list(GameGenre), list(GameTone)
+        message = StoryPrompt(
+            objectives="Escape.", genre=genres[i % len(genres)].value, plot=plot.value,
+            tone=tones[i % len(tones)].value, usr_prompt=str(i),
+        )
+        prompts.append(build_prompt(message, max_new_tokens))
+    return prompts
+
+
+class PromptCompiler:
+    """
+    Token ids for build_prompt output without tokenizing the whole chat-templated string.
+
+    The chat template's head and tail and every static prompt segment are tokenized once;
+    a request only tokenizes its free-text lines. Segments are split right after a newline,
+    before a letter, where byte-level BPE pre-tokenizers never merge across, so the
+    joined ids equal the text path's. `verify` checks that for this tokenizer and
+    build_prompt_compiler disables the compiler if it does not hold.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        messages = [{"role": "user", "content": SENTINEL}]
+        templated = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        head, tail = templated.split(SENTINEL)
+        # The head goes through the tokenizer the way the full text does (BOS etc.)
+        self.head_ids = tokenizer(head)["input_ids"]
+        self.tail_ids = self._encode(tail)
+        self.segment_ids = {text: self._encode(text) for text in static_segments()}
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(self, text):
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def rows(self, prompts):
+        """
+        Token ids of each chat-templated prompt, or None if any prompt is a plain string
+        without segments. Uncached segments of all prompts are tokenized in one call.
+        """
+        segments = [getattr(prompt, "segments", None) for prompt in prompts]
+        if not all(segments):
+            return None
+        missing = list({text: None for parts in segments for text, _ in parts if text not in self.segment_ids})
+        fresh = dict(zip(missing, self.tokenizer(missing, add_special_tokens=False)["input_ids"])) if missing else {}
+        rows = []
+        for parts in segments:
+            ids = list(self.head_ids)
+            for text, static in parts:
+                cached = self.segment_ids.get(text)
+                if cached is None:
+                    self.misses += 1
+                    cached = fresh[text]
+                    if static:
+                        # Static segments are a small closed set (e.g. one constraints line per max_new_tokens)
+                        self.segment_ids[text] = cached
+                else:
+                    self.hits += 1
+                ids += cached
+            ids += self.tail_ids
+            rows.append(ids)
+        return rows
+
+    def input_ids(self, prompt):
+        """Token ids of one chat-templated prompt (None for a plain string)."""
+        rows = self.rows([prompt])
+        return rows[0] if rows is not None else None
+
+    def encode(self, prompts):
+        """
+        Same BatchEncoding as tokenizing the chat-templated prompts (padded on the
+        tokenizer's padding side when several); None if any prompt has no segments.
+        """
+        rows = self.rows(prompts)
+        if rows is None:
+            return None
+        width = max(len(row) for row in rows)
+        input_ids = torch.full((len(rows), width), self.tokenizer.pad_token_id or 0, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, row in enumerate(rows):
+            cols = slice(width - len(row), width) if self.tokenizer.padding_side == "left" else slice(0, len(row))
+            input_ids[i, cols] = torch.tensor(row, dtype=torch.long)
+            attention_mask[i, cols] = 1
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+    def verify(self, max_new_tokens):
+        """Compare against the text path on prompts covering every static segment; returns the mismatches."""
+        mismatches = []
+        for prompt in _check_prompts(max_new_tokens):
+            messages = [{"role": "user", "content": str(prompt)}]
+            text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            if self.tokenizer(text)["input_ids"] != self.input_ids(prompt):
+                mismatches.append(str(prompt))
+        self.hits = self.misses = 0
+        return mismatches
+
+    def stats(self):
+        return {"cached_segments": len(self.segment_ids), "hits": self.hits, "misses": self.misses}
+
+
+def build_prompt_compiler(tokenizer, max_new_tokens):
+    """A verified PromptCompiler for `tokenizer`, or None when its ids would differ from the text path."""
+    try:
+        compiler = PromptCompiler(tokenizer)
+    except ValueError as e:
+        # Chat template that does not embed the prompt verbatim
+        print(f"Prompt compiler disabled: {e!r}")
+        return None
+    mismatches = compiler.verify(max_new_tokens)
+    if mismatches:
+        print(f"Prompt compiler disabled: {len(mismatches)} prompts tokenize differently from the text path")
+        return None
+    return compiler
@@ -0,0 +1,197 @@
+import os
+
+import yaml
+
+from scripts.pydantic_model import GameGenre, GameTone, PLOT_INFO, PLOT_BY_NAME
+
+TOKENS = 128
+TEMPERATURE = 0.2
+TOP_P = 0.8
+
+# img2img parameters (part of the image result cache key)
+IMAGE_STRENGTH = 0.75
+IMAGE_GUIDANCE = 7.5
+IMAGE_STEPS = 50
+IMAGE_SEED = 1024
+
+# Load configuration (APP_CONFIG overrides the path, e.g. for benchmarks)
+def get_config():
+    with open(os.environ.get("APP_CONFIG", "config/config.yaml")) as f:
+        config = yaml.safe_load(f)
+    return config
+
+def generation_params(config):
+    """Story generation parameters from the `generation` section of config.yaml."""
+    gen_cfg = config.get("generation") or {}
+    return {
+        "max_new_tokens": gen_cfg.get("max_new_tokens", 256),
+        "temperature": gen_cfg.get("temperature", TEMPERATURE),
+        "top_p": gen_cfg.get("top_p", TOP_P),
+    }
+
+# Image quality tiers: scheduler (see scripts/pipelines.py), step count and `scale`, a fraction of
+# the decode resolution (image_io.max_side or the pipeline's native size). "final" is the original
+# behaviour; override or add tiers under image_quality.tiers in config.yaml
+IMAGE_TIERS = {
+    "preview": {"scheduler": "dpm_multistep", "num_inference_steps": 8, "scale": 0.5},
+    "standard": {"scheduler": "dpm_multistep", "num_inference_steps": 20, "scale": 1.0},
+    "final": {"scheduler": "default", "num_inference_steps": IMAGE_STEPS, "scale": 1.0},
+}
+DEFAULT_IMAGE_TIER = "final"
+
+
+def image_tiers(config=None):
+    tiers = {name: dict(tier) for name, tier in IMAGE_TIERS.items()}
+    for name, overrides in (((config or {}).get("image_quality") or {}).get("tiers") or {}).items():
+        tiers[name] = {**tiers.get(name, IMAGE_TIERS[DEFAULT_IMAGE_TIER]), **overrides}
+    return tiers
+
+
+def image_params(config=None, tier=None):
+    """img2img parameters of a quality tier (image_quality.default_tier when `tier` is None)."""
+    tiers = image_tiers(config)
+    tier = tier or ((config or {}).get("image_quality") or {}).get("default_tier", DEFAULT_IMAGE_TIER)
+    if tier not in tiers:
+        raise ValueError(f"Unknown quality tier {tier!r}. Allowed: {sorted(tiers)}")
+    return {
+        "strength": IMAGE_STRENGTH,
+        "guidance_scale": IMAGE_GUIDANCE,
+        "num_inference_steps": IMAGE_STEPS,
+        "seed": IMAGE_SEED,
+        "scheduler": "default",
+        "scale": 1.0,
+        **tiers[tier],
+    }
+
+
+# Construct chat prompt
+
+# Fixed storyteller header that opens every story prompt (its KV cache is precomputed, see scripts/prefix_cache.py)
+STORY_HEADER = (
+    "You are a gifted storyteller. Produce polished, original fiction that follows the brief exactly and never explains its private reasoning.",
+    "When uncertain, make the best good-faith assumption and proceed—no clarifying questions.\n",
+    "Do not include explanations, thinking or meta text—return only the requested output. Take into account the following characteristics of the story\n",
+)
+
+
+def story_header_text():
+    """The header exactly as it appears at the start of build_prompt's output."""
+    return "\n".join(part.strip() for part in STORY_HEADER if part and part.strip())
+
+
+class Prompt(str):
+    """
+    build_prompt's text, which also keeps the segments it was joined from as
+    (text, static) pairs. Static segments are the same for every request (header,
+    enum-valued lines, plot blocks, constraints), so scripts/prompt_compiler.py can
+    reuse their token ids. Everywhere else it is just the prompt string.
+    """
+
+    def __new__(cls, segments):
+        prompt = super().__new__(cls, "".join(text for text, _ in segments))
+        prompt.segments = [(text, static) for text, static in segments]
+        return prompt
+
+
+# Precomputed segments; every segment but the last ends with the newline that joins it to the next
+HEADER_SEGMENTS = [(line + "\n", True) for line in story_header_text().split("\n")]
+GENRE_SEGMENTS = {genre.value: f"Genre: {genre.value}\n" for genre in GameGenre}
+TONE_SEGMENTS = {tone.value: f"Tone: {tone.value}\n" for tone in GameTone}
+PLOT_SEGMENTS = {
+    plot: f"Plot Archetype: {plot.value}\nPlot Description: {description}\nUniversal Reference: {reference}\n"
+    for plot, (description, reference) in PLOT_INFO.items()
+}
+
+
+def static_segments():
+    """Every static segment known before a request arrives (the constraints line depends on max_new_tokens)."""
+    return (
+        [text for text, _ in HEADER_SEGMENTS]
+        + list(GENRE_SEGMENTS.values()) + list(TONE_SEGMENTS.values()) + list(PLOT_SEGMENTS.values())
+    )
+
+
+def build_prompt(message, max_new_tokens=TOKENS):
+    """
+    Build a clean, production-ready storytelling prompt from a StoryPrompt-like object.
+    Expected attrs on `message`:
+      - objectives (str | None)
+      - genre (str | None)
+      - plot (str | None)              # plot archetype
+      - tone (str | None)
+      - extra_prompt (str | None)
+    Returns a Prompt (a str carrying its segments, see above).
+    """
+
+    def line(label, value, known=None):
+        value = (value or "").strip()
+        if not value:
+            return []
+        if known is not None and value in known:
+            return [(known[value], True)]
+        return [(f"{label}: {value}\n", False)]
+
+    # Core header
+    segments = list(HEADER_SEGMENTS)
+
+    # Brief (include only when present)
+    segments += line("Objective", getattr(message, "objectives", None))
+    segments += line("Genre", getattr(message, "genre", None), GENRE_SEGMENTS)
+
+    # Plot with detailed info when it names a known archetype (case-insensitive), else the raw value
+    plot_title = (getattr(message, "plot", None) or "").strip()
+    plot = PLOT_BY_NAME.get(plot_title.casefold())
+    if plot is not None:
+        segments.append((PLOT_SEGMENTS[plot], True))
+    else:
+        segments += line("Plot Archetype", plot_title)
+
+    segments += line("Tone", getattr(message, "tone", None), TONE_SEGMENTS)
+    segments += line("Additional Notes", getattr(message, "usr_prompt", None))
+
+    # Lightweight constraints (tweak as needed)
+    segments.append((
+        "Constraints:\n"
+        f"- Target length: {max_new_tokens} tokens maximum.",
+        #"- Clear arc with beginning → middle → end.\n"
+        #"- Show, don't tell; concrete sensory detail; strong verbs.\n"
+        #"- Avoid clichés and generic filler; keep it culturally respectful.\n"
+        #"- End with a resonant image or line that ties back to the Objective.\n"
+        True,
+    ))
+    return Prompt(segments)
+
+
+# ---------- Prompt builder ----------
+def build_sd_prompts(msg):
+
+    def _part(label, value):
+        return f"{label}: {value}" if value else None
+
+    # Generate prompt from aesthetics template
+    tech = msg.technology.value if msg.technology else "2D/3D"
+    bits = [f"{tech} game visual"]
+    if msg.char_env_item:
+        bits.append(f"{msg.char_env_item.value.lower()} for characters, environments, and items")
+    if msg.typo_menu:
+        bits.append(f"{msg.typo_menu.value.lower()} for typography and menus")
+    if msg.maps:
+        bits.append(f"{msg.maps.value.lower()} for maps")
+    core = ", ".join(bits).rstrip(", ") + "."
+    
+
+    constraints = list(filter(None, [
+        _part("Game Visual Style (Characters/Environments/Items)", msg.char_env_item.value if msg.char_env_item else None),
+        _part("Typography & Menus", msg.typo_menu.value if msg.typo_menu else None),
+        _part("Maps", msg.maps.value if msg.maps else None),
+        _part("Art Technology", msg.technology.value if msg.technology else None),
+    ]))
+
+    constraint_block = ""
+    if constraints:
+        constraint_block = "\n\n[Style Constraints]\n" + "\n".join(constraints)
+
+    positive_prompt = core + constraint_block
+
+    return positive_prompt
+    
\ No newline at end of file
@@ -48,6 +48,14 @@ class PlotTitle(str, Enum):
     THE_THIRST_FOR_POWER = "The Thirst for Power"
     THE_CREATION_OF_ARTIFICIAL_LIFE = "The Creation of Artificial Life"
 
+# Casefolded value -> member, built once for the case-insensitive validators and build_prompt
+def _casefold_index(enum):
+    return {member.value.casefold(): member for member in enum}
+
+GENRE_BY_NAME: Dict[str, GameGenre] = _casefold_index(GameGenre)
+TONE_BY_NAME: Dict[str, GameTone] = _casefold_index(GameTone)
+PLOT_BY_NAME: Dict[str, PlotTitle] = _casefold_index(PlotTitle)
+
 # --- Plot metadata ---
 
 PLOT_INFO: Dict[PlotTitle, Tuple[str, str]] = {
@@ -147,9 +155,9 @@ class StoryInputs(BaseModel):
         if isinstance(v, GameGenre):
             return v
         if isinstance(v, str):
-            for g in GameGenre:
-                if v.strip().casefold() == g.value.casefold():
-                    return g
+            g = GENRE_BY_NAME.get(v.strip().casefold())
+            if g is not None:
+                return g
         raise ValueError(f"Invalid genre: {v!r}. Allowed: {[g.value for g in GameGenre]}")
 
     @field_validator("tone", mode="before")
@@ -160,9 +168,9 @@ class StoryInputs(BaseModel):
         if isinstance(v, GameTone):
             return v
         if isinstance(v, str):
-            for t in GameTone:
-                if v.strip().casefold() == t.value.casefold():
-                    return t
+            t = TONE_BY_NAME.get(v.strip().casefold())
+            if t is not None:
+                return t
         raise ValueError(f"Invalid tone: {v!r}. Allowed: {[t.value for t in GameTone]}")
 
     @field_validator("plot_title", mode="before")
@@ -173,9 +181,9 @@ class StoryInputs(BaseModel):
         if isinstance(v, PlotTitle):
             return v
         if isinstance(v, str):
-            for p in PlotTitle:
-                if v.strip().casefold() == p.value.casefold():
-                    return p
+            p = PLOT_BY_NAME.get(v.strip().casefold())
+            if p is not None:
+                return p
         raise ValueError(f"Invalid plot_title: {v!r}. Allowed: {[p.value for p in PlotTitle]}")
 
     # Convenience accessors
@@ -211,6 +219,22 @@ class StoryPrompt(BaseModel):
     plot: str = Field(default="")
     tone: str = Field(default="")
     usr_prompt: str = Field(default="")
+    seed: Optional[int] = Field(default=None)
+    # Optional LoRA style adapter on the story model (see adapters in config.yaml); None: base model
+    adapter: Optional[str] = Field(default=None)
+    # Optional time budget in seconds; the story generated so far is returned with truncated=true
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+
+
+class StoryBatchRequest(BaseModel):
+    items: List[StoryPrompt] = Field(default_factory=list)
+
+
+class SessionMessage(BaseModel):
+    # Follow-up user turn of a story session, e.g. "Continue with the heist" or "Revise the ending"
+    message: str = Field(min_length=1)
+    seed: Optional[int] = Field(default=None)
+    timeout_s: Optional[float] = Field(default=None, gt=0)
 
 
 
@@ -255,11 +279,17 @@ class AestheticsMessage(BaseModel):
     - char_env_item, typo_menu, and maps: choose from GameStyle5
     - technology: choose from TechChoice
     - prompt will be generated from template based on aesthetics
+    - style_model: optional diffusion model id; must be listed in image_model.allowed_models
+    - quality: optional tier name, e.g. "preview", "standard" or "final" (see image_quality in config.yaml)
+    - timeout_s: optional time budget in seconds; diffusion stops early and the partial image is returned
     """
     char_env_item: Optional[GameStyle5] = Field(default=None)
     typo_menu: Optional[GameStyle5] = Field(default=None)
     maps: Optional[GameStyle5] = Field(default=None)
     technology: Optional[TechChoice] = Field(default=None)
+    style_model: Optional[str] = Field(default=None)
+    quality: Optional[str] = Field(default=None)
+    timeout_s: Optional[float] = Field(default=None, gt=0)
 
 
 # ----------------------------
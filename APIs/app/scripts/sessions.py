@@ -0,0 +1,287 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache
+
+from scripts.executor import SessionNotFound
+
+# Where a session's KV cache currently lives; None means it was dropped and the next turn re-prefills
+TIERS = ("device", "cpu", "disk")
+
+
+def kv_bytes(cache):
+    return sum(t.numel() * t.element_size() for t in (*cache.key_cache, *cache.value_cache))
+
+
+def kv_to(cache, device):
+    """A DynamicCache with every layer's keys and values on `device`."""
+    return DynamicCache.from_legacy_cache(
+        tuple((k.to(device), v.to(device)) for k, v in cache.to_legacy_cache())
+    )
+
+
+def turn_glue(tokenizer):
+    """
+    Chat-template text (between, after) around a follow-up user turn: `between` closes the
+    previous assistant reply and opens the user turn, `after` closes it and opens the next
+    reply. Cut out of a rendered three-message conversation, so it works for any template
+    that renders assistant turns.
+    """
+    marks = ("\x00A\x00", "\x00B\x00", "\x00C\x00")
+    messages = [
+        {"role": "user", "content": marks[0]},
+        {"role": "assistant", "content": marks[1]},
+        {"role": "user", "content": marks[2]},
+    ]
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    between = text[text.index(marks[1]) + len(marks[1]):text.index(marks[2])]
+    after = text[text.index(marks[2]) + len(marks[2]):]
+    return between, after
+
+
+class StorySession:
+    def __init__(self, adapter=None):
+        self.id = uuid.uuid4().hex
+        self.adapter = adapter
+        # Token ids of the whole conversation so far: the source of truth the KV cache is a prefix of
+        self.ids = []
+        self.turns = []
+        self.kv = None
+        self.kv_bytes = 0
+        self.tier = None
+        self.path = None
+        self.created = time.time()
+        self.last_used = self.created
+        # Turns of one session run one after another
+        self.lock = threading.Lock()
+        self.busy = False
+
+    def view(self):
+        return {
+            "session_id": self.id,
+            "adapter": self.adapter,
+            "turns": list(self.turns),
+            "tokens": len(self.ids),
+            "kv": self.tier,
+            "kv_mb": round(self.kv_bytes / 1024 ** 2, 2),
+            "created": self.created,
+            "last_used": self.last_used,
+        }
+
+
+class SessionStore:
+    """
+    Multi-turn story sessions whose KV cache stays server-side between turns, so a
+    continuation only prefills the new user turn instead of the whole conversation.
+
+    Caches live on the model device up to `max_device_bytes`; past that, the least
+    recently used idle sessions are moved to CPU RAM (`max_cpu_bytes`, only when the
+    model is on an accelerator), then saved under `disk_dir` (`max_disk_bytes`), then
+    dropped. A session keeps its token ids wherever its cache is, so a dropped cache
+    only costs one full re-prefill on the next turn. Sessions idle for `ttl_s` expire;
+    beyond `max_sessions` the least recently used idle one is closed.
+    """
+
+    def __init__(self, device, glue, max_device_bytes, max_cpu_bytes=0, disk_dir=None, max_disk_bytes=0,
+                 ttl_s=1800, max_sessions=256, max_tokens=None):
+        self.device = torch.device(device)
+        self.glue = glue
+        self.budgets = {
+            "device": max_device_bytes,
+            # A CPU tier under a CPU model would only move bytes between identical places
+            "cpu": max_cpu_bytes if self.device.type != "cpu" else 0,
+            "disk": max_disk_bytes if disk_dir else 0,
+        }
+        self.disk_dir = disk_dir
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self._sessions = OrderedDict()   # id -> StorySession, least recently used first
+        self._lock = threading.Lock()
+        self.moves = {tier: 0 for tier in TIERS}
+        self.drops = 0
+        self._disk_ready = False
+
+    def used(self, tier):
+        return sum(s.kv_bytes for s in self._sessions.values() if s.tier == tier)
+
+    def create(self, adapter=None):
+        session = StorySession(adapter)
+        with self._lock:
+            self._expire()
+            while len(self._sessions) >= self.max_sessions:
+                idle = next((s for s in self._sessions.values() if not s.busy), None)
+                if idle is None:
+                    break
+                self._close(idle)
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(f"Unknown or expired session {session_id!r}")
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._close(session)
+            return True
+
+    def turn_ids(self, tokenizer, message):
+        between, after = self.glue
+        return tokenizer(between + message + after, add_special_tokens=False)["input_ids"]
+
+    def check_length(self, n_tokens):
+        if self.max_tokens is not None and n_tokens > self.max_tokens:
+            raise ValueError(f"Session is too long: {n_tokens} tokens with the reply, limit {self.max_tokens}")
+
+    def checkout(self, session):
+        """
+        The session's KV cache on the model device and where it was found ("device",
+        "cpu", "disk", or None when it was dropped). The session is not evicted until
+        `checkin` or `release`.
+        """
+        with self._lock:
+            session.busy = True
+            source = session.tier
+            if source == "cpu":
+                session.kv = kv_to(session.kv, self.device)
+            elif source == "disk":
+                legacy = torch.load(session.path, map_location=self.device, weights_only=True)
+                session.kv = DynamicCache.from_legacy_cache(legacy)
+                self._remove_file(session)
+            if source is not None:
+                session.tier = "device"
+            return session.kv, source
+
+    def checkin(self, session, ids, cache, turns):
+        """Store the conversation after a turn and its KV cache, then move caches down to stay within budget."""
+        with self._lock:
+            session.ids = ids
+            session.turns.extend(turns)
+            session.kv = cache
+            session.kv_bytes = kv_bytes(cache)
+            session.tier = "device"
+            self._release(session)
+
+    def release(self, session, keep_cache=True):
+        """End a turn without new state; `keep_cache=False` drops a cache a failed turn may have half-extended."""
+        with self._lock:
+            if not keep_cache:
+                self._drop(session)
+            self._release(session)
+
+    def _release(self, session):
+        session.busy = False
+        session.last_used = time.time()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+            self._enforce()
+        else:
+            # Closed while the turn was running
+            self._drop(session)
+
+    def _enforce(self):
+        for tier in TIERS:
+            for session in list(self._sessions.values()):
+                if self.used(tier) <= self.budgets[tier]:
+                    break
+                if session.tier == tier and not session.busy:
+                    self._demote(session)
+
+    def _demote(self, session):
+        if session.tier == "device" and self.budgets["cpu"]:
+            session.kv = kv_to(session.kv, "cpu")
+            session.tier = "cpu"
+        elif session.tier in ("device", "cpu") and self.budgets["disk"]:
+            if not self._disk_ready:
+                # Created on first use; anything there is left from an earlier process with this pid
+                shutil.rmtree(self.disk_dir, ignore_errors=True)
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._disk_ready = True
+            session.path = os.path.join(self.disk_dir, f"{session.id}.pt")
+            torch.save(tuple((k.cpu(), v.cpu()) for k, v in session.kv.to_legacy_cache()), session.path)
+            session.kv = None
+            session.tier = "disk"
+        else:
+            self._drop(session)
+            return
+        self.moves[session.tier] += 1
+
+    def _drop(self, session):
+        if session.tier is not None:
+            self.drops += 1
+        self._remove_file(session)
+        session.kv = None
+        session.kv_bytes = 0
+        session.tier = None
+
+    def _remove_file(self, session):
+        if session.path is not None:
+            try:
+                os.remove(session.path)
+            except FileNotFoundError:
+                pass
+            session.path = None
+
+    def _close(self, session):
+        del self._sessions[session.id]
+        if not session.busy:
+            self._drop(session)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_s
+        for session in [s for s in self._sessions.values() if s.last_used < cutoff and not s.busy]:
+            self._close(session)
+
+    def close(self):
+        """Close every session and remove this process's disk tier directory (shutdown)."""
+        with self._lock:
+            for session in list(self._sessions.values()):
+                self._close(session)
+            if self._disk_ready:
+                shutil.rmtree(self.disk_dir, ignore_errors=True)
+                self._disk_ready = False
+
+    def stats(self):
+        with self._lock:
+            mb = {tier: round(self.used(tier) / 1024 ** 2, 2) for tier in TIERS}
+            return {
+                "sessions": len(self._sessions),
+                "kv_mb": mb,
+                "budget_mb": {tier: round(b / 1024 ** 2, 2) for tier, b in self.budgets.items()},
+                "moved_to": dict(self.moves),
+                "dropped": self.drops,
+            }
+
+
+def build_session_store(model, tokenizer, config):
+    """SessionStore from the `sessions` section of config.yaml, or None when sessions are disabled."""
+    cfg = config.get("sessions") or {}
+    if not cfg.get("enabled", True):
+        return None
+    mb = lambda key, default: int((cfg.get(key, default) or 0) * 1024 ** 2)
+    # Opt-in: without disk_dir, caches past the RAM budgets are dropped and re-prefilled
+    disk_dir = cfg.get("disk_dir")
+    return SessionStore(
+        model.device, turn_glue(tokenizer),
+        max_device_bytes=mb("max_device_mb", 512),
+        max_cpu_bytes=mb("max_cpu_mb", 2048),
+        # Session caches only make sense to the process that created them
+        disk_dir=os.path.join(disk_dir, str(os.getpid())) if disk_dir else None,
+        max_disk_bytes=mb("max_disk_mb", 8192),
+        ttl_s=cfg.get("ttl_s", 1800),
+        max_sessions=cfg.get("max_sessions", 256),
+        max_tokens=cfg.get("max_tokens") or getattr(model.config, "max_position_embeddings", None),
+    )
@@ -0,0 +1,130 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts import utils as util
+from scripts.pipelines import configure_image_pipelines
+from scripts.prefix_cache import build_prefix_cache
+from scripts.prompt_compiler import build_prompt_compiler
+from scripts.assisted import build_assisted_decoder
+from scripts.adapters import build_adapter_registry
+from scripts.sessions import build_session_store
+
+
+class ModelState:
+    """
+    Models owned by the API process, loaded on a background thread so the server
+    accepts connections (and answers liveness probes) while weights are loading.
+
+    The tokenizer loads alongside the causal LM and optional draft model; the prompt
+    compiler, prefix KV cache, assisted decoder, LoRA adapter registry and story session
+    store are built once they are available, and `ready` (story endpoints) is set. The
+    image pipeline loads after that, setting `image_ready`: every weight load runs under
+    the same process-global empty-weights patches, so they never overlap, and the story
+    endpoints do not wait for the diffusion warmup.
+    `timings` holds the seconds spent in each phase and is reported by the readiness probe.
+    """
+
+    def __init__(self):
+        self.tokenizer = None
+        self.model = None
+        self.prefix_cache = None
+        self.prompt_compiler = None
+        self.assistant = None
+        self.adapters = None
+        self.sessions = None
+        self.image_pipelines = None
+        self.ready = False
+        self.error = None
+        self.image_ready = False
+        self.image_error = None
+        self.timings = {}
+        self._thread = None
+
+    @property
+    def status(self):
+        if self.ready:
+            return "ready"
+        return "failed" if self.error else "loading"
+
+    @property
+    def image_status(self):
+        if self.image_ready:
+            return "ready"
+        return "failed" if self.image_error or self.error else "loading"
+
+    def start(self, config):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, args=(config,), name="model-loader", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def _load(self, config):
+        start = time.perf_counter()
+        try:
+            # Only the tokenizer (no weights) loads alongside the models
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load") as pool:
+                tokenizer = pool.submit(util.timed, self.timings, "tokenizer", util.load_tokenizer, config)
+                models = pool.submit(self._load_models, config)
+                self.tokenizer, (self.model, draft_model) = tokenizer.result(), models.result()
+
+            # Token ids of the fixed prompt segments, so requests only tokenize their free-text fields
+            if config["model"].get("prompt_compiler", True):
+                self.prompt_compiler = util.timed(
+                    self.timings, "prompt_compiler", build_prompt_compiler,
+                    self.tokenizer, util.generation_params(config)["max_new_tokens"],
+                )
+
+            if draft_model is not None:
+                self.assistant = util.timed(
+                    self.timings, "assisted_decoding", build_assisted_decoder, self.model, self.tokenizer, draft_model, config
+                )
+                if self.assistant is not None:
+                    print(f"Assisted decoding: baseline {self.assistant.baseline_tokens_per_sec:.1f} tokens/sec")
+
+            # KV cache of the fixed chat-template + storyteller header, computed once per model
+            if config["model"].get("prefix_cache", True):
+                self.prefix_cache = util.timed(
+                    self.timings, "prefix_cache", build_prefix_cache, self.model, self.tokenizer, util.story_header_text()
+                )
+                print(f"Prefix cache: {self.prefix_cache.length} tokens")
+
+            # LoRA style adapters attached to the same model on demand (after the base-model caches above)
+            if config.get("adapters"):
+                self.adapters = util.timed(self.timings, "adapters", build_adapter_registry, self.model, config)
+                if self.adapters is not None:
+                    print(f"Adapters: {self.adapters.names()}")
+
+            # Multi-turn story sessions keep their KV caches between turns
+            self.sessions = build_session_store(self.model, self.tokenizer, config)
+            self.ready = True
+            self.timings["story_ready"] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            self.error = repr(e)
+            traceback.print_exc()
+
+        if self.error is None:
+            # After the story models: SD and its CLIP text encoder load under the same global
+            # init patches that concurrent from_pretrained calls race on
+            try:
+                self.image_pipelines = util.timed(self.timings, "image_pipeline", configure_image_pipelines, config)
+                self.image_ready = True
+            except Exception as e:
+                self.image_error = repr(e)
+                traceback.print_exc()
+
+        self.timings["total"] = round(time.perf_counter() - start, 3)
+        print(f"Startup story {self.status}, image {self.image_status} in {self.timings['total']:.2f} sec: {self.timings}")
+
+    def _load_models(self, config):
+        # Story model and draft load one after the other: concurrent low_cpu_mem_usage
+        # loads race on the same global empty-weights patch
+        model = util.timed(self.timings, "model", util.load_model, config)
+        draft_model = util.timed(self.timings, "draft_model", util.load_draft_model, config)
+        return model, draft_model
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
@@ -1,203 +1,460 @@
+import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import torch
-import yaml
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from PIL import Image
-from io import BytesIO
-from diffusers import StableDiffusionImg2ImgPipeline
+from transformers import (AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer, StoppingCriteria,
+                          StoppingCriteriaList, LogitsProcessor, LogitsProcessorList, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+from scripts.pipelines import get_image_pipeline, native_resolution, with_scheduler
+from scripts import metrics
+# Prompt building and config helpers live in scripts/prompts.py (no torch import) and are re-exported here
+from scripts.prompts import (
+    TOKENS, TEMPERATURE, TOP_P, IMAGE_STRENGTH, IMAGE_GUIDANCE, IMAGE_STEPS, IMAGE_SEED,
+    get_config, generation_params, image_params, image_tiers, STORY_HEADER, story_header_text, build_prompt, build_sd_prompts,
+)
 
-TOKENS = 128
-
-# Load configuration
-def get_config():
-    with open("config/config.yaml") as f:
-        config = yaml.safe_load(f)
-    return config
 
 # Load Model and Tokenizer
-def load_model_and_tokenizer(config):
+# Precision modes for the story model (`model.precision` in config.yaml)
+PRECISIONS = ("auto", "float32", "bfloat16", "float16", "int8")
+
+
+def model_precision(config):
+    precision = config["model"].get("precision") or "auto"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model.precision {precision!r}, expected one of {PRECISIONS}")
+    return precision
+
+
+def precision_dtype(precision, config, device):
+    """torch dtype the checkpoint is loaded in for a precision mode."""
+    if precision == "auto":
+        # Original behaviour: bfloat16 where the GPU supports it, float16 otherwise
+        if config["model"]["dtype"] == "bfloat16" and torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        return torch.float16
+    if precision == "int8":
+        # Dynamic quantization starts from float32 weights
+        return torch.float32
+    return getattr(torch, precision)
+
+
+def quantize_int8(model):
+    """int8 dynamic quantization of every nn.Linear (weights int8, activations quantized per batch)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_size_bytes(model):
+    """Bytes held by the weights, including packed int8 Linear weights (not in model.parameters())."""
+    def size(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(size(v) for v in value)
+        return 0
+    return sum(size(v) for v in model.state_dict().values())
+
+
+def load_model(config, precision=None):
+    precision = precision or model_precision(config)
+
     # Check for GPU
-    
-    if config["model"]["device"] == "cuda":
+    if config["model"]["device"] == "cuda" and precision != "int8":
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     else:
+        # Dynamically quantized kernels only run on CPU
         device = "cpu"
-    print('Device: ', device)
-
-    # Check for bfloat16
-    if config["model"]["dtype"] == "bfloat16":
-        if torch.cuda.is_bf16_supported():
-            torch_dtype = torch.bfloat16
-        else:
-            torch_dtype = torch.float16
-    else:
-        torch_dtype = torch.float16
+    print('Device: ', device, 'Precision: ', precision)
+
+    torch_dtype = precision_dtype(precision, config, device)
 
+    # low_cpu_mem_usage loads weights straight into place; safetensors checkpoints are memory-mapped
     model = AutoModelForCausalLM.from_pretrained(
             config["model"]["base_model_path"],
             device_map=device,
             torch_dtype=torch_dtype,
             trust_remote_code=True,
+            low_cpu_mem_usage=True,
         )
 
     model.eval().to(device)
-    total_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
-    model_size_gb = total_bytes / (1024 ** 3)
+    if precision == "int8":
+        model = quantize_int8(model)
+    model_size_gb = model_size_bytes(model) / (1024 ** 3)
     print(f"Estimated model size: {model_size_gb:.2f} GB")
     print("---Successfully Merged and Unload Peft Model.---")
+    return model
+
+
+def load_draft_model(config):
+    """Draft model for assisted decoding, loaded like the story model (same device and precision)."""
+    path = (config.get("assisted_decoding") or {}).get("draft_model_path")
+    if not path:
+        return None
+    return load_model({**config, "model": {**config["model"], "base_model_path": path}})
+
+
+def load_tokenizer(config):
     tokenizer = AutoTokenizer.from_pretrained(config["model"]["base_model_path"])
+    # Left padding keeps generated tokens aligned when prompts are batched together
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
 
-    return tokenizer, model
 
+def timed(timings, phase, fn, *args, **kwargs):
+    """Run fn and record its wall time in seconds under timings[phase]."""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[phase] = round(time.perf_counter() - start, 3)
 
-# Model generation
-def model_generation(text, model, tokenizer, max_new_tokens=TOKENS):
 
+def load_model_and_tokenizer(config, timings=None):
+    """Load tokenizer and model in parallel; per-phase seconds are written to `timings` if given."""
+    timings = {} if timings is None else timings
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load") as pool:
+        tokenizer = pool.submit(timed, timings, "tokenizer", load_tokenizer, config)
+        model = pool.submit(timed, timings, "model", load_model, config)
+        return tokenizer.result(), model.result()
 
 
+# Model generation
+def chat_text(text, tokenizer):
     messages = [
     {"role": "user", "content":text}
     ]
-    text = tokenizer.apply_chat_template(
+    return tokenizer.apply_chat_template(
         messages,
         tokenize=False,
         add_generation_prompt=True,
     )
 
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-    with torch.no_grad():
-        output = model.generate(
-        **inputs,
+
+def encode_prompts(texts, tokenizer, compiler=None):
+    """
+    Tokenized chat prompts, padded when there are several. build_prompt output is
+    assembled from cached segment ids when a PromptCompiler is given (same ids).
+    """
+    if compiler is not None:
+        inputs = compiler.encode(texts)
+        if inputs is not None:
+            return inputs
+    chats = [chat_text(text, tokenizer) for text in texts]
+    return tokenizer(chats, return_tensors="pt", padding=len(chats) > 1)
+
+
+class RequestControl:
+    """
+    Cancellation and optional time budget of one request, shared with the thread
+    generating for it. `truncated` is set once the deadline (not a cancel) stopped it.
+    """
+
+    def __init__(self, budget_s=None):
+        self.cancel_event = threading.Event()
+        self.deadline = time.monotonic() + budget_s if budget_s else None
+        self.truncated = False
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def should_stop(self):
+        if self.cancel_event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.truncated = True
+            return True
+        return False
+
+
+class CancelCriteria(StoppingCriteria):
+    """Stops each row once its RequestControl is cancelled or out of time (e.g. the requesting client went away)."""
+
+    def __init__(self, controls):
+        self.controls = controls
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = [control is not None and control.should_stop() for control in self.controls]
+        return torch.tensor(stop, dtype=torch.bool, device=input_ids.device)
+
+
+class SeededSampler(LogitsProcessor):
+    """
+    Samples each next token with temperature / top-k / top-p from its own torch.Generator
+    and leaves only that token, which generate(do_sample=False) then picks. A seeded
+    request never touches the process-global RNG that concurrent generations share.
+    """
+
+    def __init__(self, seed, temperature, top_p, top_k=None):
+        self.seed = seed
+        self.generator = None
+        warpers = [TemperatureLogitsWarper(temperature)]
+        if top_k:
+            warpers.append(TopKLogitsWarper(top_k))
+        warpers.append(TopPLogitsWarper(top_p))
+        self.warpers = LogitsProcessorList(warpers)
+
+    def __call__(self, input_ids, scores):
+        if self.generator is None:
+            # multinomial needs the generator on the logits' device
+            self.generator = torch.Generator(device=scores.device).manual_seed(self.seed)
+        probs = torch.softmax(self.warpers(input_ids, scores).float(), dim=-1)
+        tokens = torch.multinomial(probs, num_samples=1, generator=self.generator)
+        return torch.full_like(scores, float("-inf")).scatter_(1, tokens, 0.0)
+
+
+def sampling_kwargs(model, temperature, top_p, seed=None):
+    """generate() sampling arguments; with a seed, sampling goes through a per-request SeededSampler."""
+    if seed is None:
+        return {"do_sample": True, "temperature": temperature, "top_p": top_p}
+    sampler = SeededSampler(seed, temperature, top_p, top_k=model.generation_config.top_k)
+    # The sampler applies the warpers itself; None keeps generate from warning about unused ones
+    return {"do_sample": False, "temperature": None, "top_p": None, "top_k": None,
+            "logits_processor": LogitsProcessorList([sampler])}
+
+
+def _generate(model, inputs, assistant=None, extra=None, controls=None, **kwargs):
+    """model.generate, through the assisted decoder when one is configured."""
+    if controls is not None and any(control is not None for control in controls):
+        kwargs["stopping_criteria"] = StoppingCriteriaList([CancelCriteria(controls)])
+    if assistant is not None:
+        # The draft keeps its own KV cache, so the prefix cache is only used on fallback
+        return assistant.generate(inputs, fallback_kwargs=extra, **kwargs)
+    return model.generate(**inputs, **kwargs, **(extra or {}))
+
+
+def model_generation(text, model, tokenizer, max_new_tokens=TOKENS, prefix_cache=None,
+                     temperature=TEMPERATURE, top_p=TOP_P, seed=None, assistant=None, control=None, compiler=None):
+
+    with metrics.stage("tokenize"):
+        inputs = encode_prompts([text], tokenizer, compiler).to(model.device)
+
+    extra = prefix_cache.generate_kwargs(inputs["input_ids"]) if prefix_cache is not None else {}
+    start = time.perf_counter()
+    with metrics.stage("generate"), torch.no_grad():
+        output = _generate(
+        model,
+        inputs,
+        assistant=assistant,
+        extra=extra,
+        controls=[control],
         max_new_tokens=max_new_tokens,
-        temperature=0.2,
-        top_p=0.8,
-        do_sample=True
+        # Seeded: reproducible however many generations run at once on the story pool
+        **sampling_kwargs(model, temperature, top_p, seed),
         )
     input_len = inputs['input_ids'].shape[1]
-    response = tokenizer.decode(output[0][input_len:], skip_special_tokens=True)
+    metrics.record_generation(input_len, output.shape[1] - input_len, time.perf_counter() - start)
+    with metrics.stage("decode"):
+        response = tokenizer.decode(output[0][input_len:], skip_special_tokens=True)
 
     return response
-   
-       
-def model_generation_image(prompt, image):
-       
-    device = "cuda"
-    pipe = StableDiffusionImg2ImgPipeline.from_pretrained("nitrosocke/Ghibli-Diffusion", torch_dtype=torch.float16).to(
-        device
-    )
-
-    generator = torch.Generator(device=device).manual_seed(1024)
-    image = pipe(prompt=prompt, image=image, strength=0.75, guidance_scale=7.5, generator=generator).images[0]
-    
-    return image
 
 
-# Construct chat prompt
-
-def build_prompt(message, max_new_tokens=TOKENS):
+def model_generation_batch(texts, model, tokenizer, max_new_tokens=TOKENS, prefix_cache=None,
+                           temperature=TEMPERATURE, top_p=TOP_P, assistant=None, compiler=None, controls=None):
     """
-    Build a clean, production-ready storytelling prompt from a StoryPrompt-like object.
-    Expected attrs on `message`:
-      - objectives (str | None)
-      - genre (str | None)
-      - plot (str | None)              # plot archetype
-      - tone (str | None)
-      - extra_prompt (str | None)
+    Generate for several prompts with one `generate` call.
+    Prompts are left-padded (see load_model_and_tokenizer) so every row's new tokens
+    start at the same column and can be sliced off together. Left padding shifts the
+    shared prefix, so the prefix cache only applies to single-prompt batches; assisted
+    decoding likewise only supports one prompt at a time. `controls` holds an optional
+    RequestControl per prompt; a row that is cancelled or out of time stops on its own
+    while the others continue.
     """
-    from scripts.pydantic_model import PLOT_INFO, PlotTitle
+    if len(texts) == 1:
+        return [model_generation(texts[0], model, tokenizer, max_new_tokens=max_new_tokens, prefix_cache=prefix_cache,
+                                 temperature=temperature, top_p=top_p, assistant=assistant, compiler=compiler,
+                                 control=controls[0] if controls else None)]
+
+    with metrics.stage("tokenize"):
+        inputs = encode_prompts(texts, tokenizer, compiler).to(model.device)
+    start = time.perf_counter()
+    with metrics.stage("generate"), torch.no_grad():
+        output = _generate(
+        model,
+        inputs,
+        controls=controls,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        do_sample=True,
+        pad_token_id=tokenizer.pad_token_id,
+        )
+    input_len = inputs['input_ids'].shape[1]
+    new_tokens = output[:, input_len:]
+    metrics.record_generation(
+        int(inputs["attention_mask"].sum()), int((new_tokens != tokenizer.pad_token_id).sum()), time.perf_counter() - start
+    )
+    with metrics.stage("decode"):
+        return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
 
-    def line(label, value):
-        value = (value or "").strip()
-        return f"{label}: {value}\n" if value else ""
 
-    # Core header
-    prompt_parts = [
-        "You are a gifted storyteller. Produce polished, original fiction that follows the brief exactly and never explains its private reasoning.",
-        "When uncertain, make the best good-faith assumption and proceed—no clarifying questions.\n",
-        "Do not include explanations, thinking or meta text—return only the requested output. Take into account the following characteristics of the story\n",
-    ]
+def model_generation_session(input_ids, model, tokenizer, past_key_values=None, max_new_tokens=TOKENS, prefix_cache=None,
+                             temperature=TEMPERATURE, top_p=TOP_P, seed=None, control=None):
+    """
+    One turn of a story session. `input_ids` is the whole conversation including the new
+    user turn and `past_key_values` the session's KV cache of a prefix of it, so only the
+    uncached tail is prefilled; without one the prefix cache is tried, then a full prefill.
+    Returns (conversation ids after the reply, reply text, updated KV cache). A closing
+    end-of-sequence token is left off the ids: the chat template's next turn re-adds it.
+    """
+    inputs = {"input_ids": torch.tensor([input_ids], device=model.device)}
+    inputs["attention_mask"] = torch.ones_like(inputs["input_ids"])
+    if past_key_values is not None:
+        extra = {"past_key_values": past_key_values}
+    else:
+        extra = prefix_cache.generate_kwargs(inputs["input_ids"]) if prefix_cache is not None else {}
+    # generate() extends the cache in place
+    cached = extra["past_key_values"].get_seq_length() if extra else 0
+    start = time.perf_counter()
+    with metrics.stage("generate"), torch.no_grad():
+        output = _generate(
+        model,
+        inputs,
+        extra=extra,
+        controls=[control],
+        max_new_tokens=max_new_tokens,
+        **sampling_kwargs(model, temperature, top_p, seed),
+        return_dict_in_generate=True,
+        )
+    ids = output.sequences[0].tolist()
+    input_len = len(input_ids)
+    metrics.record_generation(input_len - cached, len(ids) - input_len, time.perf_counter() - start)
+    eos = model.generation_config.eos_token_id
+    if len(ids) > input_len and ids[-1] in (eos if isinstance(eos, list) else [eos]):
+        ids.pop()
+    with metrics.stage("decode"):
+        reply = tokenizer.decode(ids[input_len:], skip_special_tokens=True)
+    return ids, reply, output.past_key_values
+
+
+class TimedTextStreamer(TextIteratorStreamer):
+    """
+    TextIteratorStreamer that also records when each generated token arrives,
+    so streaming callers can report time-to-first-token and per-token latency.
+    """
 
-    # Brief (include only when present)
-    brief = ""
-    brief += line("Objective", getattr(message, "objectives", None))
-    brief += line("Genre", getattr(message, "genre", None))
-
-    # Handle plot with detailed info
-    plot_title = getattr(message, "plot", None)
-    if plot_title:
-        plot_title_str = (plot_title or "").strip()
-        # Try to find matching plot in PLOT_INFO
-        plot_info_found = False
-        for plot_enum, (description, reference) in PLOT_INFO.items():
-            if plot_enum.value.casefold() == plot_title_str.casefold():
-                brief += f"Plot Archetype: {plot_enum.value}\n"
-                brief += f"Plot Description: {description}\n"
-                brief += f"Universal Reference: {reference}\n"
-                plot_info_found = True
-                break
-
-        # If not found in PLOT_INFO, just use the raw value
-        if not plot_info_found:
-            brief += line("Plot Archetype", plot_title)
-
-    brief += line("Tone", getattr(message, "tone", None))
-    brief += line("Additional Notes", getattr(message, "usr_prompt", None))
-    if brief:
-        prompt_parts.append(brief)
-
-    # Lightweight constraints (tweak as needed)
-    prompt_parts.append(
-        "Constraints:\n"
-        f"- Target length: {max_new_tokens} tokens maximum.\n"
-        #"- Clear arc with beginning → middle → end.\n"
-        #"- Show, don't tell; concrete sensory detail; strong verbs.\n"
-        #"- Avoid clichés and generic filler; keep it culturally respectful.\n"
-        #"- End with a resonant image or line that ties back to the Objective.\n"
-    )
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True, **kwargs)
+        self.start = time.perf_counter()
+        self.token_times = []
+        # Set by the generating thread when generate fails; the consumer reports it
+        self.error = None
+        # concurrent.futures.Future of the generate call when it runs on an executor
+        self.future = None
+
+    def put(self, value):
+        if not self.next_tokens_are_prompt:
+            now = time.perf_counter()
+            self.token_times.extend([now] * value.numel())
+        super().put(value)
+
+    def stats(self):
+        times = self.token_times
+        end = time.perf_counter()
+        gaps = [(b - a) * 1000 for a, b in zip(times, times[1:])]
+        gaps.sort()
+        return {
+            "n_tokens": len(times),
+            "ttft_ms": round((times[0] - self.start) * 1000, 2) if times else None,
+            "mean_token_ms": round(sum(gaps) / len(gaps), 2) if gaps else None,
+            "p50_token_ms": round(gaps[len(gaps) // 2], 2) if gaps else None,
+            "p95_token_ms": round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))], 2) if gaps else None,
+            "total_ms": round((end - self.start) * 1000, 2),
+            "tokens_per_sec": round(len(times) / (end - self.start), 2) if times else 0.0,
+        }
+
+
+def model_generation_stream(text, model, tokenizer, max_new_tokens=TOKENS, executor=None, prefix_cache=None,
+                            temperature=TEMPERATURE, top_p=TOP_P, assistant=None, control=None, compiler=None, scope=None):
     """
-    # Output format (helps models stay on track)
-    prompt_parts.append(
-        "Return:\n"
-        "1) A compelling title (on its own line).\n"
-        "2) The story (no meta commentary).\n"
-    )
+    Start generation on a background thread (or on `executor`, e.g. a bounded
+    inference pool) and return the streamer to iterate.
+    Iterating yields decoded text chunks as tokens are produced; afterwards
+    `streamer.error` holds the exception if generate failed, and `streamer.stats()`
+    the latency breakdown. `scope` is an optional
+    context manager held around generate on that thread (e.g. AdapterRegistry.use).
     """
-    prompt = "\n".join(part.strip() for part in prompt_parts if part and part.strip())
+    streamer = TimedTextStreamer(tokenizer)
+    with metrics.stage("tokenize"):
+        inputs = encode_prompts([text], tokenizer, compiler).to(model.device)
+    extra = prefix_cache.generate_kwargs(inputs["input_ids"]) if prefix_cache is not None else {}
+
+    def run():
+        try:
+            start = time.perf_counter()
+            with scope or nullcontext(), metrics.stage("generate"), torch.no_grad():
+                output = _generate(
+                model,
+                inputs,
+                assistant=assistant,
+                extra=extra,
+                controls=[control],
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=True,
+                streamer=streamer,
+                )
+            input_len = inputs["input_ids"].shape[1]
+            metrics.record_generation(input_len, output.shape[1] - input_len, time.perf_counter() - start)
+        except Exception as e:
+            # Nobody reads this thread's result: hand the error to the consumer and unblock it
+            streamer.error = e
+            streamer.end()
+
+    if executor is not None:
+        streamer.future = executor.submit(run)
+    else:
+        threading.Thread(target=run, daemon=True).start()
+    return streamer
 
-    print(prompt)
 
-    return prompt
+def image_target_side(model_id=None):
+    """Longest side uploads are decoded to for `model_id` when image_io.max_side is not set."""
+    return native_resolution(get_image_pipeline(model_id))
 
 
-# ---------- Prompt builder ----------
-def build_sd_prompts(msg):
+def _step_callback(control):
+    """Diffusion step callback that interrupts the remaining steps once `control` says stop."""
+    def callback(pipe, step, timestep, callback_kwargs):
+        if control.should_stop():
+            pipe._interrupt = True
+        return callback_kwargs
+    return callback
 
-    def _part(label, value):
-        return f"{label}: {value}" if value else None
 
-    # Generate prompt from aesthetics template
-    tech = msg.technology.value if msg.technology else "2D/3D"
-    bits = [f"{tech} game visual"]
-    if msg.char_env_item:
-        bits.append(f"{msg.char_env_item.value.lower()} for characters, environments, and items")
-    if msg.typo_menu:
-        bits.append(f"{msg.typo_menu.value.lower()} for typography and menus")
-    if msg.maps:
-        bits.append(f"{msg.maps.value.lower()} for maps")
-    core = ", ".join(bits).rstrip(", ") + "."
-    
+def model_generation_image(prompt, image, model_id=None, strength=IMAGE_STRENGTH, guidance_scale=IMAGE_GUIDANCE,
+                           num_inference_steps=IMAGE_STEPS, seed=IMAGE_SEED, scheduler="default", control=None):
+
+    # Warm pipeline from the process-wide registry (see scripts/pipelines.py), with the tier's scheduler;
+    # a private view when interruptible, so the interrupt flag never reaches concurrent calls
+    pipe = with_scheduler(get_image_pipeline(model_id), scheduler, view=control is not None)
+    extra = {"callback_on_step_end": _step_callback(control)} if control is not None else {}
 
-    constraints = list(filter(None, [
-        _part("Game Visual Style (Characters/Environments/Items)", msg.char_env_item.value if msg.char_env_item else None),
-        _part("Typography & Menus", msg.typo_menu.value if msg.typo_menu else None),
-        _part("Maps", msg.maps.value if msg.maps else None),
-        _part("Art Technology", msg.technology.value if msg.technology else None),
-    ]))
+    generator = torch.Generator(device=pipe.device).manual_seed(seed)
+    with metrics.stage("diffusion"):
+        # An interrupted run skips the remaining steps and decodes the partially denoised latents
+        image = pipe(prompt=prompt, image=image, strength=strength, guidance_scale=guidance_scale,
+                     num_inference_steps=num_inference_steps, generator=generator, **extra).images[0]
+    
+    return image
 
-    constraint_block = ""
-    if constraints:
-        constraint_block = "\n\n[Style Constraints]\n" + "\n".join(constraints)
 
-    positive_prompt = core + constraint_block
+def model_generation_image_batch(prompts, images, model_id=None, strength=IMAGE_STRENGTH, guidance_scale=IMAGE_GUIDANCE,
+                                 num_inference_steps=IMAGE_STEPS, seed=IMAGE_SEED, scheduler="default", control=None):
+    """
+    One batched img2img pass over several (prompt, image) pairs.
+    All images must share a size; every row gets its own generator seeded like the
+    single-image path.
+    """
+    pipe = with_scheduler(get_image_pipeline(model_id), scheduler, view=control is not None)
+    extra = {"callback_on_step_end": _step_callback(control)} if control is not None else {}
 
-    return positive_prompt
-    
\ No newline at end of file
+    generators = [torch.Generator(device=pipe.device).manual_seed(seed) for _ in prompts]
+    with metrics.stage("diffusion"):
+        return pipe(prompt=list(prompts), image=list(images), strength=strength, guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps, generator=generators, **extra).images
@@ -0,0 +1,105 @@
+"""AssistedDecoder on the tiny story/draft pair from benchmarks/tiny_models.py, on CPU."""
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("diffusers")
+
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.tiny_models import build_tiny_lm
+from scripts.assisted import AssistedDecoder
+from scripts.utils import TimedTextStreamer
+
+GREEDY = {"do_sample": False, "max_new_tokens": 24, "min_new_tokens": 24}
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tiny")
+    lm = build_tiny_lm(str(root / "lm"), seed=0)
+    draft = build_tiny_lm(str(root / "draft"), seed=1, num_layers=1)
+    tokenizer = AutoTokenizer.from_pretrained(lm)
+    return tokenizer, AutoModelForCausalLM.from_pretrained(lm).eval(), AutoModelForCausalLM.from_pretrained(draft).eval()
+
+
+@pytest.fixture
+def decoder(models):
+    _, model, draft = models
+    decoder = AssistedDecoder(model, draft, num_assistant_tokens=4)
+    yield decoder
+    decoder.close()
+
+
+def prompt(tokenizer):
+    return tokenizer("Once upon a time", return_tensors="pt")
+
+
+def count_calls(module):
+    calls = []
+    return calls, module.register_forward_hook(lambda *args: calls.append(1))
+
+
+def fail_draft_after(draft, n):
+    """Make the draft model raise on its forward pass number n + 1."""
+    calls = []
+
+    def hook(module, args):
+        calls.append(1)
+        if len(calls) > n:
+            raise RuntimeError("draft failed")
+    return draft.register_forward_pre_hook(hook)
+
+
+def test_accepted_token_accounting(models, decoder):
+    tokenizer, model, _ = models
+    inputs = prompt(tokenizer)
+    with torch.no_grad():
+        plain = model.generate(**inputs, **GREEDY)
+        calls, hook = count_calls(model)
+        try:
+            output = decoder.generate(inputs, **GREEDY)
+        finally:
+            hook.remove()
+
+    # Greedy assisted decoding is lossless; each verification pass adds one token of its own
+    assert torch.equal(output, plain)
+    stats = decoder.stats()
+    assert stats["requests"] == 1 and stats["fallbacks"] == 0
+    assert stats["accepted_tokens"] == GREEDY["max_new_tokens"] - len(calls)
+    assert stats["accepted_tokens"] <= stats["proposed_tokens"]
+
+
+def test_falls_back_before_streaming(models, decoder):
+    tokenizer, model, draft = models
+    inputs = prompt(tokenizer)
+    streamer = TimedTextStreamer(tokenizer)
+    hook = fail_draft_after(draft, 0)
+    try:
+        with torch.no_grad():
+            output = decoder.generate(inputs, streamer=streamer, **GREEDY)
+            plain = model.generate(**inputs, **GREEDY)
+    finally:
+        hook.remove()
+
+    assert torch.equal(output, plain)
+    # The failed call had already put the prompt; it is not streamed as text
+    new_tokens = plain[0, inputs["input_ids"].shape[1]:]
+    assert "".join(streamer) == tokenizer.decode(new_tokens, skip_special_tokens=True)
+    assert len(streamer.token_times) == GREEDY["max_new_tokens"]
+    assert decoder.stats()["fallbacks"] == 1 and decoder.stats()["requests"] == 0
+
+
+def test_no_fallback_once_tokens_streamed(models, decoder):
+    tokenizer, _, draft = models
+    streamer = TimedTextStreamer(tokenizer)
+    # Every assisted step runs at least one draft pass, so the fifth comes after a verification
+    hook = fail_draft_after(draft, 4)
+    try:
+        with torch.no_grad(), pytest.raises(RuntimeError, match="draft failed"):
+            decoder.generate(prompt(tokenizer), streamer=streamer, **GREEDY)
+    finally:
+        hook.remove()
+
+    assert streamer.token_times
+    assert decoder.stats()["fallbacks"] == 0
@@ -0,0 +1,24 @@
+"""BlobCache disk tier: one file per key, named after the stored format."""
+import os
+
+from scripts.cache import BlobCache
+
+
+def test_disk_files_take_the_suffix_of_their_format(tmp_path):
+    cache = BlobCache(max_bytes=0, disk_dir=str(tmp_path), suffix=".png")
+    cache.set("webp", b"RIFF....WEBP", ".webp")
+    cache.set("png", b"\x89PNG")
+    assert sorted(os.listdir(tmp_path)) == ["png.png", "webp.webp"]
+
+    # A restarted process finds both entries again
+    reopened = BlobCache(max_bytes=0, disk_dir=str(tmp_path), suffix=".png")
+    assert reopened.get("webp") == b"RIFF....WEBP"
+    assert reopened.get("png") == b"\x89PNG"
+
+
+def test_new_format_replaces_the_old_file(tmp_path):
+    cache = BlobCache(max_bytes=0, disk_dir=str(tmp_path))
+    cache.set("key", b"jpeg bytes", ".jpg")
+    cache.set("key", b"webp bytes", ".webp")
+    assert os.listdir(tmp_path) == ["key.webp"]
+    assert cache.stats()["disk_bytes"] == len(b"webp bytes")
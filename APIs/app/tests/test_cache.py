@@ -0,0 +1,38 @@
+"""story_cache_key normalisation."""
+import pytest
+
+pytest.importorskip("pydantic")
+
+from scripts.cache import story_cache_key
+from scripts.pydantic_model import StoryPrompt
+
+PARAMS = {"max_new_tokens": 256, "temperature": 0.7, "top_p": 0.9}
+MODEL = "Qwen/Qwen2.5-1.5B-Instruct"
+
+
+def key(params=PARAMS, model=MODEL, **fields):
+    return story_cache_key(StoryPrompt(**fields), params, model)
+
+
+def test_fields_normalised_like_build_prompt():
+    base = key(objectives="Find the key", genre="Puzzle", plot="The Split Self", tone="Serious")
+    assert key(objectives="  Find the key\n", genre=" Puzzle", plot="the split self  ", tone="Serious\t") == base
+    assert key(objectives="Find the key", genre="Puzzle", plot="THE SPLIT SELF", tone="Serious") == base
+
+
+def test_unknown_plot_kept_verbatim():
+    assert key(plot="My own plot") != key(plot="my own plot")
+    assert key(plot=" My own plot ") == key(plot="My own plot")
+
+
+def test_everything_that_changes_the_output_changes_the_key():
+    base = key(objectives="Find the key")
+    assert key(objectives="Find the door") != base
+    assert key(objectives="Find the key", seed=1) != base
+    assert key(objectives="Find the key", adapter="noir") != base
+    assert key(params={**PARAMS, "temperature": 0.8}, objectives="Find the key") != base
+    assert key(model="other/model", objectives="Find the key") != base
+
+
+def test_timeout_does_not_change_the_key():
+    assert key(objectives="Find the key", timeout_s=5) == key(objectives="Find the key")
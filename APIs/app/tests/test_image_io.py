@@ -0,0 +1,49 @@
+"""Output format negotiation and decode size snapping."""
+import pytest
+
+pytest.importorskip("PIL")
+
+from scripts.image_io import image_io_settings, negotiate_format, snap_size
+
+
+def test_explicit_format_wins_over_accept():
+    assert negotiate_format(accept="image/webp", fmt="JPG") == {"format": "jpeg", "quality": 90}
+    assert negotiate_format(fmt="webp", quality=70) == {"format": "webp", "quality": 70}
+    with pytest.raises(ValueError):
+        negotiate_format(fmt="gif")
+
+
+@pytest.mark.parametrize("accept, fmt", [
+    ("image/webp", "webp"),
+    ("image/webp;q=0.8, image/jpeg", "jpeg"),
+    ("image/jpeg;q=0.5, image/webp;q=0.9", "webp"),
+    ("image/webp, image/jpeg", "webp"),
+    ("image/avif, image/gif", "png"),
+    ("image/webp;q=0, image/png;q=0.1", "png"),
+    ("text/html, */*;q=0.8", "png"),
+    ("image/jpeg;q=bogus, image/webp;q=0.2", "webp"),
+])
+def test_accept_header(accept, fmt):
+    assert negotiate_format(accept=accept)["format"] == fmt
+
+
+def test_default_and_quality():
+    settings = image_io_settings({"image_io": {"format": "jpg", "quality": 80}})
+    assert negotiate_format(settings=settings) == {"format": "jpeg", "quality": 80}
+    assert negotiate_format(accept="image/*", settings=settings) == {"format": "jpeg", "quality": 80}
+    # PNG is lossless: quality is dropped so every PNG result shares one cache entry
+    assert negotiate_format(fmt="png", quality=50) == {"format": "png", "quality": None}
+    with pytest.raises(ValueError):
+        negotiate_format(fmt="webp", quality=0)
+
+
+@pytest.mark.parametrize("size, max_side, expected", [
+    ((1000, 600), 512, (512, 304)),
+    ((600, 1000), 512, (304, 512)),
+    ((1001, 999), None, (1000, 992)),
+    ((300, 200), 512, (296, 200)),
+    ((5, 5), None, (8, 8)),
+    ((4000, 10), 1024, (1024, 8)),
+])
+def test_snap_size(size, max_side, expected):
+    assert snap_size(*size, max_side=max_side) == expected
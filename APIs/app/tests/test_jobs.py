@@ -0,0 +1,102 @@
+"""JobStore dedupe, priority and lease flow on a temporary SQLite file."""
+import pytest
+
+pytest.importorskip("starlette")
+
+from scripts.executor import QueueFullError
+from scripts.jobs import JobStore
+
+PAYLOAD = {"req": {"objectives": "Find the key"}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"), result_ttl_s=3600, max_attempts=2)
+
+
+def test_same_payload_is_deduplicated(store):
+    job, created = store.submit("story", PAYLOAD)
+    again, created_again = store.submit("story", PAYLOAD)
+    assert created and not created_again
+    assert again["id"] == job["id"]
+    # Kind and uploaded bytes are part of the identity
+    assert store.submit("image", PAYLOAD, b"png")[1]
+    assert store.submit("image", PAYLOAD, b"other png")[1]
+    assert not store.submit("image", PAYLOAD, b"png")[1]
+
+
+def test_duplicate_raises_priority_of_queued_job(store):
+    job, _ = store.submit("story", PAYLOAD, priority=0)
+    store.submit("story", PAYLOAD, priority=5)
+    assert store.get(job["id"])["priority"] == 5
+    store.submit("story", PAYLOAD, priority=1)
+    assert store.get(job["id"])["priority"] == 5
+
+
+def test_claim_order_priority_then_age(store):
+    old, _ = store.submit("story", {"n": 1})
+    new, _ = store.submit("story", {"n": 2})
+    urgent, _ = store.submit("story", {"n": 3}, priority=10)
+    order = [store.claim("w", 60)["id"] for _ in range(3)]
+    assert order == [urgent["id"], old["id"], new["id"]]
+    assert store.claim("w", 60) is None
+
+
+def test_finished_job_is_reused_failed_job_is_not(store):
+    job, _ = store.submit("story", PAYLOAD)
+    claimed = store.claim("w", 60)
+    store.finish(claimed["id"], "w", b'{"generated_story": "..."}', "application/json", {"truncated": False})
+    assert store.result(job["id"]) == (b'{"generated_story": "..."}', "application/json")
+    assert store.submit("story", PAYLOAD) == (store.get(job["id"]), False)
+
+    other, _ = store.submit("story", {"n": 1})
+    store.fail(store.claim("w", 60)["id"], "w", "boom")
+    assert store.get(other["id"])["error"] == "boom"
+    assert store.submit("story", {"n": 1})[1]
+
+
+def test_expired_lease_is_claimed_again(store):
+    job, _ = store.submit("story", PAYLOAD)
+    first = store.claim("dead", -1)
+    assert first["attempts"] == 1
+    second = store.claim("alive", 60)
+    assert second["id"] == job["id"] and second["attempts"] == 2
+    # The worker that lost the lease can no longer finish the job
+    store.finish(job["id"], "dead", b"stale", "text/plain")
+    assert store.get(job["id"])["status"] == "running"
+    store.finish(job["id"], "alive", b"fresh", "text/plain")
+    assert store.result(job["id"]) == (b"fresh", "text/plain")
+
+
+def test_live_lease_is_not_claimed_and_renew_extends_it(store):
+    store.submit("story", PAYLOAD)
+    job = store.claim("w", 60)
+    assert store.claim("other", 60) is None
+    store.renew(job["id"], "w", -1)
+    assert store.claim("other", 60)["id"] == job["id"]
+
+
+def test_requeue_does_not_count_the_attempt(store):
+    job, _ = store.submit("story", PAYLOAD)
+    store.claim("w", 60)
+    store.requeue(job["id"], "w")
+    assert store.get(job["id"])["status"] == "queued"
+    assert store.get(job["id"])["attempts"] == 0
+    assert store.claim("w", 60)["attempts"] == 1
+
+
+def test_queue_limit(store):
+    store.submit("story", {"n": 1}, max_queued=1)
+    with pytest.raises(QueueFullError):
+        store.submit("story", {"n": 2}, max_queued=1)
+    # A duplicate is not a new job
+    assert not store.submit("story", {"n": 1}, max_queued=1)[1]
+
+
+def test_purge_after_ttl(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), result_ttl_s=0)
+    job, _ = store.submit("story", PAYLOAD)
+    store.finish(store.claim("w", 60)["id"], "w", b"done", "text/plain")
+    assert store.get(job["id"]) is None
+    assert store.purge() == 1
+    assert store.counts()["done"] == 0
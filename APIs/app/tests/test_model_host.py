@@ -0,0 +1,27 @@
+"""RemoteInference when the model host is not running."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from scripts.model_host import RemoteInference
+
+
+@pytest.fixture
+def inference(tmp_path):
+    return RemoteInference({}, str(tmp_path / "no-host.sock"))
+
+
+def test_readiness_reports_every_model_unavailable(inference):
+    readiness = asyncio.run(inference.readiness())
+    # main.py's readiness probe and require_*_ready read these keys
+    assert readiness["status"] == "unavailable"
+    assert readiness["image"] == "unavailable"
+    assert readiness["startup"] == {}
+    assert readiness["error"]
+
+
+@pytest.mark.parametrize("model", ["story", "image", None])
+def test_not_ready(inference, model):
+    assert asyncio.run(inference.is_ready(model)) is False
@@ -0,0 +1,58 @@
+"""PromptCompiler ids against the chat-templated text path, with the tiny BPE tokenizer."""
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("tokenizers")
+pytest.importorskip("pydantic")
+
+from benchmarks.tiny_models import build_tiny_tokenizer
+from scripts.prompt_compiler import PromptCompiler, _check_prompts, build_prompt_compiler
+from scripts.prompts import build_prompt
+from scripts.pydantic_model import StoryPrompt
+
+MAX_NEW_TOKENS = 256
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    tokenizer = build_tiny_tokenizer()
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def chat_text(tokenizer, prompt):
+    messages = [{"role": "user", "content": str(prompt)}]
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def test_ids_equal_text_path(tokenizer):
+    compiler = PromptCompiler(tokenizer)
+    for prompt in _check_prompts(MAX_NEW_TOKENS):
+        assert compiler.input_ids(prompt) == tokenizer(chat_text(tokenizer, prompt))["input_ids"], str(prompt)
+    assert compiler.verify(MAX_NEW_TOKENS) == []
+    assert build_prompt_compiler(tokenizer, MAX_NEW_TOKENS) is not None
+
+
+def test_batch_encoding_equals_padded_tokenizer(tokenizer):
+    compiler = PromptCompiler(tokenizer)
+    prompts = [
+        build_prompt(StoryPrompt(objectives="Open the vault"), MAX_NEW_TOKENS),
+        build_prompt(StoryPrompt(genre="Puzzle", plot="the split self", usr_prompt="A long\nuser prompt"), MAX_NEW_TOKENS),
+    ]
+    expected = tokenizer([chat_text(tokenizer, p) for p in prompts], padding=True, return_tensors="pt")
+    encoded = compiler.encode(prompts)
+    assert encoded["input_ids"].tolist() == expected["input_ids"].tolist()
+    assert encoded["attention_mask"].tolist() == expected["attention_mask"].tolist()
+
+
+def test_only_free_text_is_tokenized_per_request(tokenizer):
+    compiler = PromptCompiler(tokenizer)
+    prompt = build_prompt(StoryPrompt(objectives="Find the key", genre="Puzzle"), MAX_NEW_TOKENS)
+    free = sum(1 for _, static in prompt.segments if not static)
+    first = compiler.input_ids(prompt)
+    hits, misses = compiler.hits, compiler.misses
+    assert compiler.input_ids(prompt) == first
+    assert compiler.misses - misses == free
+    assert compiler.hits - hits == len(prompt.segments) - free
+    assert compiler.input_ids("a plain string prompt") is None
@@ -0,0 +1,139 @@
+"""
+Throughput of gbt.features.aggregate_sessions on synthetic events.
+
+    python benchmarks/aggregate_sessions.py --events 1e6 1e7 1e8
+    python benchmarks/aggregate_sessions.py --events 1e5 1e6 --legacy-max 1e6 --out agg.json
+
+Events are built column-wise with numpy, typed the way data.load_json_logs returns them
+(categorical ids, nullable Float64 milliseconds and success flags, boolean backtracks),
+about 25 events per session. For each size the best of --repeats runs is reported as
+events/sec. Up to --legacy-max events, the previous lambda-based groupby also runs, and
+the report includes the speedup and whether the outputs are identical.
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from gbt.data import ensure_columns
+from gbt.features import aggregate_sessions
+
+
+def legacy_aggregate_sessions(df: pd.DataFrame) -> pd.DataFrame:
+    """aggregate_sessions before the vectorized engine, kept as the reference."""
+    base_cols = [
+        "timestamp","session_id","player_id","level_id","event_type",
+        "decision_time_ms","was_backtracked","success_flag","completion_time_ms",
+    ]
+    df = ensure_columns(df, base_cols)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    for numcol in ["decision_time_ms","completion_time_ms","success_flag"]:
+        df[numcol] = pd.to_numeric(df[numcol], errors="coerce").astype(float)
+    df["was_backtracked"] = df["was_backtracked"].astype(str).str.lower().isin(["1","true","t","yes"]).astype(int)
+
+    grouped = df.groupby(["session_id","player_id","level_id"], dropna=False, observed=True)
+    features = grouped.agg(
+        session_time=("timestamp", lambda s: (s.max() - s.min()).total_seconds() if s.notna().any() else np.nan),
+        attempt_count=("event_type", lambda s: (s == "level_start").sum()),
+        action_count=("event_type", lambda s: (s == "action").sum()),
+        mean_decision_time=("decision_time_ms", lambda s: np.nanmean(s.values) if np.isfinite(s.astype(float)).any() else np.nan),
+        backtrack_ratio=("was_backtracked", lambda s: np.nanmean(s.values) if len(s) > 0 else np.nan),
+        success_flag=("success_flag","max"),
+        completion_time_ms=("completion_time_ms","max"),
+    ).reset_index()
+
+    for c in ["session_time","mean_decision_time","backtrack_ratio","completion_time_ms"]:
+        features[c] = features[c].astype(float)
+    features["action_count"] = features["action_count"].fillna(0).astype(int)
+    features["attempt_count"] = features["attempt_count"].fillna(0).astype(int)
+    features["completion_time_ms"] = features["completion_time_ms"].fillna(features["session_time"] * 1000)
+    return features
+
+
+def synthetic_events(n_events: int, n_players: int = 5000, n_levels: int = 200, seed: int = 7) -> pd.DataFrame:
+    """`n_events` events in sessions of level_start, actions, level_end, as typed columns."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.poisson(23, n_events // 25 + 2) + 2
+    lengths = lengths[:np.searchsorted(np.cumsum(lengths), n_events) + 1]
+    lengths[-1] -= lengths.sum() - n_events
+    lengths = lengths[lengths > 0]
+    n_sessions = len(lengths)
+
+    session = np.repeat(np.arange(n_sessions, dtype=np.int32), lengths)
+    starts = np.cumsum(lengths) - lengths
+    pos = np.arange(n_events) - np.repeat(starts, lengths)
+    is_start = pos == 0
+    is_end = pos == np.repeat(lengths - 1, lengths)
+    is_action = ~is_start & ~is_end
+    event_code = np.where(is_start, 0, np.where(is_end, 2, 1)).astype(np.int8)
+
+    decision = rng.normal(300, 80, n_events).clip(20).round()
+    step_ms = np.where(is_start, 0, decision).astype(np.int64)
+    offset_ms = np.cumsum(step_ms) - np.repeat(np.cumsum(step_ms)[starts] - step_ms[starts], lengths)
+    base = np.datetime64("2025-01-01", "ms") + (np.arange(n_sessions) * 3000).astype("timedelta64[ms]")
+    timestamp = np.repeat(base, lengths) + offset_ms.astype("timedelta64[ms]")
+
+    def ids(prefix, n, codes):
+        return pd.Categorical.from_codes(codes, [f"{prefix}{i}" for i in range(n)])
+
+    player = rng.integers(0, n_players, n_sessions, dtype=np.int32)
+    level = rng.integers(0, n_levels, n_sessions, dtype=np.int32)
+    completion = np.repeat(offset_ms[np.cumsum(lengths) - 1], lengths)
+    return pd.DataFrame({
+        "timestamp": timestamp.astype("datetime64[ns]"),
+        "session_id": ids("S", n_sessions, session),
+        "player_id": ids("P", n_players, np.repeat(player, lengths)),
+        "level_id": ids("L", n_levels, np.repeat(level, lengths)),
+        "event_type": pd.Categorical.from_codes(event_code, ["level_start", "action", "level_end"]),
+        "decision_time_ms": pd.Series(np.where(is_action, decision, np.nan)).astype("Float64"),
+        "was_backtracked": pd.Series(rng.random(n_events) < 0.15, dtype="boolean").mask(~is_action),
+        "success_flag": pd.Series(np.where(is_end, rng.random(n_events) < 0.6, np.nan)).astype("Float64"),
+        "completion_time_ms": pd.Series(np.where(is_end, completion, np.nan)).astype("Float64"),
+    })
+
+
+def best_of(fn, df, repeats):
+    times, out = [], None
+    for _ in range(repeats):
+        # aggregate_sessions converts columns in place, so every run starts from a fresh copy
+        frame = df.copy()
+        start = time.perf_counter()
+        out = fn(frame)
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", nargs="+", type=float, default=[1e6, 1e7, 1e8], help="event counts to time")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--legacy-max", type=float, default=1e6, help="largest size the lambda groupby also runs at")
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    report = []
+    for n in [int(n) for n in args.events]:
+        start = time.perf_counter()
+        df = synthetic_events(n)
+        row = {"events": n, "build_s": round(time.perf_counter() - start, 2)}
+        seconds, out = best_of(aggregate_sessions, df, args.repeats)
+        row.update(sessions=len(out), seconds=round(seconds, 3), events_per_sec=round(n / seconds))
+        if n <= args.legacy_max:
+            legacy_s, legacy = best_of(legacy_aggregate_sessions, df, 1)
+            row.update(legacy_seconds=round(legacy_s, 3), legacy_events_per_sec=round(n / legacy_s),
+                       speedup=round(legacy_s / seconds, 1), identical=bool(out.equals(legacy)))
+        print(json.dumps(row), flush=True)
+        report.append(row)
+        del df, out
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
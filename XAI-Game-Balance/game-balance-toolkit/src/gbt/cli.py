@@ -2,28 +2,54 @@ from __future__ import annotations
 import argparse
 from pathlib import Path
 import json
+import sys
 import pandas as pd
 
-from .data import load_json_logs, generate_synthetic_logs
+from .data import load_json_logs, generate_synthetic_logs, write_json_logs, DEFAULT_CHUNKSIZE
 from .features import aggregate_sessions
 from .elo import compute_elo
 from .model import train_success_model, save_shap_summary_png
 from .archetypes import cluster_archetypes, archetype_labels_from_centers
 from .report import per_level_report
+from .store import EventStore
+
+def ingest_main(argv):
+    parser = argparse.ArgumentParser(prog="gbt ingest", description="Add new or changed logs to a Parquet event store")
+    parser.add_argument("--input", required=True, help="Path to JSONL/JSON file or directory")
+    parser.add_argument("--store", required=True, help="Event store directory")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Events decoded per chunk when reading logs")
+    args = parser.parse_args(argv)
+    if args.chunksize < 1:
+        parser.error("--chunksize must be at least 1")
+
+    counts = EventStore(args.store).ingest(args.input, chunksize=args.chunksize)
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
 
 def main():
-    parser = argparse.ArgumentParser(description="Game Balance Toolkit — V1")
-    parser.add_argument("--input", required=True, help="Path to JSONL/JSON or 'SYNTH' for synthetic")
+    if sys.argv[1:2] == ["ingest"]:
+        return ingest_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Game Balance Toolkit — V1 (`gbt ingest -h` for the event store)")
+    parser.add_argument("--input", help="Path to JSONL/JSON or 'SYNTH' for synthetic")
+    parser.add_argument("--store", help="Read events from this event store (with --input: ingest it first)")
+    parser.add_argument("--level-ids", nargs="+", help="Only these level ids (with --store)")
+    parser.add_argument("--start", help="First day, YYYY-MM-DD (with --store)")
+    parser.add_argument("--end", help="Last day, YYYY-MM-DD (with --store)")
     parser.add_argument("--output", required=True, help="Output directory")
     parser.add_argument("--clusters", type=int, default=3, help="Number of archetype clusters")
     parser.add_argument("--make-synth", action="store_true", help="Generate synthetic data if input is SYNTH")
     parser.add_argument("--players", type=int, default=40, help="#players for synthetic data")
     parser.add_argument("--levels", type=int, default=10, help="#levels for synthetic data")
     parser.add_argument("--sessions", type=int, default=1500, help="#sessions for synthetic data")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Events decoded per chunk when reading logs")
 
     args = parser.parse_args()
 
     # Validate arguments
+    if not args.input and not args.store:
+        parser.error("one of --input or --store is required")
+    if (args.level_ids or args.start or args.end) and not args.store:
+        parser.error("--level-ids, --start and --end need --store")
     if args.clusters < 1:
         parser.error("--clusters must be at least 1")
     if args.players < 1:
@@ -32,6 +58,8 @@ def main():
         parser.error("--levels must be at least 1")
     if args.sessions < 1:
         parser.error("--sessions must be at least 1")
+    if args.chunksize < 1:
+        parser.error("--chunksize must be at least 1")
 
     out = Path(args.output)
     out.mkdir(parents=True, exist_ok=True)
@@ -40,11 +68,15 @@ def main():
     if args.make_synth and str(args.input).upper() == "SYNTH":
         df_events = generate_synthetic_logs(args.players, args.levels, args.sessions)
         synth_path = out / "synthetic_logs.jsonl"
-        with open(synth_path, "w", encoding="utf-8") as fh:
-            for _, row in df_events.iterrows():
-                fh.write(json.dumps(row.to_dict()) + "\n")
+        write_json_logs(df_events, synth_path)
+    elif args.store:
+        store = EventStore(args.store)
+        if args.input:
+            counts = store.ingest(args.input, chunksize=args.chunksize)
+            print("Ingested " + ", ".join(f"{k}: {v}" for k, v in counts.items()))
+        df_events = store.read(levels=args.level_ids, start=args.start, end=args.end)
     else:
-        df_events = load_json_logs(args.input)
+        df_events = load_json_logs(args.input, chunksize=args.chunksize)
 
     # Aggregate to sessions
     df_sessions = aggregate_sessions(df_events)
@@ -64,6 +96,7 @@ def main():
     # Save summary
     summary = {
         "n_events": int(len(df_events)),
+        "n_malformed_lines": int(df_events.attrs.get("malformed_lines", 0)),
         "n_sessions": int(len(df_sessions)),
         "n_players": int(df_sessions["player_id"].nunique()),
         "n_levels": int(df_sessions["level_id"].nunique()),
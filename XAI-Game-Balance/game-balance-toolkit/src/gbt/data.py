@@ -1,53 +1,193 @@
 from __future__ import annotations
+import itertools
 import json
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
 import numpy as np
 import pandas as pd
 
-def load_json_logs(input_path: str) -> pd.DataFrame:
-    p = Path(input_path)
-    rows: List[Dict] = []
-    files: List[Path] = []
+try:
+    import orjson as _orjson  # optional, several times faster than the stdlib decoder
+except ImportError:
+    _orjson = None
+
+# Event fields aggregate_sessions needs, and the column type each is decoded to
+EVENT_SCHEMA: Dict[str, str] = {
+    "timestamp": "datetime",
+    "session_id": "category",
+    "player_id": "category",
+    "level_id": "category",
+    "event_type": "category",
+    "decision_time_ms": "float",
+    "was_backtracked": "bool",
+    "success_flag": "float",
+    "completion_time_ms": "float",
+}
+EVENT_COLUMNS: List[str] = list(EVENT_SCHEMA)
+TRUE_STRINGS = ["1", "1.0", "true", "t", "yes"]
+DEFAULT_CHUNKSIZE = 100_000
+
+def _loads(data: bytes):
+    """orjson when installed; what it rejects but the stdlib accepts (NaN, Infinity) goes to json.loads."""
+    if _orjson is not None:
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def find_log_files(p: Path) -> List[Path]:
+    """The .jsonl/.json files under a directory (recursively), or the file itself."""
     if p.is_dir():
-        files = [f for f in p.glob("**/*.jsonl")] + [f for f in p.glob("**/*.json")]
-    else:
-        files = [p]
-
-    for f in files:
-        with f.open("r", encoding="utf-8") as fh:
-            content = fh.read()
-            # First, try parsing as JSONL (one JSON object per line)
-            lines = content.strip().split('\n')
-            jsonl_success = True
-            for line in lines:
-                s = line.strip()
-                if not s:
-                    continue
-                try:
-                    obj = json.loads(s)
-                    rows.append(obj)
-                except json.JSONDecodeError:
-                    jsonl_success = False
-                    break
-
-            # If JSONL parsing failed, try parsing as single JSON array/object
-            if not jsonl_success:
-                try:
-                    obj = json.loads(content)
-                    if isinstance(obj, list):
-                        rows.extend(obj)
-                    elif isinstance(obj, dict):
-                        rows.append(obj)
-                except json.JSONDecodeError as e:
-                    print(f"Warning: Could not parse {f} as JSON: {e}")
-                except Exception as e:
-                    print(f"Warning: Error processing {f}: {e}")
-    if not rows:
+        return [f for f in p.glob("**/*.jsonl")] + [f for f in p.glob("**/*.json")]
+    return [p]
+
+def _typed_column(values: List, kind: Optional[str]) -> pd.Series:
+    s = pd.Series(values, dtype=object)
+    if kind == "datetime":
+        # naive UTC in every chunk: offsets may differ between events, and chunks must concatenate
+        return pd.to_datetime(s, errors="coerce", format="ISO8601", utc=True).dt.tz_convert(None)
+    if kind == "category":
+        # ids as strings, so chunks share one category dtype; missing ids stay NaN
+        return s.where(s.isna(), s.astype(str)).astype("category")
+    if kind == "float":
+        # not rounded: fractional milliseconds and success rates are kept as logged
+        return pd.to_numeric(s, errors="coerce").astype("Float64")
+    if kind == "bool":
+        flags = s.astype(str).str.strip().str.lower().isin(TRUE_STRINGS)
+        return flags.astype("boolean").mask(s.isna())
+    return s
+
+def _chunk_frame(rows: List[Dict], columns: Optional[List[str]]) -> pd.DataFrame:
+    """Project decoded events onto `columns` (all fields when None) and type them per EVENT_SCHEMA."""
+    seen = set()
+    for r in rows:
+        seen.update(r)
+    raw_keys: Dict[str, List[str]] = {}
+    for k in seen:
+        raw_keys.setdefault(str(k).strip().lower(), []).append(k)
+    wanted = columns if columns is not None else EVENT_COLUMNS + sorted(set(raw_keys) - set(EVENT_COLUMNS))
+
+    data = {}
+    for col in wanted:
+        keys = raw_keys.get(col, [])
+        if not keys:
+            values = [None] * len(rows)
+        elif len(keys) == 1:
+            values = [r.get(keys[0]) for r in rows]
+        else:
+            # spelled several ways ("Level_ID", "level_id"): first non-null wins
+            values = [next((r[k] for k in keys if r.get(k) is not None), None) for r in rows]
+        data[col] = _typed_column(values, EVENT_SCHEMA.get(col))
+    return pd.DataFrame(data)
+
+def _iter_events(f: Path, stats: Dict[str, int]) -> Iterator[Dict]:
+    """
+    Decoded events of one file. JSON Lines are streamed; lines that are not a JSON
+    object are counted in `stats` and skipped. Only a file that opens with "[" or a lone
+    "{" line (a pretty-printed array or object) is parsed as a single document.
+    """
+    malformed: List[int] = []
+    with f.open("rb") as fh:
+        lineno, first = 0, b""
+        for lineno, first in enumerate(fh, 1):
+            if first.strip():
+                break
+        head = first.strip()
+        if not head:
+            return
+        if head.startswith(b"[") or head == b"{":
+            fh.seek(0)
+            try:
+                doc = _loads(fh.read())
+            except ValueError as e:
+                print(f"Warning: Could not parse {f} as JSON: {e}")
+                stats["malformed_files"] += 1
+                return
+            for i, obj in enumerate(doc if isinstance(doc, list) else [doc]):
+                if isinstance(obj, dict):
+                    yield obj
+                else:
+                    malformed.append(i)
+            if malformed:
+                print(f"Warning: Skipped {len(malformed)} non-object item(s) in {f}")
+                stats["malformed_lines"] += len(malformed)
+            return
+
+        for lineno, line in itertools.chain([(lineno, first)], enumerate(fh, lineno + 1)):
+            if not line.strip():
+                continue
+            try:
+                obj = _loads(line)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                yield obj
+            else:
+                malformed.append(lineno)
+    if malformed:
+        shown = ", ".join(map(str, malformed[:5])) + (", ..." if len(malformed) > 5 else "")
+        print(f"Warning: Skipped {len(malformed)} malformed line(s) in {f} (lines {shown})")
+        stats["malformed_lines"] += len(malformed)
+
+def iter_json_logs(input_path: str, chunksize: int = DEFAULT_CHUNKSIZE,
+                   columns: Optional[List[str]] = EVENT_COLUMNS,
+                   stats: Optional[Dict[str, int]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream events from .jsonl/.json files as typed DataFrames of up to `chunksize` rows.
+
+    Only `columns` are kept (every field when None); field names are matched after
+    stripping and lowercasing. Known fields are typed as they are read: categorical
+    string ids, datetime timestamps, nullable Float64 milliseconds and success flags,
+    and a nullable boolean was_backtracked.
+    Memory stays proportional to `chunksize`, except for files holding one JSON array.
+    Malformed lines are counted into `stats` ("malformed_lines", "malformed_files").
+    """
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1")
+    if stats is None:
+        stats = {}
+    stats.setdefault("malformed_lines", 0)
+    stats.setdefault("malformed_files", 0)
+    rows: List[Dict] = []
+    for f in find_log_files(Path(input_path)):
+        for obj in _iter_events(f, stats):
+            rows.append(obj)
+            if len(rows) >= chunksize:
+                yield _chunk_frame(rows, columns)
+                rows = []
+    if rows:
+        yield _chunk_frame(rows, columns)
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate typed chunks, recoding each chunk onto the union of categories so ids stay categorical."""
+    if len(chunks) == 1:
+        return chunks[0]
+    for c in chunks[0].columns:
+        if not isinstance(chunks[0][c].dtype, pd.CategoricalDtype):
+            continue
+        categories = pd.Index([], dtype=object)
+        for ch in chunks:
+            if c in ch.columns:
+                categories = categories.union(ch[c].cat.categories.astype(object), sort=False)
+        for ch in chunks:
+            if c in ch.columns:
+                ch[c] = ch[c].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+def load_json_logs(input_path: str, chunksize: int = DEFAULT_CHUNKSIZE,
+                   columns: Optional[List[str]] = EVENT_COLUMNS) -> pd.DataFrame:
+    """
+    Load event logs into one typed DataFrame (see iter_json_logs). The number of skipped
+    malformed lines is reported and kept in `df.attrs["malformed_lines"]`.
+    """
+    stats: Dict[str, int] = {}
+    chunks = list(iter_json_logs(input_path, chunksize=chunksize, columns=columns, stats=stats))
+    if not chunks:
         raise ValueError("No JSON rows loaded. Provide .jsonl/.json files.")
 
-    df = pd.DataFrame(rows)
-    df.columns = [c.strip().lower() for c in df.columns]
+    df = concat_chunks(chunks)
+    df.attrs.update(stats)
     return df
 
 def ensure_columns(df: pd.DataFrame, cols: List[str]) -> pd.DataFrame:
@@ -56,6 +196,12 @@ def ensure_columns(df: pd.DataFrame, cols: List[str]) -> pd.DataFrame:
             df[c] = np.nan
     return df
 
+def write_json_logs(df: pd.DataFrame, path: Path) -> None:
+    """Write events as JSON Lines, with missing values as null (strict JSON, no NaN)."""
+    with open(path, "w", encoding="utf-8") as fh:
+        for _, row in df.iterrows():
+            fh.write(json.dumps(row.astype(object).where(row.notna(), None).to_dict(), allow_nan=False) + "\n")
+
 def generate_synthetic_logs(n_players: int = 40, n_levels: int = 10, n_sessions: int = 1500, seed: int = 7) -> pd.DataFrame:
     rng = np.random.default_rng(seed)
     player_skill = {f"P{i}": rng.normal(0, 1) for i in range(n_players)}
@@ -3,6 +3,33 @@ import numpy as np
 import pandas as pd
 from .data import ensure_columns
 
+TRUE_STRINGS = ["1","true","t","yes"]
+NS_PER_DAY = 86_400 * 10**9
+
+def _truthy(s: pd.Series) -> pd.Series:
+    """0/1 per event: "1", "true", "t" or "yes" after str() and lowercasing count as true."""
+    if pd.api.types.is_bool_dtype(s.dtype):
+        return s.fillna(False).astype(int)
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return (s == 1).fillna(False).astype(int)
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # decide once per category instead of once per event
+        flags = s.cat.categories.astype(str).str.lower().isin(TRUE_STRINGS)
+        return pd.Series(np.append(flags, False)[s.cat.codes.to_numpy()].astype(int), index=s.index)
+    return s.astype(str).str.lower().isin(TRUE_STRINGS).astype(int)
+
+def _total_seconds(delta: pd.Series) -> np.ndarray:
+    """
+    Timedelta.total_seconds() for a whole column, bit for bit: days * 86400 + seconds +
+    microseconds / 1e6. Series.dt.total_seconds() rounds differently in the last bit.
+    """
+    ns = delta.astype("timedelta64[ns]").to_numpy().view("int64")
+    seconds = (ns // NS_PER_DAY) * 86_400 + (ns // 10**9) % 86_400 + ((ns // 1000) % 10**6) / 1e6
+    return np.where(delta.isna().to_numpy(), np.nan, seconds)
+
+def _as_category(s: pd.Series) -> pd.Series:
+    return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype("category")
+
 def aggregate_sessions(df: pd.DataFrame) -> pd.DataFrame:
     if len(df) == 0:
         raise ValueError("Cannot aggregate sessions from empty dataframe")
@@ -17,20 +44,49 @@ def aggregate_sessions(df: pd.DataFrame) -> pd.DataFrame:
         df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
     for numcol in ["decision_time_ms","completion_time_ms","success_flag"]:
         if numcol in df.columns:
-            df[numcol] = pd.to_numeric(df[numcol], errors="coerce")
+            df[numcol] = pd.to_numeric(df[numcol], errors="coerce").astype(float)
     if "was_backtracked" in df.columns:
-        df["was_backtracked"] = df["was_backtracked"].astype(str).str.lower().isin(["1","true","t","yes"]).astype(int)
-
-    grouped = df.groupby(["session_id","player_id","level_id"], dropna=False)
-    features = grouped.agg(
-        session_time=("timestamp", lambda s: (s.max() - s.min()).total_seconds() if s.notna().any() else np.nan),
-        attempt_count=("event_type", lambda s: (s == "level_start").sum()),
-        action_count=("event_type", lambda s: (s == "action").sum()),
-        mean_decision_time=("decision_time_ms", lambda s: np.nanmean(s.values) if np.isfinite(s.astype(float)).any() else np.nan),
-        backtrack_ratio=("was_backtracked", lambda s: np.nanmean(s.values) if len(s) > 0 else np.nan),
-        success_flag=("success_flag","max"),
-        completion_time_ms=("completion_time_ms","max"),
-    ).reset_index()
+        df["was_backtracked"] = _truthy(df["was_backtracked"])
+
+    # Per-event indicator columns, so every per-session statistic is a built-in (cythonized) aggregation
+    keys = ["session_id","player_id","level_id"]
+    decision = df["decision_time_ms"].astype(float)
+    work = pd.DataFrame({
+        **{k: _as_category(df[k]) for k in keys},
+        "timestamp": df["timestamp"],
+        "is_start": (df["event_type"] == "level_start").to_numpy(dtype=np.int64),
+        "is_action": (df["event_type"] == "action").to_numpy(dtype=np.int64),
+        "decision_time_ms": decision,
+        "decision_finite": np.isfinite(decision.to_numpy()),
+        "was_backtracked": df["was_backtracked"],
+        "success_flag": df["success_flag"],
+        "completion_time_ms": df["completion_time_ms"],
+    })
+
+    # observed=True: categorical keys would otherwise produce every id combination
+    grouped = work.groupby(keys, dropna=False, observed=True)
+    agg = grouped.agg(
+        ts_min=("timestamp", "min"),
+        ts_max=("timestamp", "max"),
+        attempt_count=("is_start", "sum"),
+        action_count=("is_action", "sum"),
+        mean_decision_time=("decision_time_ms", "mean"),
+        n_finite_decisions=("decision_finite", "sum"),
+        backtrack_ratio=("was_backtracked", "mean"),
+        success_flag=("success_flag", "max"),
+        completion_time_ms=("completion_time_ms", "max"),
+    )
+    agg["session_time"] = _total_seconds(agg["ts_max"] - agg["ts_min"])
+    # sessions whose decision times are all missing or infinite have no mean
+    agg.loc[agg["n_finite_decisions"] == 0, "mean_decision_time"] = np.nan
+    features = agg[[
+        "session_time","attempt_count","action_count","mean_decision_time",
+        "backtrack_ratio","success_flag","completion_time_ms",
+    ]].reset_index()
+    for k in keys:
+        if not isinstance(df[k].dtype, pd.CategoricalDtype):
+            # keys come back with the caller's dtype
+            features[k] = features[k].astype(df[k].dtype)
 
     for c in ["session_time","mean_decision_time","backtrack_ratio","completion_time_ms"]:
         if c in features.columns:
@@ -21,7 +21,7 @@ def per_level_report(df_sessions: pd.DataFrame, model, feat_cols: List[str], out
     global_feat = shap_global_importance(model, X)
     top_features = sorted(global_feat.items(), key=lambda kv: kv[1], reverse=True)[:8] if global_feat else []
 
-    for level_id, g in df.groupby("level_id"):
+    for level_id, g in df.groupby("level_id", observed=True):
         rep = {
             "level_id": str(level_id),
             "n_sessions": int(len(g)),
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import quote
+import pandas as pd
+from .data import DEFAULT_CHUNKSIZE, EVENT_COLUMNS, find_log_files, iter_json_logs
+
+# Local Parquet event store:
+#   <root>/manifest.json                                   ingested source files
+#   <root>/events/level_id=<L>/date=<YYYY-MM-DD>/<part>.parquet
+# Events without a level or timestamp go to the hive null partition.
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+MANIFEST_VERSION = 2
+
+def _pyarrow():
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.dataset as ds  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+    except ImportError as e:
+        raise ImportError("The event store needs pyarrow: pip install -e .[store]") from e
+    return pa, ds, pq
+
+def _event_schema():
+    pa, _, _ = _pyarrow()
+    ids = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("timestamp", pa.timestamp("ns")),
+        ("session_id", ids),
+        ("player_id", ids),
+        ("event_type", ids),
+        ("decision_time_ms", pa.float64()),
+        ("was_backtracked", pa.bool_()),
+        ("success_flag", pa.float64()),
+        ("completion_time_ms", pa.float64()),
+    ])
+
+def _partitioning():
+    pa, ds, _ = _pyarrow()
+    return ds.partitioning(pa.schema([("level_id", pa.string()), ("date", pa.string())]), flavor="hive")
+
+def file_sha256(path: Path, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class EventStore:
+    """
+    Events from .jsonl/.json logs in Parquet, partitioned by level and day.
+
+    The manifest records each ingested file's size, mtime, sha256 and the parts written
+    from it. ingest() only parses files that are new or whose contents changed; the
+    parts of changed and deleted files are replaced or dropped. read() prunes
+    partitions by level and date before any Parquet is decoded.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.events_dir = self.root / "events"
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict:
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+            print(f"Warning: {self.manifest_path} has an unknown version, re-ingesting everything")
+        return {"version": MANIFEST_VERSION, "files": {}}
+
+    def _save_manifest(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    def _drop_parts(self, entry: Dict) -> None:
+        for part in entry.get("parts", []):
+            p = self.events_dir / part
+            if p.exists():
+                p.unlink()
+
+    def _drop_orphans(self) -> None:
+        """Remove parts no manifest entry owns, e.g. left by an interrupted ingest."""
+        owned = {part for entry in self.manifest["files"].values() for part in entry.get("parts", [])}
+        for p in self.events_dir.glob("*/*/*.parquet"):
+            if p.relative_to(self.events_dir).as_posix() not in owned:
+                p.unlink()
+
+    def _write_parts(self, df: pd.DataFrame) -> List[str]:
+        """Write one chunk as a Parquet part per (level, day); returns paths relative to events_dir."""
+        pa, _, pq = _pyarrow()
+        schema = _event_schema()
+        level = df["level_id"].astype(object)
+        date = df["timestamp"].dt.strftime("%Y-%m-%d").astype(object)
+        keys = pd.DataFrame({
+            "level_id": level.where(level.notna(), NULL_PARTITION).map(lambda v: quote(str(v), safe="")),
+            "date": date.where(date.notna(), NULL_PARTITION),
+        })
+        parts = []
+        for (lvl, day), idx in keys.groupby(["level_id", "date"], sort=False).groups.items():
+            rel = Path(f"level_id={lvl}") / f"date={day}" / f"{uuid.uuid4().hex}.parquet"
+            (self.events_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+            part = df.loc[idx, schema.names]
+            for c in part.select_dtypes("category").columns:
+                part[c] = part[c].cat.remove_unused_categories()
+            table = pa.Table.from_pandas(part, schema=schema, preserve_index=False)
+            pq.write_table(table, self.events_dir / rel)
+            parts.append(rel.as_posix())
+        return parts
+
+    def ingest(self, input_path: str, chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, int]:
+        """
+        Bring the store up to date with the logs under `input_path`. A file is parsed again
+        only when its size or mtime changed and its sha256 differs from the manifest.
+        Returns counts of added, changed, unchanged and removed files and of events written.
+        """
+        root = self.root.resolve()
+        files = {
+            str(f.resolve()): f for f in find_log_files(Path(input_path))
+            if root not in f.resolve().parents
+        }
+        known = self.manifest["files"]
+        counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "events": 0, "malformed_lines": 0}
+        self._drop_orphans()
+
+        scope = Path(input_path).resolve()
+        for key in [k for k in known if k not in files and (Path(k) == scope or scope in Path(k).parents)]:
+            self._drop_parts(known.pop(key))
+            counts["removed"] += 1
+
+        for key, f in sorted(files.items()):
+            st = f.stat()
+            entry = known.get(key)
+            if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                counts["unchanged"] += 1
+                continue
+            digest = file_sha256(f)
+            if entry and entry["sha256"] == digest:
+                # touched, not modified
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                counts["unchanged"] += 1
+                continue
+
+            stats: Dict[str, int] = {}
+            parts: List[str] = []
+            events = 0
+            for chunk in iter_json_logs(str(f), chunksize=chunksize, columns=EVENT_COLUMNS, stats=stats):
+                parts += self._write_parts(chunk)
+                events += len(chunk)
+            if entry:
+                self._drop_parts(entry)
+            counts["changed" if entry else "added"] += 1
+            counts["events"] += events
+            counts["malformed_lines"] += stats.get("malformed_lines", 0)
+            known[key] = {
+                "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest,
+                "events": events, "malformed_lines": stats.get("malformed_lines", 0), "parts": parts,
+            }
+            # saved per file, so an interrupted ingest keeps the files already done
+            self._save_manifest()
+
+        self._save_manifest()
+        return counts
+
+    def read(self, levels: Optional[List[str]] = None, start: Optional[str] = None,
+             end: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Events as a typed DataFrame like data.load_json_logs returns. `levels`, and the
+        inclusive ISO dates `start`/`end`, are pushed down to the partition paths, so
+        other levels and days are never opened.
+        """
+        _, ds, _ = _pyarrow()
+        if not self.events_dir.exists():
+            raise ValueError(f"Event store {self.root} is empty. Run `gbt ingest` first.")
+        dataset = ds.dataset(self.events_dir, format="parquet", partitioning=_partitioning())
+        expr = None
+        for cond in [
+            ds.field("level_id").isin([str(l) for l in levels]) if levels else None,
+            ds.field("date") >= str(start) if start else None,
+            ds.field("date") <= str(end) if end else None,
+        ]:
+            if cond is not None:
+                expr = cond if expr is None else expr & cond
+        names = [c for c in (columns or EVENT_COLUMNS) if c != "date"]
+        table = dataset.to_table(columns=names, filter=expr)
+        if table.num_rows == 0:
+            raise ValueError("No events in the store match the level/date filters.")
+
+        df = table.to_pandas()
+        for c in ["session_id", "player_id", "level_id", "event_type"]:
+            if c in df.columns:
+                df[c] = df[c].astype("category")
+        for c in ["decision_time_ms", "success_flag", "completion_time_ms"]:
+            if c in df.columns:
+                df[c] = df[c].astype("Float64")
+        if "was_backtracked" in df.columns:
+            df["was_backtracked"] = df["was_backtracked"].astype("boolean")
+        return df
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from gbt import data
+from gbt.data import generate_synthetic_logs, load_json_logs, write_json_logs
+
+SYNTH_OUTPUT = Path(__file__).resolve().parents[1] / "output_test" / "synthetic_logs.jsonl"
+
+def test_cli_synthetic_logs_load_with_orjson(tmp_path):
+    pytest.importorskip("orjson")
+    assert data._orjson is not None
+    events = generate_synthetic_logs(n_players=5, n_levels=3, n_sessions=20)
+    path = tmp_path / "synthetic_logs.jsonl"
+    write_json_logs(events, path)
+    assert "NaN" not in path.read_text(encoding="utf-8")
+
+    df = load_json_logs(str(path))
+    assert len(df) == len(events)
+    assert df.attrs["malformed_lines"] == 0
+    assert df["decision_time_ms"].notna().sum() == events["decision_time_ms"].notna().sum()
+
+def test_nan_lines_from_older_synthetic_output_load_with_orjson():
+    pytest.importorskip("orjson")
+    df = load_json_logs(str(SYNTH_OUTPUT))
+    assert len(df) == 2639
+    assert df.attrs["malformed_lines"] == 0
+    assert df["success_flag"].notna().any()
+
+def test_mixed_utc_offsets_become_naive_utc(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text(
+        '{"timestamp": "2025-01-01T10:00:00Z", "session_id": "S1", "event_type": "level_start"}\n'
+        '{"timestamp": "2025-01-01T12:00:30+02:00", "session_id": "S1", "event_type": "action"}\n'
+        '{"timestamp": "2025-01-01T10:01:00", "session_id": "S1", "event_type": "level_end"}\n'
+        '{"timestamp": "not a time", "session_id": "S1", "event_type": "action"}\n',
+        encoding="utf-8",
+    )
+    # chunksize 2: each chunk has a different mix of offsets, they still concatenate as datetimes
+    df = load_json_logs(str(path), chunksize=2)
+    assert pd.api.types.is_datetime64_dtype(df["timestamp"])
+    assert getattr(df["timestamp"].dt, "tz", None) is None
+    assert df["timestamp"].iloc[:3].tolist() == [
+        pd.Timestamp("2025-01-01 10:00:00"), pd.Timestamp("2025-01-01 10:00:30"), pd.Timestamp("2025-01-01 10:01:00"),
+    ]
+    assert pd.isna(df["timestamp"].iloc[3])